@@ -0,0 +1,178 @@
+"""
+Load test for the Persona Bot HTTP API against a fake Azure OpenAI server
+Serves api.py from N worker processes sharing one listening socket and one SQLite session store,
+then drives concurrent sessions (create + streamed turns) over HTTP and reports throughput and TTFT
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import FakeOpenAIServer, add_config_arguments, config_from_args
+from load_test import DEFAULT_SCRIPT, FakeCredential, Recorder, percentile
+
+def serve(sock: socket.socket, endpoint: str):
+    """Worker process: build an engine with a static credential and serve the API on the shared socket"""
+    os.environ["AZURE_OPENAI_ENDPOINT"] = endpoint
+    import uvicorn
+    import api
+    from persona_bot import AzureOpenAIClient, PersonaEngine
+
+    api.app.state.engine = PersonaEngine(
+        openai_client=AzureOpenAIClient(credential=FakeCredential()),
+        session_store=api.create_api_session_store()
+    )
+    config = uvicorn.Config(api.app, log_level="warning", access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+def start_workers(workers: int, endpoint: str) -> (List[multiprocessing.Process], str):
+    """Bind one socket and fork the workers that accept on it (the kernel spreads connections)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=serve, args=(sock, endpoint), daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    sock.close()
+
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            if requests.get(f"{base_url}/personas", timeout=5).ok:
+                break
+        except requests.RequestException:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("API workers did not start")
+        time.sleep(0.2)
+    return processes, base_url
+
+def run_session(base_url: str, persona_file: str, script: List[str], recorder: Recorder):
+    """One user: start a session with a persona, then stream each turn"""
+    # No keep-alive: every request may land on a different worker, which reads the session from SQLite
+    started = time.perf_counter()
+    response = requests.post(f"{base_url}/sessions", json={"persona": persona_file}, timeout=60)
+    response.raise_for_status()
+    session_id = response.json()["session_id"]
+    recorder.add("create", time.perf_counter() - started)
+
+    for question in script:
+        started = time.perf_counter()
+        first = None
+        with requests.post(
+            f"{base_url}/sessions/{session_id}/messages", json={"message": question}, stream=True, timeout=60
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: error"):
+                    raise RuntimeError("Streaming reply failed")
+                if first is None and line.startswith("event: delta"):
+                    first = time.perf_counter() - started
+        recorder.add("ttft", first if first is not None else time.perf_counter() - started)
+        recorder.add("turn", time.perf_counter() - started)
+
+def run_load_test(args: argparse.Namespace, workers: int, endpoint: str) -> Dict[str, Any]:
+    os.environ["PERSONA_SESSION_DB"] = os.path.join(tempfile.mkdtemp(prefix="persona-api-"), "sessions.db")
+    processes, base_url = start_workers(workers, endpoint)
+    try:
+        personas = [item["file"] for item in requests.get(f"{base_url}/personas", timeout=10).json()["personas"]]
+        script = (DEFAULT_SCRIPT * args.turns)[:args.turns]
+        rng = random.Random(args.seed)
+        assignments = [rng.choice(personas) for _ in range(args.sessions)]
+        recorder = Recorder()
+        recorder.timings = {"create": [], "ttft": [], "turn": []}
+
+        def guarded(persona_file: str):
+            try:
+                run_session(base_url, persona_file, script, recorder)
+            except Exception:
+                recorder.error()
+
+        threads = [threading.Thread(target=guarded, args=(persona_file,)) for persona_file in assignments]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(10)
+
+    report: Dict[str, Any] = {
+        "workers": workers,
+        "sessions": args.sessions,
+        "turns_per_session": len(script),
+        "elapsed_seconds": round(elapsed, 3),
+        "turns_per_second": round(recorder.turns / elapsed, 2) if elapsed else 0.0,
+        "errors": recorder.errors,
+        "latency_ms": {},
+    }
+    for name, values in recorder.timings.items():
+        report["latency_ms"][name] = {
+            "count": len(values),
+            "p50": round(percentile(values, 50) * 1000, 1),
+            "p95": round(percentile(values, 95) * 1000, 1),
+            "p99": round(percentile(values, 99) * 1000, 1),
+        }
+    return report
+
+def print_report(report: Dict[str, Any]):
+    print(f"\nWorkers: {report['workers']} | sessions: {report['sessions']} | turns/session: {report['turns_per_session']}")
+    print(f"Elapsed: {report['elapsed_seconds']}s | throughput: {report['turns_per_second']} turns/s | errors: {report['errors']}")
+    print("-" * 60)
+    print(f"{'operation':<14}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for name, stats in report["latency_ms"].items():
+        print(f"{name:<14}{stats['count']:>8}{stats['p50']:>12}{stats['p95']:>12}{stats['p99']:>12}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the Persona Bot HTTP API against a fake Azure OpenAI server")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2], help="Worker process counts to compare")
+    parser.add_argument("--sessions", type=int, default=50, help="Concurrent sessions")
+    parser.add_argument("--turns", type=int, default=4, help="Streamed turns per session")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", dest="json_path", help="Also write the reports to this JSON file")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    os.environ.setdefault("PERSONA_HOT_RELOAD", "false")
+    os.environ["PERSONA_SESSION_STORE"] = "sqlite"
+
+    reports = []
+    with FakeOpenAIServer(config_from_args(args)) as server:
+        for workers in args.workers:
+            reports.append(run_load_test(args, workers, server.endpoint))
+            print_report(reports[-1])
+        print("-" * 60)
+        print(f"Fake server: {server.stats.snapshot()}")
+    print(f"\nCPUs available: {os.cpu_count()}")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(reports, indent=2), encoding="utf-8")
+    failed = [report for report in reports if report["errors"]]
+    for report in failed:
+        print(f"❌ {report['errors']} sessions failed with {report['workers']} worker(s)")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Batch runner benchmark against a fake Azure OpenAI server
+Answers a persona × question matrix at several concurrency levels (optionally under a requests-per-minute
+quota), then interrupts a run halfway and resumes it from its JSONL output
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import FakeOpenAIServer, add_config_arguments, config_from_args
+from load_test import FakeCredential
+
+def write_questions(path: str, count: int, turns: int):
+    with open(path, "w", encoding="utf-8") as f:
+        for index in range(count):
+            script = [f"Pergunta {index}-{turn}: como a sua equipe decide o que fazer primeiro?" for turn in range(turns)]
+            f.write(json.dumps({"id": f"q{index}", "turns": script}, ensure_ascii=False) + "\n")
+
+# Clients of finished levels. Dropping one lets the garbage collector close its sockets behind the
+# background loop's back, and a new connection reusing the descriptor then never sees it become writable
+_clients: List[Any] = []
+
+def make_runner(concurrency: int) -> Any:
+    # The client sizes its limiters from the environment when it is created
+    os.environ["PERSONA_MAX_CONCURRENT_REQUESTS"] = str(concurrency)
+    from batch import BatchRunner
+    from persona_bot import AzureOpenAIClient, PersonaLoader, PromptBuilder
+
+    client = AzureOpenAIClient(credential=FakeCredential())
+    _clients.append(client)
+    return BatchRunner(client, PersonaLoader(), PromptBuilder(), concurrency=concurrency, timeout=60.0)
+
+def run_level(args: argparse.Namespace, directory: str, questions: str, personas: List[str], concurrency: int,
+              name: str = None) -> Dict[str, Any]:
+    from batch import ResultLog, read_questions
+    from concurrency import get_background_loop
+
+    runner = make_runner(concurrency)
+    log = ResultLog(os.path.join(directory, f"answers-{name or concurrency}.jsonl"))
+    started = time.perf_counter()
+    try:
+        stats = get_background_loop().run(runner.run(read_questions(questions), personas, log, log.load()))
+    finally:
+        log.close()
+    elapsed = time.perf_counter() - started
+    return {"concurrency": concurrency, "seconds": round(elapsed, 2),
+            "items_per_second": round(stats["ok"] / elapsed, 2), "stats": stats}
+
+def run_resume(args: argparse.Namespace, directory: str, questions: str, personas: List[str]) -> Dict[str, Any]:
+    """Stop a run after half its expected time, rerun it and check every item is answered exactly once"""
+    from batch import ResultLog, read_questions
+    from concurrency import get_background_loop
+
+    loop = get_background_loop()
+    path = os.path.join(directory, "answers-resume.jsonl")
+    expected = args.questions * len(personas)
+
+    async def interrupted(runner, log, done, seconds):
+        try:
+            await asyncio.wait_for(runner.run(read_questions(questions), personas, log, done), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    full = run_level(args, directory, questions, personas, args.resume_concurrency, name="full")
+    log = ResultLog(path)
+    loop.run(interrupted(make_runner(args.resume_concurrency), log, log.load(), full["seconds"] / 2))
+    log.close()
+    # Simulate a record cut off by a hard kill
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"persona": "half-writ')
+    first = sum(1 for _ in open(path, encoding="utf-8")) - 1
+
+    log = ResultLog(path)
+    done = log.load()
+    started = time.perf_counter()
+    stats = loop.run(make_runner(args.resume_concurrency).run(read_questions(questions), personas, log, done))
+    log.close()
+    resumed = time.perf_counter() - started
+
+    records = [json.loads(line) for line in open(path, encoding="utf-8")]
+    # Failed items are retried by the rerun, so only answered items must be unique
+    keys = [(record["persona"], record["question_id"]) for record in records if record["status"] == "ok"]
+    return {
+        "expected": expected,
+        "first_run_items": first,
+        "resumed_skipped": stats["skipped"],
+        "resumed_answered": stats["ok"],
+        "resumed_seconds": round(resumed, 2),
+        "full_run_seconds": full["seconds"],
+        "records": len(records),
+        "duplicates": len(keys) - len(set(keys)),
+        "complete": len(set(keys)) == expected,
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure batch runner throughput by concurrency and check resuming")
+    parser.add_argument("--questions", type=int, default=24, help="Questions in the generated question file")
+    parser.add_argument("--turns", type=int, default=2, help="Turns per question")
+    parser.add_argument("--personas", type=int, default=4, help="Personas to ask")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64], help="Concurrency levels")
+    parser.add_argument("--rpm", type=int, default=0,
+                        help="Requests-per-minute quota of the deployment (the bucket starts full: one minute of burst)")
+    parser.add_argument("--resume-concurrency", type=int, default=16, help="Concurrency of the resume check")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    os.environ.setdefault("PERSONA_HOT_RELOAD", "false")
+    os.environ["AZURE_OPENAI_RPM"] = str(args.rpm)
+
+    with FakeOpenAIServer(config_from_args(args)) as server, tempfile.TemporaryDirectory() as directory:
+        os.environ["AZURE_OPENAI_ENDPOINT"] = server.endpoint
+        from persona_bot import PersonaLoader
+
+        personas = PersonaLoader().list_available_personas()[:args.personas]
+        questions = os.path.join(directory, "questions.jsonl")
+        write_questions(questions, args.questions, args.turns)
+        levels = [run_level(args, directory, questions, personas, level) for level in args.levels]
+        resume = run_resume(args, directory, questions, personas)
+        upstream = server.stats.snapshot()["requests"]
+
+    items = args.questions * len(personas)
+    quota = f", quota {args.rpm} rpm = {args.rpm / 60 / args.turns:.1f} items/s" if args.rpm else ""
+    print(f"\n{items} items ({len(personas)} personas × {args.questions} questions × {args.turns} turns){quota}")
+    for level in levels:
+        print(f"concurrency {level['concurrency']:>3}: {level['seconds']:>6}s  {level['items_per_second']:>6} items/s  "
+              f"({level['stats']['failed']} failed)")
+    print(f"Resume: {resume['first_run_items']} items before the interruption, {resume['resumed_skipped']} skipped and "
+          f"{resume['resumed_answered']} answered on rerun in {resume['resumed_seconds']}s "
+          f"(full run {resume['full_run_seconds']}s); {resume['records']} records, {resume['duplicates']} duplicates, "
+          f"complete: {resume['complete']}")
+    print(f"Upstream requests: {upstream}")
+    return 0 if resume["complete"] and not resume["duplicates"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
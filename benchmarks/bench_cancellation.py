@@ -0,0 +1,145 @@
+"""
+Cancellation benchmark against a fake Azure OpenAI server
+Simulates users who leave in the middle of an answer (closed tab, Streamlit rerun) or send their
+next message before the reply finished, with a per-request deadline, and reports the completion
+tokens the server really generated against what the same requests would have cost unstopped
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import FakeOpenAIServer, add_config_arguments, config_from_args
+from load_test import FakeCredential, percentile
+
+def run_benchmark(args: argparse.Namespace, server: FakeOpenAIServer) -> Dict[str, Any]:
+    os.environ["AZURE_OPENAI_ENDPOINT"] = server.endpoint
+    from persona_bot import AzureOpenAIClient, PersonaBot, PersonaEngine
+    from deadline import CancelToken
+    import metrics
+
+    engine = PersonaEngine(openai_client=AzureOpenAIClient(credential=FakeCredential()))
+    personas = engine.list_available_personas()
+    rng = random.Random(args.seed)
+    outcomes = {"completed": 0, "abandoned": 0, "superseded": 0}
+    turn_seconds: List[float] = []
+    lock = threading.Lock()
+
+    def read(stream, stop_after: int = None, started_reading: threading.Event = None):
+        started = time.perf_counter()
+        for index, _ in enumerate(stream):
+            if started_reading is not None and index + 1 >= stop_after:
+                started_reading.set()
+            elif stop_after is not None and started_reading is None and index + 1 >= stop_after:
+                # The tab was closed or the script rerun: the reader goes away
+                stream.close()
+                break
+        with lock:
+            turn_seconds.append(time.perf_counter() - started)
+        if started_reading is not None:
+            started_reading.set()
+
+    def session(index: int):
+        bot = PersonaBot(engine)
+        bot.load_persona(personas[index % len(personas)])
+        superseded = []
+        for turn in range(args.turns):
+            question = f"Pergunta {index}-{turn}: o que mais atrapalha o seu trabalho hoje?"
+            with lock:
+                roll = rng.random()
+                stop_after = rng.randint(1, max(1, args.completion_tokens // 2))
+            stream = bot.chat_stream(question, cancel=CancelToken(args.deadline))
+            if roll < args.abandon_rate:
+                outcome = "abandoned"
+                read(stream, stop_after)
+            elif roll < args.abandon_rate + args.supersede_rate and turn < args.turns - 1:
+                # Keep reading on another thread and send the next message meanwhile
+                outcome = "superseded"
+                started_reading = threading.Event()
+                reader = threading.Thread(target=read, args=(stream, stop_after, started_reading))
+                reader.start()
+                started_reading.wait()
+                superseded.append(reader)
+            else:
+                outcome = "completed"
+                read(stream)
+            with lock:
+                outcomes[outcome] += 1
+        for reader in superseded:
+            reader.join()
+
+    before = server.stats.snapshot()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(index,)) for index in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    # Let the server notice the last closed connections
+    time.sleep(0.5)
+    after = server.stats.snapshot()
+
+    # Unstopped, every turn would have cost a whole completion, including the requests that never left the client
+    completion_tokens = min(args.completion_tokens, int(os.getenv("AZURE_OPENAI_MAX_TOKENS", "500")))
+    requested = args.sessions * args.turns * completion_tokens
+    generated = after["generated_tokens"] - before["generated_tokens"]
+    cancelled = {}
+    for labels, value in metrics.CANCELLED_TOTAL.snapshot().items():
+        reason = labels.split('reason="')[1].split('"')[0]
+        cancelled[reason] = cancelled.get(reason, 0) + int(value)
+    return {
+        "sessions": args.sessions,
+        "turns": args.sessions * args.turns,
+        "deadline_seconds": args.deadline,
+        "outcomes": outcomes,
+        "elapsed_seconds": round(elapsed, 3),
+        "turn_seconds": {pct: round(percentile(turn_seconds, pct), 3) for pct in (50, 99, 100)},
+        "upstream_requests": after["requests"] - before["requests"],
+        "disconnected": after["disconnected"] - before["disconnected"],
+        "completion_tokens_unstopped": requested,
+        "completion_tokens_generated": generated,
+        "completion_tokens_saved": requested - generated,
+        "estimated_saved": int(sum(metrics.CANCELLED_TOKENS.snapshot().values())),
+        "cancelled_by_reason": cancelled,
+        "requests": engine.requests.stats(),
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure the tokens saved by cancelling abandoned and superseded replies")
+    parser.add_argument("--sessions", type=int, default=30, help="Concurrent sessions")
+    parser.add_argument("--turns", type=int, default=4, help="Messages per session")
+    parser.add_argument("--abandon-rate", type=float, default=0.25, help="Fraction of replies the user leaves halfway")
+    parser.add_argument("--supersede-rate", type=float, default=0.15, help="Fraction of replies interrupted by the next message")
+    parser.add_argument("--deadline", type=float, default=6.0, help="Deadline of each request in seconds")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed of the simulated users")
+    add_config_arguments(parser)
+    parser.set_defaults(latency_jitter_ms=150.0)
+    args = parser.parse_args()
+    os.environ.setdefault("PERSONA_HOT_RELOAD", "false")
+    # Repeated questions would otherwise be answered from the caches
+    os.environ["PERSONA_RESPONSE_CACHE_ENABLED"] = "false"
+    os.environ["PERSONA_INTRO_CACHE_ENABLED"] = "false"
+
+    with FakeOpenAIServer(config_from_args(args)) as server:
+        report = run_benchmark(args, server)
+
+    print(f"\nSessions: {report['sessions']} | turns: {report['turns']} | deadline: {report['deadline_seconds']:g}s | elapsed: {report['elapsed_seconds']}s")
+    print(f"Replies: {report['outcomes']}")
+    print(f"Turn time p50/p99/max: {report['turn_seconds'][50]} / {report['turn_seconds'][99]} / {report['turn_seconds'][100]} s")
+    print(f"Upstream requests: {report['upstream_requests']} ({report['disconnected']} closed early)")
+    print(f"Completion tokens: {report['completion_tokens_generated']} generated of {report['completion_tokens_unstopped']} "
+          f"unstopped ({report['completion_tokens_saved']} saved; the client estimated {report['estimated_saved']})")
+    print(f"Cancelled by reason: {report['cancelled_by_reason']} | tracker: {report['requests']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Coalesced stream abandonment check against a fake Azure OpenAI server
+A leader and followers share one upstream stream and all stop reading after the first delta, in both
+orders (followers first, leader first), for the sync and the async client; fails if the shared stream
+keeps generating for nobody
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import FakeOpenAIServer, FakeServerConfig
+from load_test import FakeCredential
+
+SYSTEM_PROMPT = "Você é uma persona de teste."
+
+def run_sync(client, question: str, followers: int, leader_first: bool):
+    """Leader reads one delta, followers join and read one, then everybody closes"""
+    leader = client.complete_stream(SYSTEM_PROMPT, question)
+    next(leader)
+    streams = [client.complete_stream(SYSTEM_PROMPT, question) for _ in range(followers)]
+    joined = threading.Barrier(followers + 1)
+
+    def follow(stream):
+        next(stream)
+        joined.wait()
+        if leader_first:
+            left.wait()
+        stream.close()
+
+    left = threading.Event()
+    threads = [threading.Thread(target=follow, args=(stream,)) for stream in streams]
+    for thread in threads:
+        thread.start()
+    joined.wait()
+    if leader_first:
+        leader.close()
+        left.set()
+        for thread in threads:
+            thread.join()
+    else:
+        for thread in threads:
+            thread.join()
+        leader.close()
+
+async def run_async(client, question: str, followers: int, leader_first: bool):
+    leader = client.acomplete_stream(SYSTEM_PROMPT, question)
+    await leader.__anext__()
+    streams = [client.acomplete_stream(SYSTEM_PROMPT, question) for _ in range(followers)]
+    for stream in streams:
+        await stream.__anext__()
+    if leader_first:
+        await leader.aclose()
+    for stream in streams:
+        await stream.aclose()
+    if not leader_first:
+        await leader.aclose()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check that abandoned coalesced streams stop generating")
+    parser.add_argument("--followers", type=int, default=1, help="Followers sharing the leader's stream")
+    parser.add_argument("--completion-tokens", type=int, default=100, help="Tokens per completion")
+    parser.add_argument("--chunk-interval-ms", type=float, default=20.0, help="Delay between streamed tokens")
+    args = parser.parse_args()
+    os.environ.setdefault("PERSONA_HOT_RELOAD", "false")
+    os.environ["AZURE_OPENAI_COALESCE_REQUESTS"] = "true"
+
+    config = FakeServerConfig(latency_ms=50.0, latency_jitter_ms=0.0, chunk_interval_ms=args.chunk_interval_ms,
+                              completion_tokens=args.completion_tokens)
+    results: List[Dict[str, object]] = []
+    with FakeOpenAIServer(config) as server:
+        os.environ["AZURE_OPENAI_ENDPOINT"] = server.endpoint
+        from concurrency import get_background_loop
+        from persona_bot import AzureOpenAIClient
+
+        client = AzureOpenAIClient(credential=FakeCredential())
+        for mode in ("sync", "async"):
+            for leader_first in (False, True):
+                question = f"{mode} {'leader' if leader_first else 'followers'} first: quais são seus desafios?"
+                before = server.stats.snapshot()
+                if mode == "sync":
+                    run_sync(client, question, args.followers, leader_first)
+                else:
+                    get_background_loop().run(run_async(client, question, args.followers, leader_first))
+                # Let the server notice the closed connection, or finish generating if nobody closed it
+                time.sleep(args.completion_tokens * args.chunk_interval_ms / 1000 + 0.5)
+                after = server.stats.snapshot()
+                results.append({
+                    "case": f"{mode}, {'leader' if leader_first else 'followers'} closed first",
+                    "requests": after["requests"] - before["requests"],
+                    "generated": after["generated_tokens"] - before["generated_tokens"],
+                })
+
+    failed = False
+    for result in results:
+        # Everybody left after one delta: most of the completion must never have been generated
+        ok = result["requests"] == 1 and result["generated"] < args.completion_tokens / 2
+        failed = failed or not ok
+        print(f"{result['case']:<32} upstream requests: {result['requests']}  tokens generated: "
+              f"{result['generated']}/{args.completion_tokens}  {'ok' if ok else 'FAILED'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
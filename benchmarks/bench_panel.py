@@ -0,0 +1,83 @@
+"""
+Panel benchmark against a fake Azure OpenAI server
+Asks the same question to N personas one after another and then as a panel, and compares
+the panel's wall-clock time with the sum and with the slowest single answer
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import FakeOpenAIServer, add_config_arguments, config_from_args
+from load_test import FakeCredential
+
+QUESTION = "Quais são seus principais desafios hoje?"
+
+def run_benchmark(args: argparse.Namespace, endpoint: str) -> Dict[str, float]:
+    os.environ["AZURE_OPENAI_ENDPOINT"] = endpoint
+    from persona_bot import AzureOpenAIClient, PersonaBot, PersonaEngine
+    from concurrency import get_background_loop
+    from panel import PersonaPanel
+
+    engine = PersonaEngine(openai_client=AzureOpenAIClient(credential=FakeCredential()))
+    personas = engine.list_available_personas()[:args.personas]
+    loop = get_background_loop()
+
+    # One persona after another: what a facilitator does without the panel
+    single = []
+    started = time.perf_counter()
+    for persona_file in personas:
+        bot = PersonaBot(engine)
+        bot.load_persona(persona_file)
+        answer_started = time.perf_counter()
+        for _ in loop.iterate(bot.achat_stream(QUESTION)):
+            pass
+        single.append(time.perf_counter() - answer_started)
+    sequential = time.perf_counter() - started
+
+    panel = PersonaPanel(engine, personas)
+    first_delta = None
+    started = time.perf_counter()
+    for delta in panel.ask(QUESTION):
+        if first_delta is None and delta.text:
+            first_delta = time.perf_counter() - started
+    parallel = time.perf_counter() - started
+
+    return {
+        "personas": len(personas),
+        "sequential_seconds": round(sequential, 3),
+        "slowest_single_seconds": round(max(single), 3),
+        "panel_seconds": round(parallel, 3),
+        "panel_first_delta_seconds": round(first_delta or 0.0, 3),
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare a persona panel with asking each persona in turn")
+    parser.add_argument("--personas", type=int, default=6, help="Personas on the panel")
+    parser.add_argument("--endpoint", help="Use an already running (fake) server instead of starting one")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    os.environ.setdefault("PERSONA_HOT_RELOAD", "false")
+    os.environ.setdefault("PERSONA_PANEL_MAX_PERSONAS", str(args.personas))
+    # Repeated questions would otherwise be answered from the cache
+    os.environ["PERSONA_RESPONSE_CACHE_ENABLED"] = "false"
+
+    if args.endpoint:
+        report = run_benchmark(args, args.endpoint)
+    else:
+        with FakeOpenAIServer(config_from_args(args)) as server:
+            report = run_benchmark(args, server.endpoint)
+
+    print(f"\nPersonas: {report['personas']}")
+    print(f"One after another: {report['sequential_seconds']}s (slowest single answer {report['slowest_single_seconds']}s)")
+    print(f"Panel:             {report['panel_seconds']}s (first delta after {report['panel_first_delta_seconds']}s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Persona loading benchmark
+Compares cold start (index every persona) and per-load times for pure-Python YAML, libyaml and the persona bundle
+"""
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+
+import bundle as bundle_module
+from bundle import BUNDLE_FILENAME, PersonaBundle, build_bundle, write_bundle
+from catalog import PersonaCatalog
+
+def make_personas(directory: str, count: int):
+    """Write count personas derived from the ones in bots/"""
+    sources = [path.read_text(encoding="utf-8") for path in sorted((ROOT / "bots").glob("*.yaml"))]
+    for index in range(count):
+        text = sources[index % len(sources)].replace("name: ", f"name: P{index:05d} ", 1)
+        Path(directory, f"persona-{index:05d}.yaml").write_text(text, encoding="utf-8")
+
+def time_it(function: Callable[[], object], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    workdir = tempfile.mkdtemp(prefix="persona-bench-")
+    try:
+        bots = os.path.join(workdir, "bots")
+        os.mkdir(bots)
+        make_personas(bots, args.personas)
+        bundle_path = os.path.join(workdir, BUNDLE_FILENAME)
+        write_bundle(build_bundle(bots, str(ROOT / "templates" / "prompt-template.txt")), bundle_path)
+        files = sorted(os.listdir(bots))[:args.loads]
+
+        def load_with(loader, persona_bundle):
+            def load():
+                for persona_file in files:
+                    text = Path(bots, persona_file).read_text(encoding="utf-8")
+                    file_hash = bundle_module.content_hash(text)
+                    config = persona_bundle.lookup(persona_file, file_hash) if persona_bundle else None
+                    if config is None:
+                        yaml.load(text, Loader=loader)
+            return load
+
+        results = {}
+        for name, loader, use_bundle in (
+            ("yaml (pure Python)", yaml.SafeLoader, False),
+            ("yaml (libyaml)", getattr(yaml, "CSafeLoader", None), False),
+            ("bundle", getattr(yaml, "CSafeLoader", yaml.SafeLoader), True),
+        ):
+            if loader is None:
+                print(f"Skipping {name}: PyYAML was built without libyaml")
+                continue
+            bundle_module.SafeLoader = loader
+
+            def cold_start():
+                persona_bundle = PersonaBundle.load(bundle_path) if use_bundle else None
+                PersonaCatalog(bots, bundle=persona_bundle).files()
+
+            cold = time_it(cold_start, args.repeat)
+            persona_bundle = PersonaBundle.load(bundle_path) if use_bundle else None
+            per_load = time_it(load_with(loader, persona_bundle), args.repeat)
+            results[name] = {
+                "cold_start_ms": statistics.median(cold) * 1000,
+                "per_load_ms": statistics.median(per_load) * 1000 / max(1, len(files)),
+            }
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark persona loading paths")
+    parser.add_argument("--personas", type=int, default=500, help="Synthetic personas to generate")
+    parser.add_argument("--loads", type=int, default=50, help="Personas loaded in the per-load measurement")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions (the median is reported)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = run(args)
+    print(f"\n{args.personas} personas (OS file cache warm)")
+    print("-" * 60)
+    print(f"{'path':<22}{'cold start ms':>18}{'per load ms':>18}")
+    for name, stats in results.items():
+        print(f"{name:<22}{stats['cold_start_ms']:>18.1f}{stats['per_load_ms']:>18.3f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Routing benchmark against several fake Azure OpenAI servers
+Starts a pool of fake deployments (a fast one, one with a long latency tail and one that
+fails halfway through the run), streams requests through the router with hedging off and on,
+and reports how requests were spread, time-to-first-token percentiles and circuit ejections
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import FakeOpenAIServer, FakeServerConfig
+from load_test import FakeCredential, percentile
+
+SYSTEM_PROMPT = "Você é uma persona de teste."
+
+def make_servers(args: argparse.Namespace) -> Dict[str, FakeOpenAIServer]:
+    return {
+        "fast": FakeOpenAIServer(FakeServerConfig(latency_ms=args.latency_ms, latency_jitter_ms=args.latency_ms / 4,
+                                                  chunk_interval_ms=5, completion_tokens=40)),
+        # Usually as fast, but with a long tail: the case hedging is for
+        "tail": FakeOpenAIServer(FakeServerConfig(latency_ms=args.latency_ms, latency_jitter_ms=args.tail_ms,
+                                                  chunk_interval_ms=5, completion_tokens=40)),
+        # Healthy until half the requests were sent, then answers every request with HTTP 500
+        "flaky": FakeOpenAIServer(FakeServerConfig(latency_ms=args.latency_ms, latency_jitter_ms=args.latency_ms / 4,
+                                                   chunk_interval_ms=5, completion_tokens=40)),
+    }
+
+def run_scenario(args: argparse.Namespace, servers: Dict[str, FakeOpenAIServer], hedge_delay_ms: float) -> Dict[str, Any]:
+    os.environ["AZURE_OPENAI_DEPLOYMENTS"] = json.dumps([
+        {"name": name, "endpoint": server.endpoint, "deployment": "gpt-4o-mini"} for name, server in servers.items()
+    ])
+    os.environ["AZURE_OPENAI_HEDGE_DELAY_MS"] = str(hedge_delay_ms)
+    from persona_bot import AzureOpenAIClient
+    from concurrency import get_background_loop
+
+    for server in servers.values():
+        server.config.error_rate = 0.0
+    before = {name: server.stats.snapshot() for name, server in servers.items()}
+    client = AzureOpenAIClient(credential=FakeCredential())
+    ttft: List[float] = []
+    errors = 0
+
+    async def one(index: int):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            first = None
+            # A distinct question per request, so nothing is coalesced
+            async for _ in client.acomplete_stream(SYSTEM_PROMPT, f"Pergunta {index}", persona="bench"):
+                if first is None:
+                    first = time.perf_counter() - started
+            ttft.append(first or time.perf_counter() - started)
+        except Exception:
+            errors += 1
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def guarded(index: int):
+            async with semaphore:
+                if index == args.requests // 2:
+                    servers["flaky"].config.error_rate = 1.0
+                await one(index)
+
+        await asyncio.gather(*(guarded(index) for index in range(args.requests)))
+
+    started = time.perf_counter()
+    get_background_loop().run(run_all())
+    elapsed = time.perf_counter() - started
+
+    sent = {name: server.stats.snapshot()["requests"] - before[name]["requests"] for name, server in servers.items()}
+    return {
+        "hedge_delay_ms": hedge_delay_ms,
+        "requests": args.requests,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "upstream_requests": sent,
+        "ttft_ms": {pct: round(percentile(ttft, pct) * 1000, 1) for pct in (50, 95, 99)},
+        "router": client.router.stats(),
+        "ejections": {deployment.name: deployment.health.ejections for deployment in client.router.deployments},
+    }
+
+def print_report(report: Dict[str, Any]):
+    hedging = f"{report['hedge_delay_ms']:g} ms" if report["hedge_delay_ms"] else "off"
+    print(f"\nHedging: {hedging} | requests: {report['requests']} | errors: {report['errors']} | elapsed: {report['elapsed_seconds']}s")
+    ttft = report["ttft_ms"]
+    print(f"TTFT p50/p95/p99: {ttft[50]} / {ttft[95]} / {ttft[99]} ms")
+    print(f"Upstream requests per deployment: {report['upstream_requests']}")
+    print(f"Router: {report['router']} | circuit ejections: {report['ejections']}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare deployment routing with and without hedged requests")
+    parser.add_argument("--requests", type=int, default=300, help="Streamed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=12, help="Requests in flight at once")
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Typical time to first token of every fake deployment")
+    parser.add_argument("--tail-ms", type=float, default=2000.0, help="Latency jitter of the long-tail deployment")
+    parser.add_argument("--hedge-ms", type=float, default=400.0, help="Hedge delay of the second scenario")
+    parser.add_argument("--hedge-max-ratio", type=float, default=0.2, help="Maximum fraction of hedged requests")
+    parser.add_argument("--json", dest="json_path", help="Also write the reports to this JSON file")
+    args = parser.parse_args()
+    os.environ.setdefault("PERSONA_HOT_RELOAD", "false")
+    os.environ["AZURE_OPENAI_HEDGE_MAX_RATIO"] = str(args.hedge_max_ratio)
+    # Short cooldown so the failed deployment is probed again during the run
+    os.environ.setdefault("AZURE_OPENAI_CIRCUIT_COOLDOWN_SECONDS", "2")
+
+    servers = make_servers(args)
+    for server in servers.values():
+        server.start()
+    try:
+        reports = [run_scenario(args, servers, 0), run_scenario(args, servers, args.hedge_ms)]
+    finally:
+        for server in servers.values():
+            server.stop()
+    for report in reports:
+        print_report(report)
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(reports, indent=2), encoding="utf-8")
+    return 1 if any(report["errors"] for report in reports) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
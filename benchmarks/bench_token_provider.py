@@ -0,0 +1,147 @@
+"""
+Entra ID token caching check
+Counts the credential's get_token calls for concurrent chats against a fake Azure OpenAI server, and, on
+a simulated clock, for a cold start, a concurrent refresh-ahead and a refresh that fails; exits 1 if
+the token provider calls the credential more than once per token lifetime, retries a failed refresh
+before its backoff or drops the cached token
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import FakeOpenAIServer, FakeServerConfig
+from load_test import FakeCredential
+
+LIFETIME = 3600
+BACKOFF = 30
+
+class ScriptedCredential(FakeCredential):
+    """Counting credential on a simulated clock, with a slow round-trip and switchable failures"""
+
+    def __init__(self, clock: Callable[[], float], delay: float):
+        super().__init__()
+        self.clock = clock
+        self.delay = delay
+        self.fail = False
+
+    def get_token(self, *scopes: str) -> Any:
+        with self._lock:
+            self.calls += 1
+            number = self.calls
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("Entra ID unavailable")
+
+        class _Token:
+            token = f"token-{number}"
+            expires_on = self.clock() + LIFETIME
+        return _Token()
+
+def call_concurrently(callers: int, call: Callable[[], Any]) -> List[Any]:
+    """Run call on callers threads released at the same moment"""
+    results: List[Any] = [None] * callers
+    start = threading.Barrier(callers)
+
+    def run(index: int):
+        start.wait()
+        results[index] = call()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def check_chats(args: argparse.Namespace) -> Dict[str, Any]:
+    """N concurrent chats through the real client share one token"""
+    with FakeOpenAIServer(FakeServerConfig(latency_ms=50.0, chunk_interval_ms=1.0)) as server:
+        os.environ["AZURE_OPENAI_ENDPOINT"] = server.endpoint
+        from persona_bot import AzureOpenAIClient
+
+        credential = FakeCredential()
+        client = AzureOpenAIClient(credential=credential)
+        call_concurrently(args.callers, lambda: client.complete("Você é uma persona de teste.", "Olá, tudo bem?"))
+    return {"case": f"{args.callers} concurrent chats", "calls": credential.calls, "expected": 1}
+
+def check_provider(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Cold start, refresh-ahead and a failed refresh on a simulated clock"""
+    from token_provider import CachedTokenProvider
+
+    now = [1_000_000.0]
+    credential = ScriptedCredential(lambda: now[0], args.credential_delay)
+    provider = CachedTokenProvider(credential, refresh_margin=300.0, min_validity=30.0, refresh_backoff=BACKOFF,
+                                   clock=lambda: now[0])
+
+    def wait_for_background_refresh():
+        deadline = time.monotonic() + 10
+        while provider._background_refresh_running and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    results = []
+    tokens = call_concurrently(args.callers, provider.get_token)
+    results.append({"case": f"cold start, {args.callers} callers", "calls": credential.calls, "expected": 1,
+                    "ok": set(tokens) == {"token-1"}})
+
+    # Inside the refresh window: everybody keeps the current token while one background refresh runs
+    now[0] += LIFETIME - 200
+    tokens = call_concurrently(args.callers, provider.get_token)
+    wait_for_background_refresh()
+    tokens_after = call_concurrently(args.callers, provider.get_token)
+    results.append({"case": f"refresh-ahead, {args.callers} callers", "calls": credential.calls, "expected": 2,
+                    "ok": set(tokens) == {"token-1"} and set(tokens_after) == {"token-2"}})
+
+    # The refresh fails: the old token is still served and the failure is counted
+    now[0] += LIFETIME - 200
+    credential.fail = True
+    failures_before = provider.metrics()["refresh_failures"]
+    tokens = call_concurrently(args.callers, provider.get_token)
+    wait_for_background_refresh()
+    failures = provider.metrics()["refresh_failures"] - failures_before
+    results.append({"case": f"failed refresh, {args.callers} callers", "calls": credential.calls, "expected": 3,
+                    "ok": set(tokens) == {"token-2"} and failures == 1, "failures": failures})
+
+    # Inside the backoff nobody calls the failing credential again
+    now[0] += BACKOFF / 2
+    tokens = call_concurrently(args.callers, provider.get_token)
+    wait_for_background_refresh()
+    results.append({"case": f"backoff after failure, {args.callers} callers", "calls": credential.calls, "expected": 3,
+                    "ok": set(tokens) == {"token-2"}})
+
+    # The credential recovers: the next caller after the backoff refreshes again
+    credential.fail = False
+    now[0] += BACKOFF
+    provider.get_token()
+    wait_for_background_refresh()
+    results.append({"case": "recovery after the failure", "calls": credential.calls, "expected": 4,
+                    "ok": provider.get_token() == "token-4"})
+    return results
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Count Entra ID token requests under concurrency")
+    parser.add_argument("--callers", type=int, default=50, help="Concurrent chats / token callers")
+    parser.add_argument("--credential-delay", type=float, default=0.2,
+                        help="Seconds a (simulated) credential round-trip takes")
+    args = parser.parse_args()
+    os.environ.setdefault("PERSONA_HOT_RELOAD", "false")
+
+    results = [check_chats(args)] + check_provider(args)
+    failed = False
+    for result in results:
+        ok = result["calls"] == result["expected"] and result.get("ok", True)
+        failed = failed or not ok
+        extra = f", {result['failures']} refresh failure(s) counted" if "failures" in result else ""
+        print(f"{result['case']:<36} get_token calls: {result['calls']} (expected {result['expected']}){extra}  "
+              f"{'ok' if ok else 'FAILED'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+Fake Azure OpenAI server for load tests
+An OpenAI-compatible chat completions endpoint with configurable latency, streaming cadence and failures
+"""
+import argparse
+import collections
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+LOREM = (
+    "Nosso maior desafio hoje e transformar dados em decisoes rapidas. Temos informacao espalhada "
+    "em varios sistemas e pouca confianca na qualidade. Queremos testar IA em casos concretos, "
+    "medir resultados e escalar o que funcionar sem aumentar a complexidade da operacao."
+).split()
+
+class FakeServerConfig:
+    """Behaviour of the fake server; every field can be changed while it runs"""
+
+    def __init__(self, latency_ms: float = 200.0, latency_jitter_ms: float = 50.0,
+                 chunk_interval_ms: float = 20.0, completion_tokens: int = 120,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, retry_after_ms: int = 1000,
+                 prompt_cache: bool = True):
+        """
+        Args:
+            latency_ms: Mean time before the first token (or the full response)
+            latency_jitter_ms: Uniform jitter added to latency_ms
+            chunk_interval_ms: Delay between streamed chunks (one token per chunk)
+            completion_tokens: Tokens per completion (capped by the request's max_tokens)
+            error_rate: Fraction of requests answered with HTTP 500
+            throttle_rate: Fraction of requests answered with HTTP 429
+            retry_after_ms: Retry-After sent with 429 responses
+            prompt_cache: Report cached_tokens like Azure OpenAI prompt caching (prefixes
+                of 1024+ tokens seen before, in 128-token steps)
+        """
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.chunk_interval_ms = chunk_interval_ms
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after_ms = retry_after_ms
+        self.prompt_cache = prompt_cache
+
+class FakeServerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # completion_tokens is what the requests asked for; generated_tokens what was actually sent
+        # before the client hung up (disconnected counts streams the client closed early)
+        self.counts = {"requests": 0, "streamed": 0, "throttled": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                       "cached_tokens": 0, "generated_tokens": 0, "disconnected": 0}
+
+    def add(self, **values: int):
+        with self._lock:
+            for name, value in values.items():
+                self.counts[name] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+class PromptCache:
+    """
+    Approximation of provider-side prompt caching
+
+    The prompt is the messages' roles and contents in order, at about 4
+    characters per token. A request reuses the longest prefix, in 128-token
+    steps from 1024 tokens on, that an earlier request already sent.
+    """
+
+    MIN_TOKENS = 1024
+    STEP_TOKENS = 128
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, maxsize: int = 100_000):
+        self._lock = threading.Lock()
+        self._prefixes: "collections.OrderedDict[str, None]" = collections.OrderedDict()
+        self.maxsize = maxsize
+
+    def lookup(self, messages: list) -> int:
+        """Return the cached tokens of a request and remember its prefixes"""
+        text = "".join(f"{message.get('role')}\n{message.get('content', '')}\n" for message in messages)
+        step = self.STEP_TOKENS * self.CHARS_PER_TOKEN
+        digest = hashlib.sha1()
+        cached = 0
+        with self._lock:
+            for end in range(step, len(text) + 1, step):
+                digest.update(text[end - step:end].encode("utf-8"))
+                tokens = end // self.CHARS_PER_TOKEN
+                if tokens < self.MIN_TOKENS:
+                    continue
+                key = digest.copy().hexdigest()
+                if key in self._prefixes:
+                    self._prefixes.move_to_end(key)
+                    cached = tokens
+                else:
+                    self._prefixes[key] = None
+            while len(self._prefixes) > self.maxsize:
+                self._prefixes.popitem(last=False)
+        return cached
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/stats"):
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(404, {"error": {"code": "NotFound", "message": "Not found"}})
+
+    def do_POST(self):
+        if "/chat/completions" not in self.path:
+            self._send_json(404, {"error": {"code": "NotFound", "message": "Not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", "0"))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.config
+        stats = self.server.stats
+        stats.add(requests=1)
+
+        roll = random.random()
+        if roll < config.throttle_rate:
+            stats.add(throttled=1)
+            self._send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                            {"retry-after-ms": str(config.retry_after_ms),
+                             "retry-after": str(max(1, config.retry_after_ms // 1000))})
+            return
+        if roll < config.throttle_rate + config.error_rate:
+            stats.add(errors=1)
+            self._send_json(500, {"error": {"code": "InternalServerError", "message": "Injected failure"}})
+            return
+
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 4
+        completion_tokens = min(config.completion_tokens, int(body.get("max_tokens") or config.completion_tokens))
+        cached_tokens = min(prompt_tokens, self.server.prompt_cache.lookup(body.get("messages", []))) if config.prompt_cache else 0
+        stats.add(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_tokens=cached_tokens)
+        words = [LOREM[i % len(LOREM)] for i in range(completion_tokens)]
+
+        time.sleep(max(0.0, config.latency_ms + random.uniform(-1, 1) * config.latency_jitter_ms) / 1000.0)
+
+        if body.get("stream"):
+            stats.add(streamed=1)
+            self._stream(body, words, prompt_tokens, cached_tokens)
+        else:
+            # The whole completion was generated, whether or not the client is still there to read it
+            stats.add(generated_tokens=completion_tokens)
+            try:
+                self._send_json(200, self._completion(body, " ".join(words), prompt_tokens, completion_tokens, cached_tokens))
+            except (BrokenPipeError, ConnectionResetError):
+                stats.add(disconnected=1)
+
+    def _completion(self, body: Dict[str, Any], content: str, prompt_tokens: int, completion_tokens: int,
+                    cached_tokens: int) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "prompt_filter_results": [{"prompt_index": 0, "content_filter_results": {}}],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+                "content_filter_results": {},
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    def _stream(self, body: Dict[str, Any], words: list, prompt_tokens: int, cached_tokens: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": body.get("model", "fake")}
+        interval = self.server.config.chunk_interval_ms / 1000.0
+        try:
+            self._event({**base, "choices": [], "prompt_filter_results": [{"prompt_index": 0, "content_filter_results": {}}]})
+            for index, word in enumerate(words):
+                delta = {"content": (" " if index else "") + word}
+                if index == 0:
+                    delta["role"] = "assistant"
+                self._event({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                self.server.stats.add(generated_tokens=1)
+                if interval:
+                    time.sleep(interval)
+            self._event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                                   "total_tokens": prompt_tokens + len(words),
+                                   "prompt_tokens_details": {"cached_tokens": cached_tokens}}})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream: stop generating
+            self.server.stats.add(disconnected=1)
+
+    def _event(self, payload: Dict[str, Any]):
+        self.wfile.write(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, config: FakeServerConfig):
+        super().__init__(address, _Handler)
+        self.config = config
+        self.stats = FakeServerStats()
+        self.prompt_cache = PromptCache()
+
+class FakeOpenAIServer:
+    """Runs the fake server in a background thread, e.g. from a load test or unit test"""
+
+    def __init__(self, config: FakeServerConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeServerConfig()
+        self._server = _Server((host, port), self.config)
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self) -> FakeServerStats:
+        return self._server.stats
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any):
+        self.stop()
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Add the FakeServerConfig options to an argument parser"""
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Mean time to first token")
+    parser.add_argument("--latency-jitter-ms", type=float, default=50.0, help="Uniform latency jitter")
+    parser.add_argument("--chunk-interval-ms", type=float, default=20.0, help="Delay between streamed tokens")
+    parser.add_argument("--completion-tokens", type=int, default=120, help="Tokens per completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of HTTP 500 responses")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of HTTP 429 responses")
+    parser.add_argument("--retry-after-ms", type=int, default=1000, help="Retry-After sent with 429s")
+    parser.add_argument("--no-prompt-cache", dest="prompt_cache", action="store_false",
+                        help="Always report 0 cached prompt tokens")
+
+def config_from_args(args: argparse.Namespace) -> FakeServerConfig:
+    return FakeServerConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        chunk_interval_ms=args.chunk_interval_ms,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after_ms=args.retry_after_ms,
+        prompt_cache=args.prompt_cache,
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Azure OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(config_from_args(args), args.host, args.port)
+    print(f"Fake Azure OpenAI server listening on {server.endpoint} (stats at {server.endpoint}/stats)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
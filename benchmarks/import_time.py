@@ -0,0 +1,97 @@
+"""
+Import-time report for the web app's startup path
+Runs `python -X importtime -c "import <module>"` in fresh interpreters, reports the slowest imports
+and fails when the module exceeds its budget or pulls in a module that should be imported lazily
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+ROOT = Path(__file__).resolve().parent.parent
+WEBAPP = ROOT / "webapp"
+
+# SDKs deferred until the first Azure OpenAI client or YAML parse
+DEFAULT_DENY = ["openai", "azure.identity", "yaml"]
+
+# "import time:       521 |      14884 |   yaml"
+LINE_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+class ImportRecord(NamedTuple):
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+def measure(module: str) -> List[ImportRecord]:
+    """Import module in a fresh interpreter and return its -X importtime records"""
+    env = dict(os.environ, PYTHONPATH=str(WEBAPP))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=str(WEBAPP), env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    records = []
+    for line in result.stderr.splitlines():
+        match = LINE_PATTERN.match(line)
+        if match:
+            records.append(ImportRecord(
+                name=match.group(4),
+                self_us=int(match.group(1)),
+                cumulative_us=int(match.group(2)),
+                depth=len(match.group(3)) // 2
+            ))
+    return records
+
+def total_us(records: List[ImportRecord], module: str) -> int:
+    """Cumulative time of the top-level import of module"""
+    for record in records:
+        if record.name == module and record.depth == 0:
+            return record.cumulative_us
+    return 0
+
+def report(module: str, records: List[ImportRecord], top: int) -> Dict[str, float]:
+    total_ms = total_us(records, module) / 1000
+    print(f"\nimport {module}: {total_ms:.1f} ms cumulative, {len(records)} modules imported")
+    print("-" * 60)
+    print(f"{'module':<40}{'self ms':>10}{'cumul ms':>10}")
+    for record in sorted(records, key=lambda r: r.self_us, reverse=True)[:top]:
+        print(f"{record.name:<40}{record.self_us / 1000:>10.1f}{record.cumulative_us / 1000:>10.1f}")
+    return {"total_ms": total_ms}
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Profile and budget the import time of web app modules")
+    parser.add_argument("--module", action="append", help="Module to import from webapp/ (repeatable, default persona_bot)")
+    parser.add_argument("--budget-ms", type=float, default=0, help="Fail if a module's cumulative import time exceeds this (0 = report only)")
+    parser.add_argument("--deny", nargs="*", default=DEFAULT_DENY, help="Modules that must not be imported at startup")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per module (the fastest run is reported)")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.module or ["persona_bot"]:
+        # The first run also pays for cold OS caches and bytecode compilation
+        runs = [measure(module) for _ in range(max(1, args.repeat))]
+        records = min(runs, key=lambda run: total_us(run, module))
+        total_ms = report(module, records, args.top)["total_ms"]
+
+        imported = {record.name for record in records}
+        for denied in args.deny:
+            if denied in imported:
+                failures.append(f"import {module} imports {denied}, which should be deferred until first use")
+        if args.budget_ms and total_ms > args.budget_ms:
+            failures.append(f"import {module} took {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    print()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK: import time within budget")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Load test for PersonaBot against a fake Azure OpenAI server
+Simulates N concurrent workshop sessions and reports latency, time-to-first-token, throughput and memory
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import FakeOpenAIServer, add_config_arguments, config_from_args
+
+DEFAULT_SCRIPT = [
+    "Quais são seus principais desafios hoje?",
+    "Como vocês usam dados para tomar decisões?",
+    "O que faria você confiar em uma solução de IA?",
+    "Como seria o sucesso para você daqui a um ano?",
+]
+
+class FakeCredential:
+    """Credential returning a static token, so no Entra ID round-trip is needed; counts its calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes: str) -> Any:
+        with self._lock:
+            self.calls += 1
+
+        class _Token:
+            token = "fake-token"
+            expires_on = int(time.time()) + 3600
+        return _Token()
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values (0 if empty)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class Recorder:
+    """Thread-safe collection of timings (seconds) per operation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings: Dict[str, List[float]] = {"load_persona": [], "intro": [], "ttft": [], "turn": []}
+        self.errors = 0
+        self.turns = 0
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.timings[name].append(seconds)
+            if name == "turn":
+                self.turns += 1
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+def run_session_sync(bot: Any, persona_file: str, script: List[str], recorder: Recorder):
+    started = time.perf_counter()
+    bot.load_persona(persona_file)
+    recorder.add("load_persona", time.perf_counter() - started)
+
+    started = time.perf_counter()
+    bot.get_introduction_message()
+    recorder.add("intro", time.perf_counter() - started)
+
+    for question in script:
+        started = time.perf_counter()
+        first = None
+        for _ in bot.chat_stream(question):
+            if first is None:
+                first = time.perf_counter() - started
+        recorder.add("ttft", first if first is not None else time.perf_counter() - started)
+        recorder.add("turn", time.perf_counter() - started)
+
+async def run_session_async(bot: Any, persona_file: str, script: List[str], recorder: Recorder):
+    started = time.perf_counter()
+    bot.load_persona(persona_file)
+    recorder.add("load_persona", time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await bot.aget_introduction_message()
+    recorder.add("intro", time.perf_counter() - started)
+
+    for question in script:
+        started = time.perf_counter()
+        first = None
+        async for _ in bot.achat_stream(question):
+            if first is None:
+                first = time.perf_counter() - started
+        recorder.add("ttft", first if first is not None else time.perf_counter() - started)
+        recorder.add("turn", time.perf_counter() - started)
+
+def run_load_test(args: argparse.Namespace, endpoint: str) -> Dict[str, Any]:
+    os.environ["AZURE_OPENAI_ENDPOINT"] = endpoint
+    from persona_bot import AzureOpenAIClient, PersonaBot, PersonaEngine
+    from concurrency import get_background_loop
+
+    engine = PersonaEngine(openai_client=AzureOpenAIClient(credential=FakeCredential()))
+    personas = engine.list_available_personas()
+    script = DEFAULT_SCRIPT[:args.turns] if args.turns <= len(DEFAULT_SCRIPT) else (DEFAULT_SCRIPT * args.turns)[:args.turns]
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    bots = [PersonaBot(engine) for _ in range(args.sessions)]
+    assignments = [args.persona or rng.choice(personas) for _ in bots]
+
+    started = time.perf_counter()
+    if args.mode == "async":
+        loop = get_background_loop()
+
+        async def run_all():
+            async def guarded(bot, persona_file):
+                try:
+                    await run_session_async(bot, persona_file, script, recorder)
+                except Exception:
+                    recorder.error()
+            await asyncio.gather(*(guarded(bot, persona_file) for bot, persona_file in zip(bots, assignments)))
+
+        loop.run(run_all())
+    else:
+        def guarded(bot, persona_file):
+            try:
+                run_session_sync(bot, persona_file, script, recorder)
+            except Exception:
+                recorder.error()
+
+        threads = [threading.Thread(target=guarded, args=pair) for pair in zip(bots, assignments)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+
+    memory_per_session = (tracemalloc.get_traced_memory()[0] - baseline) / max(1, len(bots))
+    tracemalloc.stop()
+
+    report: Dict[str, Any] = {
+        "mode": args.mode,
+        "sessions": args.sessions,
+        "turns_per_session": len(script),
+        "elapsed_seconds": round(elapsed, 3),
+        "turns_per_second": round(recorder.turns / elapsed, 2) if elapsed else 0.0,
+        "errors": recorder.errors,
+        "memory_per_session_kib": round(memory_per_session / 1024, 1),
+        "latency_ms": {},
+    }
+    for name, values in recorder.timings.items():
+        report["latency_ms"][name] = {
+            "count": len(values),
+            "p50": round(percentile(values, 50) * 1000, 1),
+            "p95": round(percentile(values, 95) * 1000, 1),
+            "p99": round(percentile(values, 99) * 1000, 1),
+        }
+    return report
+
+def print_report(report: Dict[str, Any]):
+    print(f"\nMode: {report['mode']} | sessions: {report['sessions']} | turns/session: {report['turns_per_session']}")
+    print(f"Elapsed: {report['elapsed_seconds']}s | throughput: {report['turns_per_second']} turns/s | errors: {report['errors']}")
+    print(f"Memory per session: {report['memory_per_session_kib']} KiB")
+    print("-" * 60)
+    print(f"{'operation':<14}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for name, stats in report["latency_ms"].items():
+        print(f"{name:<14}{stats['count']:>8}{stats['p50']:>12}{stats['p95']:>12}{stats['p99']:>12}")
+    if "server" in report:
+        print("-" * 60)
+        print(f"Fake server: {report['server']}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test PersonaBot against a fake Azure OpenAI server")
+    parser.add_argument("--sessions", type=int, default=50, help="Concurrent sessions")
+    parser.add_argument("--turns", type=int, default=4, help="Chat turns per session")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="Thread per session or the async engine")
+    parser.add_argument("--endpoint", help="Use an already running (fake) server instead of starting one")
+    parser.add_argument("--persona", help="Persona file every session loads (a whole room loading the same persona); default random")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", dest="json_path", help="Also write the report to this JSON file")
+    parser.add_argument("--max-p95-turn-ms", type=float, help="Fail (exit 1) if the p95 turn latency exceeds this")
+    parser.add_argument("--max-p95-ttft-ms", type=float, help="Fail (exit 1) if the p95 time-to-first-token exceeds this")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    if args.endpoint:
+        report = run_load_test(args, args.endpoint)
+    else:
+        with FakeOpenAIServer(config_from_args(args)) as server:
+            report = run_load_test(args, server.endpoint)
+            report["server"] = server.stats.snapshot()
+
+    print_report(report)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    failed = False
+    if args.max_p95_turn_ms is not None and report["latency_ms"]["turn"]["p95"] > args.max_p95_turn_ms:
+        print(f"❌ p95 turn latency {report['latency_ms']['turn']['p95']} ms exceeds budget {args.max_p95_turn_ms} ms")
+        failed = True
+    if args.max_p95_ttft_ms is not None and report["latency_ms"]["ttft"]["p95"] > args.max_p95_ttft_ms:
+        print(f"❌ p95 time-to-first-token {report['latency_ms']['ttft']['p95']} ms exceeds budget {args.max_p95_ttft_ms} ms")
+        failed = True
+    if report["errors"]:
+        print(f"❌ {report['errors']} sessions failed")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+System prompt token profile for every persona
+Tokenizes each rendered persona prompt locally, shows what every template field costs and flags
+oversized or repeated content; with --turns, also replays conversations against a fake Azure OpenAI
+server that simulates prompt caching and reports the cached prompt tokens recorded from usage
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "webapp"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from template import PROMPT_LAYOUTS, template_filename
+
+def profile_layout(layout: str, count_text: Any) -> Dict[str, Any]:
+    from persona_bot import PersonaEngine
+
+    engine = PersonaEngine(template_path=str(ROOT / "templates" / template_filename(layout)))
+    report = engine.prompt_report(count_text)
+    report["layout"] = layout
+    return report
+
+def print_profile(report: Dict[str, Any], top_fields: int):
+    profiles = report["personas"]
+    print(f"\nLayout: {report['layout']} ({report['template']})")
+    print("-" * 78)
+    print(f"{'persona':<26}{'tokens':>8}{'static prefix':>15}  most expensive fields")
+    for profile in profiles:
+        fields = ", ".join(f"{key} {field['total']}" for key, field in list(profile["fields"].items())[:top_fields])
+        print(f"{profile['file']:<26}{profile['total_tokens']:>8}{profile['static_prefix_tokens']:>15}  {fields}")
+    totals = [profile["total_tokens"] for profile in profiles]
+    if totals:
+        print(f"Mean {sum(totals) / len(totals):.0f} tokens, max {max(totals)}; template text {profiles[0]['template_tokens']} tokens")
+    cacheable = "yes" if report["shared_prefix_cacheable"] else "no, below 1024"
+    print(f"Prefix shared by every persona: {report['shared_prefix_tokens']} tokens (cacheable across personas: {cacheable})")
+    for profile in profiles:
+        for warning in profile["warnings"]:
+            print(f"⚠️  {profile['file']}: {warning}")
+
+def replay_conversations(layout: str, endpoint: str, turns: int) -> Dict[str, int]:
+    """Chat turns with every persona; return prompt and cached tokens as recorded by metrics.record_usage"""
+    os.environ["AZURE_OPENAI_ENDPOINT"] = endpoint
+    import metrics
+    from load_test import DEFAULT_SCRIPT, FakeCredential
+    from persona_bot import AzureOpenAIClient, PersonaBot, PersonaEngine
+
+    engine = PersonaEngine(
+        template_path=str(ROOT / "templates" / template_filename(layout)),
+        openai_client=AzureOpenAIClient(credential=FakeCredential())
+    )
+    before = metrics.TOKENS_TOTAL.snapshot()
+    script = (DEFAULT_SCRIPT * turns)[:turns]
+    for persona_file in engine.list_available_personas():
+        bot = PersonaBot(engine)
+        bot.load_persona(persona_file)
+        for question in script:
+            bot.chat(question)
+
+    recorded = {"prompt": 0, "cached": 0}
+    for labels, value in metrics.TOKENS_TOTAL.snapshot().items():
+        for kind in recorded:
+            if f'kind="{kind}"' in labels:
+                recorded[kind] += int(value - before.get(labels, 0))
+    return recorded
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Profile the input-token cost of every persona's system prompt")
+    parser.add_argument("--layout", nargs="+", choices=list(PROMPT_LAYOUTS), default=list(PROMPT_LAYOUTS),
+                        help="Prompt layouts to profile")
+    parser.add_argument("--top-fields", type=int, default=3, help="Fields listed per persona")
+    parser.add_argument("--turns", type=int, default=0,
+                        help="Also chat this many turns with every persona against a fake server and report cached tokens")
+    parser.add_argument("--json", dest="json_path", help="Also write the reports to this JSON file")
+    args = parser.parse_args()
+    os.environ.setdefault("PERSONA_HOT_RELOAD", "false")
+    # Every request must reach the (fake) model for its usage to be recorded
+    os.environ["PERSONA_RESPONSE_CACHE_ENABLED"] = "false"
+
+    from history import Tokenizer
+    tokenizer = Tokenizer(os.getenv("PERSONA_TOKENIZER_ENCODING", "o200k_base"))
+    if tokenizer.encoding is None:
+        print("⚠️  tiktoken is not available: token counts are estimates (~4 characters per token)")
+
+    reports: List[Dict[str, Any]] = []
+    for layout in args.layout:
+        reports.append(profile_layout(layout, tokenizer.count_text))
+        print_profile(reports[-1], args.top_fields)
+
+    if args.turns:
+        from fake_openai_server import FakeOpenAIServer, FakeServerConfig
+        print(f"\n{args.turns} turns with every persona (fake server, simulated prompt caching)")
+        for report in reports:
+            # A fresh server per layout, so one layout's prompts are not cached for the next
+            with FakeOpenAIServer(FakeServerConfig(latency_ms=0, latency_jitter_ms=0, completion_tokens=60)) as server:
+                recorded = replay_conversations(report["layout"], server.endpoint, args.turns)
+            share = recorded["cached"] / recorded["prompt"] if recorded["prompt"] else 0.0
+            report["replay"] = recorded
+            print(f"{report['layout']:<8} prompt tokens {recorded['prompt']:>8}  cached {recorded['cached']:>8}  ({share:.0%})")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(reports, indent=2, ensure_ascii=False), encoding="utf-8")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
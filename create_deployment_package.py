@@ -1,81 +1,341 @@
 """
 Create deployment ZIP package for Azure App Service
 This script creates a ZIP file with Linux-compatible path separators
+
+The archive is reproducible (sorted entries, fixed timestamps and permissions),
+entries are compressed in parallel worker processes, and --incremental reuses
+the compressed bytes of unchanged files from the previous archive using the
+content-hash manifest stored inside it.
 """
-import zipfile
+import argparse
+import fnmatch
+import hashlib
+import json
 import os
-from pathlib import Path
+import py_compile
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
-def create_deployment_zip(output_filename='persona-bot.zip'):
-    """Create a ZIP file for Azure deployment with proper path separators"""
-    
-    # Files and directories to include
-    items_to_include = [
-        'bots',
-        'templates',
-        'webapp',
-        'requirements.txt',
-        'startup.sh'
-    ]
-    
-    # Files to exclude
-    exclude_patterns = [
-        '__pycache__',
-        '.pyc',
-        '.env',
-        '.venv',
-        'venv',
-        '.git',
-        '.vscode',
-        '.idea'
+# Relative to this file, so the imports work from any directory and the root check below can report
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webapp'))
+from bundle import BUNDLE_FILENAME, BundleError, build_bundle, write_bundle
+from template import template_filename
+
+# Files and directories to include
+ITEMS_TO_INCLUDE = [
+    'bots',
+    'templates',
+    'webapp',
+    'requirements.txt',
+    'startup.sh',
+    BUNDLE_FILENAME
+]
+
+# Directory names and file name patterns to exclude (matched per path component)
+EXCLUDED_DIRS = {'__pycache__', '.venv', 'venv', '.git', '.vscode', '.idea'}
+EXCLUDED_FILES = ['*.pyc', '*.pyo', '.env', '.env.*']
+
+# Already-compressed formats are stored as-is
+STORED_EXTENSIONS = ('.whl', '.zip', '.gz', '.png', '.jpg', '.jpeg')
+
+MANIFEST_NAME = 'deploy-manifest.json'
+WHEELHOUSE_DIR = 'wheelhouse'
+WHEELHOUSE_CACHE = os.path.join('build', 'wheelhouse')
+
+# 1980-01-01 00:00, the earliest DOS timestamp a ZIP entry can hold; used for every entry
+FIXED_DOS_DATE = (1 << 5) | 1
+FIXED_DOS_TIME = 0
+UTF8_FLAG = 0x0800
+
+# (method, crc32, uncompressed size, compressed payload)
+Compressed = Tuple[int, int, int, bytes]
+
+def create_persona_bundle() -> bool:
+    """Validate bots/ and the template and compile them into the persona bundle"""
+    try:
+        bundle = build_bundle('bots', os.path.join('templates', template_filename()))
+    except BundleError as e:
+        print(f"❌ {e}")
+        return False
+    write_bundle(bundle, BUNDLE_FILENAME)
+    print(f"✓ Compiled {len(bundle['personas'])} personas into {BUNDLE_FILENAME}")
+    return True
+
+def is_excluded(name: str) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in EXCLUDED_FILES)
+
+def collect_files(items: List[str]) -> List[Tuple[str, str]]:
+    """Return sorted (arcname, path) pairs for every file to package"""
+    files = []
+    for item in items:
+        if not os.path.exists(item):
+            print(f"⚠️  Warning: {item} not found, skipping...")
+            continue
+
+        if os.path.isfile(item):
+            files.append((item.replace('\\', '/'), item))  # Ensure forward slashes
+            continue
+
+        for root, dirs, names in os.walk(item):
+            # Remove excluded directories
+            dirs[:] = [d for d in dirs if d not in EXCLUDED_DIRS]
+            for name in names:
+                if is_excluded(name):
+                    continue
+                file_path = os.path.join(root, name)
+                files.append((file_path.replace('\\', '/'), file_path))  # Ensure forward slashes
+    return sorted(files)
+
+def compile_bytecode(files: List[Tuple[str, str]], python_version: str, build_dir: str) -> List[Tuple[str, str]]:
+    """
+    Compile the packaged Python modules to __pycache__/*.pyc
+
+    Hash-checked .pyc files stay valid after ZIP extraction resets mtimes, and
+    Python falls back to the source if a file no longer matches. Bytecode is
+    specific to the Python minor version, so this only runs with the version
+    App Service uses.
+    """
+    running = f"{sys.version_info.major}.{sys.version_info.minor}"
+    if running != python_version:
+        print(f"⚠️  Warning: skipping .pyc files, running Python {running} but the target is {python_version}")
+        return []
+
+    compiled = []
+    for arcname, path in files:
+        if not arcname.endswith('.py'):
+            continue
+        directory, name = os.path.split(arcname)
+        pyc_arcname = f"{directory}/__pycache__/{name[:-3]}.{sys.implementation.cache_tag}.pyc"
+        pyc_path = os.path.join(build_dir, pyc_arcname)
+        py_compile.compile(
+            path, cfile=pyc_path, dfile=arcname, doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH
+        )
+        compiled.append((pyc_arcname, pyc_path))
+    print(f"✓ Compiled {len(compiled)} modules to bytecode")
+    return compiled
+
+def build_wheelhouse(python_version: str) -> List[Tuple[str, str]]:
+    """Download Linux wheels for requirements.txt so startup.sh can install offline"""
+    os.makedirs(WHEELHOUSE_CACHE, exist_ok=True)
+    command = [
+        sys.executable, '-m', 'pip', 'download',
+        '-r', 'requirements.txt',
+        '-d', WHEELHOUSE_CACHE,
+        '--only-binary=:all:',
+        '--implementation', 'cp',
+        '--python-version', python_version,
+        '--platform', 'manylinux2014_x86_64',
+        '--platform', 'manylinux_2_17_x86_64',
+        '--platform', 'manylinux_2_28_x86_64',
+        '--quiet'
     ]
-    
+    print(f"Downloading wheels for Python {python_version} (linux x86_64)...")
+    subprocess.run(command, check=True)
+    wheels = sorted(name for name in os.listdir(WHEELHOUSE_CACHE) if name.endswith('.whl'))
+    print(f"✓ Wheelhouse has {len(wheels)} wheels")
+    return [(f"{WHEELHOUSE_DIR}/{name}", os.path.join(WHEELHOUSE_CACHE, name)) for name in wheels]
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def compress_file(path: str, level: int) -> Compressed:
+    """Raw-deflate a file (runs in a worker process); small gains are stored instead"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    crc = zlib.crc32(data)
+    if path.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED, crc, len(data), data
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    payload = compressor.compress(data) + compressor.flush()
+    if len(payload) >= len(data):
+        return zipfile.ZIP_STORED, crc, len(data), data
+    return zipfile.ZIP_DEFLATED, crc, len(data), payload
+
+class PreviousArchive:
+    """Raw entries of the last package, reusable when a file's hash and the compression level match"""
+
+    def __init__(self, path: str, level: int):
+        self._file = None
+        self._entries: Dict[str, zipfile.ZipInfo] = {}
+        try:
+            with zipfile.ZipFile(path) as archive:
+                manifest = json.loads(archive.read(MANIFEST_NAME))
+                infos = {info.filename: info for info in archive.infolist()}
+        except (FileNotFoundError, KeyError, ValueError, zipfile.BadZipFile):
+            return
+        if manifest.get('compression_level') != level:
+            return
+        for arcname, sha256 in manifest.get('files', {}).items():
+            if arcname in infos:
+                self._entries[sha256] = infos[arcname]
+        self._file = open(path, 'rb')
+
+    def get(self, sha256: str) -> Optional[Compressed]:
+        info = self._entries.get(sha256)
+        if info is None or self._file is None:
+            return None
+        self._file.seek(info.header_offset)
+        header = self._file.read(30)
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        self._file.seek(info.header_offset + 30 + name_length + extra_length)
+        return info.compress_type, info.CRC, info.file_size, self._file.read(info.compress_size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+class DeterministicZipWriter:
+    """
+    Minimal ZIP writer for pre-compressed entries
+
+    zipfile cannot add already-deflated data, which parallel compression and
+    incremental reuse need. Every entry gets the same timestamp and
+    permissions, so identical inputs always produce identical archives.
+    """
+
+    def __init__(self, f):
+        self._file = f
+        self._entries = []
+
+    def add(self, arcname: str, entry: Compressed):
+        method, crc, size, payload = entry
+        name = arcname.encode('utf-8')
+        offset = self._file.tell()
+        if offset + len(payload) > 0xFFFFFFFF or len(self._entries) >= 0xFFFF:
+            raise ValueError("Package too large for a non-ZIP64 archive")
+        self._file.write(struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, 20, UTF8_FLAG, method, FIXED_DOS_TIME, FIXED_DOS_DATE,
+            crc, len(payload), size, len(name), 0
+        ))
+        self._file.write(name)
+        self._file.write(payload)
+        self._entries.append((name, method, crc, len(payload), size, offset))
+
+    def close(self):
+        directory_offset = self._file.tell()
+        for name, method, crc, compressed_size, size, offset in self._entries:
+            # Shell scripts keep their executable bit when extracted on Linux
+            mode = 0o100755 if name.endswith(b'.sh') else 0o100644
+            self._file.write(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | 20, 20, UTF8_FLAG, method,
+                FIXED_DOS_TIME, FIXED_DOS_DATE, crc, compressed_size, size, len(name), 0, 0, 0, 0,
+                mode << 16, offset
+            ))
+            self._file.write(name)
+        directory_size = self._file.tell() - directory_offset
+        self._file.write(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, len(self._entries), len(self._entries),
+            directory_size, directory_offset, 0
+        ))
+
+def create_deployment_zip(output_filename='persona-bot.zip', incremental=False, jobs=None, level=6,
+                          include_pyc=False, include_wheelhouse=False, python_version='3.11'):
+    """Create a ZIP file for Azure deployment with proper path separators"""
+
     print(f"Creating deployment package: {output_filename}")
     print("-" * 50)
-    
-    with zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for item in items_to_include:
-            if not os.path.exists(item):
-                print(f"⚠️  Warning: {item} not found, skipping...")
-                continue
-            
-            if os.path.isfile(item):
-                # Add single file
-                arcname = item.replace('\\', '/')  # Ensure forward slashes
-                zipf.write(item, arcname)
-                print(f"✓ Added file: {arcname}")
-            
-            elif os.path.isdir(item):
-                # Add directory recursively
-                for root, dirs, files in os.walk(item):
-                    # Remove excluded directories
-                    dirs[:] = [d for d in dirs if not any(pattern in d for pattern in exclude_patterns)]
-                    
-                    for file in files:
-                        # Skip excluded files
-                        if any(pattern in file for pattern in exclude_patterns):
-                            continue
-                        
-                        file_path = os.path.join(root, file)
-                        arcname = file_path.replace('\\', '/')  # Ensure forward slashes
-                        zipf.write(file_path, arcname)
-                        print(f"✓ Added: {arcname}")
-    
+    started = time.perf_counter()
+
+    build_dir = tempfile.mkdtemp(prefix='persona-bot-build-')
+    previous = PreviousArchive(output_filename, level) if incremental else None
+    temp_output = f"{output_filename}.tmp"
+    try:
+        files = collect_files(ITEMS_TO_INCLUDE)
+        if include_pyc:
+            files += compile_bytecode(files, python_version, build_dir)
+        if include_wheelhouse:
+            files += build_wheelhouse(python_version)
+        files.sort()
+
+        hashes = {arcname: file_sha256(path) for arcname, path in files}
+        entries: Dict[str, Compressed] = {}
+        if previous is not None:
+            for arcname, _ in files:
+                reused = previous.get(hashes[arcname])
+                if reused is not None:
+                    entries[arcname] = reused
+
+        # Compress the new and changed files in parallel
+        pending = [(arcname, path) for arcname, path in files if arcname not in entries]
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = pool.map(compress_file, [path for _, path in pending], [level] * len(pending), chunksize=8)
+            for (arcname, _), entry in zip(pending, results):
+                entries[arcname] = entry
+
+        manifest = json.dumps(
+            {'format': 1, 'compression_level': level, 'files': hashes},
+            sort_keys=True, indent=1
+        ).encode('utf-8')
+
+        with open(temp_output, 'wb') as f:
+            writer = DeterministicZipWriter(f)
+            for arcname, _ in files:
+                writer.add(arcname, entries[arcname])
+            writer.add(MANIFEST_NAME, (zipfile.ZIP_STORED, zlib.crc32(manifest), len(manifest), manifest))
+            writer.close()
+    finally:
+        if previous is not None:
+            previous.close()
+        shutil.rmtree(build_dir, ignore_errors=True)
+    os.replace(temp_output, output_filename)
+
+    reused_count = len(files) - len(pending)
+    print(f"✓ {len(files)} files: {len(pending)} compressed, {reused_count} reused from the previous package")
+
     # Get ZIP file size
     zip_size = os.path.getsize(output_filename)
     zip_size_mb = zip_size / (1024 * 1024)
-    
+
     print("-" * 50)
-    print(f"✅ Package created successfully: {output_filename}")
+    print(f"✅ Package created successfully: {output_filename} ({time.perf_counter() - started:.1f}s)")
     print(f"📦 Size: {zip_size_mb:.2f} MB")
     print(f"\nNext step: Deploy using Azure CLI")
     print(f"az webapp deployment source config-zip --name <APP_NAME> --resource-group <RG_NAME> --src {output_filename}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create the Azure App Service deployment ZIP")
+    parser.add_argument('--output', default='persona-bot.zip', help="Package file name")
+    parser.add_argument('--incremental', action='store_true', help="Reuse unchanged entries from the previous package")
+    parser.add_argument('--jobs', type=int, default=None, help="Compression worker processes (default: CPU count)")
+    parser.add_argument('--level', type=int, default=6, choices=range(1, 10), metavar='1-9', help="DEFLATE level")
+    parser.add_argument('--pyc', action='store_true', help="Include hash-checked .pyc files for the webapp modules")
+    parser.add_argument('--wheelhouse', action='store_true', help="Include Linux wheels so startup.sh installs offline")
+    parser.add_argument('--python-version', default='3.11', help="App Service Python version for .pyc files and wheels")
+    args = parser.parse_args()
+
     # Check if we're in the right directory
     if not os.path.exists('webapp') or not os.path.exists('bots'):
         print("❌ Error: Please run this script from the repository root directory")
         print("   (where 'webapp' and 'bots' folders are located)")
         exit(1)
-    
-    create_deployment_zip()
+
+    # Refuse to package personas or a template that would fail at runtime
+    if not create_persona_bundle():
+        exit(1)
+
+    try:
+        create_deployment_zip(
+            args.output,
+            incremental=args.incremental,
+            jobs=args.jobs,
+            level=args.level,
+            include_pyc=args.pyc,
+            include_wheelhouse=args.wheelhouse,
+            python_version=args.python_version
+        )
+    except subprocess.CalledProcessError:
+        print("❌ Error: could not download wheels for every requirement (some may have no Linux wheel)")
+        exit(1)
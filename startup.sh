@@ -6,8 +6,21 @@
 # Change to the application directory
 cd /home/site/wwwroot
 
+# Packages built with --wheelhouse ship Linux wheels: install them offline into a
+# virtualenv that is only rebuilt when requirements.txt changes
+if [ -d "wheelhouse" ]; then
+    REQUIREMENTS_HASH=$(sha256sum requirements.txt | cut -d' ' -f1)
+    if [ "$(cat .venv/.requirements-sha256 2>/dev/null)" != "$REQUIREMENTS_HASH" ]; then
+        echo "Installing dependencies from wheelhouse..."
+        rm -rf .venv
+        # The hash is only recorded after a complete install, so a failed one is retried on the next start
+        python -m venv .venv && \
+            .venv/bin/pip install --no-index --find-links wheelhouse -r requirements.txt && \
+            echo "$REQUIREMENTS_HASH" > .venv/.requirements-sha256
+    fi
+    source .venv/bin/activate
 # Install dependencies if needed (Azure should do this automatically, but as fallback)
-if [ ! -d ".venv" ]; then
+elif [ ! -d ".venv" ]; then
     echo "Installing dependencies..."
     pip install -r requirements.txt
 fi
@@ -0,0 +1,251 @@
+"""
+Persona Bot HTTP API
+Headless ASGI service over PersonaBot: list personas, start and reset sessions, stream replies over SSE
+
+Sessions live in the SQLite session store (shared mode) by default, so any worker can serve any request:
+    uvicorn api:app --app-dir webapp --host 0.0.0.0 --port 8080 --workers 4
+
+Store reads and writes block, so handlers run them in the thread pool instead of on the event loop.
+"""
+import json
+import logging
+import os
+import re
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import bootstrap
+import metrics
+from deadline import CancelToken
+from persona_bot import PersonaBot, PersonaEngine, get_shared_engine
+from session_store import Message, SessionStore, SQLiteSessionStore, create_session_store
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = int(os.getenv("PERSONA_API_MAX_MESSAGE_LENGTH", "2000"))
+MESSAGE_ROLES = ("user", "assistant")
+
+class JSONResponseWithDefaults(JSONResponse):
+    """JSON response that also serializes YAML values JSON lacks (dates)"""
+
+    def render(self, content: Any) -> bytes:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+def clean_message(text: Any) -> str:
+    """Trim, bound and strip control characters from a message sent to a persona"""
+    if not isinstance(text, str):
+        raise HTTPException(400, "'message' must be a string")
+    text = re.sub(r'[\x00-\x08\x0B-\x0C\x0E-\x1F\x7F]', '', text[:MAX_MESSAGE_LENGTH]).strip()
+    if not text:
+        raise HTTPException(400, "'message' is empty")
+    return text
+
+def request_token(engine: PersonaEngine, timeout: Any) -> CancelToken:
+    """Deadline of a message: the client's 'timeout' in seconds, never longer than the server's"""
+    limit = engine.requests.timeout
+    if timeout is None:
+        return CancelToken(limit)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+        raise HTTPException(400, "'timeout' must be a positive number of seconds")
+    return CancelToken(min(timeout, limit) if limit else timeout)
+
+async def read_json(request: Request) -> Dict[str, Any]:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Request body must be JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(400, "Request body must be a JSON object")
+    return body
+
+def engine_of(request: Request) -> PersonaEngine:
+    return request.app.state.engine
+
+def load_bot(engine: PersonaEngine, session_id: str) -> Optional[PersonaBot]:
+    session = engine.sessions.get(session_id)
+    if session is None:
+        return None
+    # In shared mode every read goes to SQLite: the request works on this one copy
+    return PersonaBot(engine, session=session)
+
+async def open_bot(request: Request) -> PersonaBot:
+    """PersonaBot for the session in the URL; 404 if the session does not exist"""
+    bot = await run_in_threadpool(load_bot, engine_of(request), request.path_params["session_id"])
+    if bot is None:
+        raise HTTPException(404, "Unknown session")
+    return bot
+
+def message_payload(message: Message) -> Dict[str, Any]:
+    return {"seq": message.seq, "role": message.role, "content": message.content, "context": message.context}
+
+def session_payload(bot: PersonaBot, since_seq: int = 0) -> Dict[str, Any]:
+    session = bot.session
+    return {
+        "session_id": session.id,
+        "persona_file": bot.persona_file,
+        "persona": bot.current_persona,
+        "next_seq": session.next_seq,
+        "messages": [message_payload(message) for message in session.transcript(since_seq)],
+    }
+
+def sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def health(request: Request) -> Response:
+    return JSONResponseWithDefaults({"status": "ok"})
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Prometheus metrics of the worker that served the request"""
+    return PlainTextResponse(metrics.registry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+async def list_personas(request: Request) -> Response:
+    # The catalog rescans bots/ every PERSONA_CATALOG_RESCAN_SECONDS
+    entries = await run_in_threadpool(engine_of(request).catalog.entries)
+    return JSONResponseWithDefaults({"personas": [
+        {
+            "file": entry.file,
+            "name": entry.name,
+            "role": entry.role,
+            "industry": entry.industry,
+            "tech_maturity": entry.tech_maturity,
+            "hash": entry.file_hash,
+        }
+        for entry in entries
+    ]})
+
+async def create_session(request: Request) -> Response:
+    """
+    Start (or reuse) a session, optionally loading a persona
+
+    Body: {"session_id": optional id to reuse, "persona": optional persona file}.
+    Loading a persona resets the conversation and returns its introduction.
+    """
+    engine = engine_of(request)
+    body = await read_json(request)
+    persona_file = body.get("persona")
+    if persona_file is not None and (
+        not isinstance(persona_file, str) or await run_in_threadpool(engine.catalog.get, persona_file) is None
+    ):
+        raise HTTPException(404, "Unknown persona")
+
+    bot = await run_in_threadpool(lambda: PersonaBot(engine, session=engine.sessions.open(body.get("session_id"))))
+    introduction = None
+    if persona_file:
+        await run_in_threadpool(bot.load_persona, persona_file)
+        introduction = await bot.aget_introduction_message()
+    payload = session_payload(bot)
+    payload["introduction"] = introduction
+    return JSONResponseWithDefaults(payload, status_code=201)
+
+async def get_session(request: Request) -> Response:
+    """Session state and the transcript from ?since=<seq> on"""
+    try:
+        since_seq = int(request.query_params.get("since", "0"))
+    except ValueError:
+        raise HTTPException(400, "'since' must be an integer")
+    return JSONResponseWithDefaults(session_payload(await open_bot(request), since_seq))
+
+async def delete_session(request: Request) -> Response:
+    await run_in_threadpool(engine_of(request).sessions.delete, request.path_params["session_id"])
+    return Response(status_code=204)
+
+async def send_message(request: Request) -> Response:
+    """
+    Send a message to the session's persona
+
+    Body: {"message": text, "stream": true, "timeout": seconds}. Streams
+    ``delta`` events and a final ``done`` event over SSE, or returns
+    {"reply": ...} with stream false. A client that disconnects cancels the
+    generation, and a newer message to the same session supersedes this one.
+    """
+    bot = await open_bot(request)
+    if not bot.current_persona:
+        raise HTTPException(409, "Load a persona before sending messages")
+    body = await read_json(request)
+    message = clean_message(body.get("message"))
+    token = request_token(engine_of(request), body.get("timeout"))
+
+    if body.get("stream", True) is False:
+        reply = await bot.achat(message, cancel=token)
+        return JSONResponseWithDefaults({"reply": reply, "next_seq": bot.session.next_seq})
+
+    async def events() -> AsyncIterator[str]:
+        chunks = []
+        try:
+            async for delta in bot.achat_stream(message, cancel=token):
+                chunks.append(delta)
+                yield sse("delta", {"text": delta})
+        except Exception as e:
+            logger.error(f"Streaming reply failed: {e}")
+            yield sse("error", {"error": "Reply failed"})
+            return
+        yield sse("done", {"reply": "".join(chunks), "next_seq": bot.session.next_seq})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def reset_session(request: Request) -> Response:
+    """Clear the conversation and return the persona's new introduction"""
+    bot = await open_bot(request)
+    await run_in_threadpool(bot.reset_conversation)
+    introduction = await bot.aget_introduction_message() if bot.current_persona else None
+    payload = session_payload(bot)
+    payload["introduction"] = introduction
+    return JSONResponseWithDefaults(payload)
+
+async def add_notice(request: Request) -> Response:
+    """Record a message shown in the transcript but never sent to the model"""
+    bot = await open_bot(request)
+    body = await read_json(request)
+    role = body.get("role", "assistant")
+    content = body.get("content")
+    if role not in MESSAGE_ROLES or not isinstance(content, str):
+        raise HTTPException(400, "Expected {'role': 'user' | 'assistant', 'content': text}")
+    await run_in_threadpool(bot.add_notice, content[:MAX_MESSAGE_LENGTH], role=role)
+    return JSONResponseWithDefaults({"next_seq": bot.session.next_seq}, status_code=201)
+
+async def http_error(request: Request, exc: HTTPException) -> Response:
+    return JSONResponseWithDefaults({"error": exc.detail}, status_code=exc.status_code)
+
+def create_api_session_store() -> SessionStore:
+    """Session store for the API: SQLite in shared mode unless configured otherwise"""
+    # Sessions must outlive a request and be visible to every worker
+    store = create_session_store(default_backend="sqlite", shared=True)
+    if not isinstance(store, SQLiteSessionStore):
+        logger.warning("API sessions are kept in worker memory; run a single worker or use PERSONA_SESSION_STORE=sqlite")
+    return store
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    bootstrap.configure()
+    # An engine set on app.state before start-up (benchmarks, embedding code) is kept
+    if getattr(app.state, "engine", None) is None:
+        app.state.engine = get_shared_engine(session_store=create_api_session_store())
+    # Create the Azure OpenAI client (SDK imports, tokenizer, first token) and load the personas before
+    # serving: done lazily, the first requests would do this blocking work on the event loop
+    app.state.engine.prewarm()
+    yield
+
+routes = [
+    Route("/healthz", health),
+    Route("/metrics", metrics_endpoint),
+    Route("/personas", list_personas),
+    Route("/sessions", create_session, methods=["POST"]),
+    Route("/sessions/{session_id}", get_session, methods=["GET"]),
+    Route("/sessions/{session_id}", delete_session, methods=["DELETE"]),
+    Route("/sessions/{session_id}/messages", send_message, methods=["POST"]),
+    Route("/sessions/{session_id}/reset", reset_session, methods=["POST"]),
+    Route("/sessions/{session_id}/notices", add_notice, methods=["POST"]),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan, exception_handlers={HTTPException: http_error})
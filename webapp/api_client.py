@@ -0,0 +1,194 @@
+"""
+Persona Bot HTTP API client
+PersonaBot's interface over api.py, so the Streamlit UI can run against a separately scaled API service
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+
+from catalog import PersonaCatalog, PersonaEntry
+from deadline import CancelToken
+from session_store import Message, Session
+
+logger = logging.getLogger(__name__)
+
+_clients: Dict[str, "APIHttpClient"] = {}
+_catalogs: Dict[str, "RemoteCatalog"] = {}
+_clients_lock = threading.Lock()
+
+class APIHttpClient:
+    """requests session (one connection pool) bound to an API base URL; no cookies are used"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.session = requests.Session()
+        # (connect, read) seconds; the read timeout bounds the wait between streamed chunks
+        self.timeout = (5.0, float(os.getenv("PERSONA_API_TIMEOUT_SECONDS", "120")))
+
+    def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        return self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+
+def get_http_client(base_url: str) -> APIHttpClient:
+    """Process-wide HTTP client per API base URL"""
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = APIHttpClient(base_url)
+        return client
+
+class RemoteCatalog(PersonaCatalog):
+    """PersonaCatalog filled from GET /personas instead of a bots directory"""
+
+    def __init__(self, http: APIHttpClient, rescan_interval: float = 60.0):
+        super().__init__("", rescan_interval=rescan_interval)
+        self._http = http
+
+    def refresh(self) -> bool:
+        with self._lock:
+            self._scanned_at = self._clock()
+            try:
+                response = self._http.request("GET", "/personas")
+                response.raise_for_status()
+                personas = response.json()["personas"]
+            except (requests.RequestException, ValueError, KeyError) as e:
+                logger.error(f"Error listing personas from the API: {e}")
+                return False
+
+            entries = {item["file"]: PersonaEntry(item["file"], item, item.get("hash", ""), 0.0, 0) for item in personas}
+            changed = entries.keys() != self._entries.keys() or any(
+                entry.file_hash != self._entries[file].file_hash for file, entry in entries.items()
+            )
+            self._entries = entries
+            if changed:
+                self._sorted = sorted(entries.values(), key=lambda item: (item.name.casefold(), item.file))
+            return changed
+
+def get_remote_catalog(base_url: str) -> RemoteCatalog:
+    with _clients_lock:
+        catalog = _catalogs.get(base_url)
+    if catalog is None:
+        catalog = RemoteCatalog(
+            get_http_client(base_url),
+            rescan_interval=float(os.getenv("PERSONA_CATALOG_RESCAN_SECONDS", "60"))
+        )
+        with _clients_lock:
+            catalog = _catalogs.setdefault(base_url, catalog)
+    return catalog
+
+class PersonaAPIClient:
+    """
+    Conversation with a persona served by the HTTP API
+
+    Offers the PersonaBot methods the UI uses. The conversation lives in the
+    API's session store; this object only keeps the session id and the last
+    persona and introduction the API returned.
+    """
+
+    def __init__(self, base_url: str, session_id: str = None):
+        """
+        Args:
+            base_url: API root, e.g. http://localhost:8080
+            session_id: Session to resume; a new session is started if it is unknown
+        """
+        self._http = get_http_client(base_url)
+        self.catalog = get_remote_catalog(base_url)
+        self._introduction: Optional[str] = None
+        self._apply(self._post("/sessions", {"session_id": session_id}))
+
+    @property
+    def session(self) -> Session:
+        """Snapshot of the session, fetched from the API"""
+        return self._session_from(self._get(f"/sessions/{self.session_id}"))
+
+    def transcript(self, since_seq: int = 0) -> List[Message]:
+        return self._session_from(self._get(f"/sessions/{self.session_id}", params={"since": since_seq})).transcript()
+
+    def load_persona(self, persona_file: str) -> Dict[str, Any]:
+        """Load a persona into the session (resetting it) and keep its introduction"""
+        self._apply(self._post("/sessions", {"session_id": self.session_id, "persona": persona_file}))
+        return self.current_persona
+
+    def get_introduction_message(self) -> str:
+        """Introduction returned by the last load or reset (the API already added it to the transcript)"""
+        return self._introduction or ""
+
+    def chat_stream(self, user_message: str, cancel: CancelToken = None) -> Iterator[str]:
+        """
+        Send a message and yield the reply deltas streamed over SSE
+
+        The token's remaining time is sent as the request's timeout, and
+        cancelling it closes the connection, which makes the API stop generating.
+        """
+        body = {"message": user_message, "stream": True}
+        if cancel is not None and cancel.deadline is not None:
+            body["timeout"] = cancel.remaining()
+        with self._http.request("POST", f"/sessions/{self.session_id}/messages", json=body, stream=True) as response:
+            unregister = cancel.on_cancel(response.close) if cancel is not None else (lambda: None)
+            try:
+                yield from self._read_events(response, cancel)
+            except Exception:
+                if cancel is not None:
+                    # Reading fails once the cancellation closed the connection
+                    cancel.check()
+                raise
+            finally:
+                unregister()
+
+    def _read_events(self, response: requests.Response, cancel: Optional[CancelToken]) -> Iterator[str]:
+        self._raise_for_status(response)
+        response.encoding = "utf-8"
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if cancel is not None:
+                cancel.check()
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "delta":
+                    yield data["text"]
+                elif event == "error":
+                    raise RuntimeError(data.get("error", "Reply failed"))
+
+    def reset_conversation(self):
+        self._apply(self._post(f"/sessions/{self.session_id}/reset", {}))
+
+    def add_notice(self, content: str, role: str = "assistant"):
+        self._post(f"/sessions/{self.session_id}/notices", {"role": role, "content": content})
+
+    def _apply(self, data: Dict[str, Any]):
+        self.session_id = data["session_id"]
+        self.persona_file = data.get("persona_file")
+        self.current_persona = data.get("persona")
+        self._introduction = data.get("introduction")
+
+    def _session_from(self, data: Dict[str, Any]) -> Session:
+        messages = data["messages"]
+        session = Session(data["session_id"], max(2, len(messages)))
+        session.persona_file = data.get("persona_file")
+        session.next_seq = data["next_seq"]
+        for item in messages:
+            session._push(Message(item["seq"], item["role"], item["content"], item["context"]))
+        return session
+
+    def _get(self, path: str, **kwargs: Any) -> Dict[str, Any]:
+        response = self._http.request("GET", path, **kwargs)
+        self._raise_for_status(response)
+        return response.json()
+
+    def _post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        response = self._http.request("POST", path, json=body)
+        self._raise_for_status(response)
+        return response.json()
+
+    def _raise_for_status(self, response: requests.Response):
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("error", response.text)
+            except ValueError:
+                detail = response.text
+            raise RuntimeError(f"Persona API error {response.status_code}: {detail}")
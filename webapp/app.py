@@ -7,21 +7,39 @@ import os
 import sys
 import re
 import html
-from typing import List, Dict
-from dotenv import load_dotenv
+from typing import Iterator, List, Dict
 
-# Load environment variables from .env file
-load_dotenv()
+# Add the current directory to Python path for imports (once; Streamlit re-runs this script)
+APP_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+if APP_DIRECTORY not in sys.path:
+    sys.path.append(APP_DIRECTORY)
 
-# Add the current directory to Python path for imports
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import bootstrap
 
-from persona_bot import PersonaBot
+# Load environment variables from .env file and configure logging, once per process
+bootstrap.configure()
+
+from persona_bot import PersonaBot, get_shared_engine
+from deadline import CancelToken
+from session_store import Message
+from concurrency import get_background_loop
+from panel import MAX_PANEL_PERSONAS, PersonaPanel
 
 # Security configurations
 MAX_MESSAGE_LENGTH = 2000
 ALLOWED_PERSONA_PATTERN = r'^[a-zA-Z0-9\-_\.]+\.yaml$'
 
+# Use the HTTP API (api.py) instead of an in-process engine when set
+PERSONA_API_URL = os.getenv("PERSONA_API_URL", "").rstrip("/")
+
+# Drive the async engine through one shared background event loop instead of
+# blocking a script thread per request
+USE_ASYNC_ENGINE = os.getenv("PERSONA_BOT_ASYNC", "false").lower() == "true" and not PERSONA_API_URL
+
+# Messages shown in the open transcript; older ones are paginated in an expander.
+# This bounds the work per rerun no matter how long the conversation gets.
+CHAT_VISIBLE_MESSAGES = max(2, int(os.getenv("PERSONA_CHAT_VISIBLE_MESSAGES", "20")))
+
 # Page configuration
 st.set_page_config(
     page_title="AI Discovery Cards - Persona Bot",
@@ -85,19 +103,49 @@ def validate_persona_file(persona_file: str) -> bool:
     
     return True
 
+def get_introduction(persona_bot: PersonaBot) -> str:
+    """Get the persona introduction through the sync or async engine"""
+    if USE_ASYNC_ENGINE:
+        return get_background_loop().run(persona_bot.aget_introduction_message())
+    return persona_bot.get_introduction_message()
+
+def stream_reply(persona_bot: PersonaBot, prompt: str) -> Iterator[str]:
+    """Stream the persona reply through the sync or async engine"""
+    cancel = CancelToken(float(os.getenv("PERSONA_REQUEST_TIMEOUT_SECONDS", "60")))
+    if USE_ASYNC_ENGINE:
+        reply = get_background_loop().iterate(persona_bot.achat_stream(prompt, cancel=cancel))
+    else:
+        reply = persona_bot.chat_stream(prompt, cancel=cancel)
+    try:
+        # Not "yield from": it would close the reply before the token is cancelled
+        for delta in reply:
+            yield delta
+    except GeneratorExit:
+        # Streamlit stops or reruns the script (a new message, a click elsewhere, a closed tab) by raising
+        # StopException/RerunException in the script thread, and the chat loop then closes this generator
+        cancel.cancel("interrupted")
+        raise
+    finally:
+        reply.close()
+
 def initialize_session_state():
     """Initialize Streamlit session state variables"""
     if "persona_bot" not in st.session_state:
-        st.session_state.persona_bot = PersonaBot()
-    
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-    
-    if "current_persona" not in st.session_state:
-        st.session_state.current_persona = None
+        # The engine (Azure client, template, parsed personas, session store) is shared
+        # by every session in the process. The conversation itself lives in the session
+        # store; the ?session= URL parameter resumes it after a reload or restart.
+        session_id = st.query_params.get("session")
+        if PERSONA_API_URL:
+            # Imported here so the in-process setup never loads the HTTP client
+            from api_client import PersonaAPIClient
+            st.session_state.persona_bot = PersonaAPIClient(PERSONA_API_URL, session_id=session_id)
+        else:
+            st.session_state.persona_bot = PersonaBot(get_shared_engine(), session_id=session_id)
+        st.query_params["session"] = st.session_state.persona_bot.session_id
     
-    if "persona_introduced" not in st.session_state:
-        st.session_state.persona_introduced = False
+    # Sequence number of the first message not drawn by the last full run; the chat fragment only draws those
+    if "rendered_seq" not in st.session_state:
+        st.session_state.rendered_seq = 0
 
 def load_persona(persona_file: str):
     """Load a new persona and reset the conversation"""
@@ -107,21 +155,11 @@ def load_persona(persona_file: str):
             st.error("Invalid persona file name. Please select a valid persona.")
             return
         
-        # Load the persona
+        # Load the persona (this resets the conversation)
         persona_config = st.session_state.persona_bot.load_persona(persona_file)
-        st.session_state.current_persona = persona_config
         
-        # Reset conversation
-        st.session_state.messages = []
-        st.session_state.persona_introduced = False
-        
-        # Get introduction message
-        intro_message = st.session_state.persona_bot.get_introduction_message()
-        st.session_state.messages.append({
-            "role": "assistant", 
-            "content": intro_message
-        })
-        st.session_state.persona_introduced = True
+        # Get introduction message (added to the session transcript)
+        get_introduction(st.session_state.persona_bot)
         
         st.success(f"Persona selecionada: {html.escape(persona_config['name'])}")
         
@@ -132,58 +170,75 @@ def load_persona(persona_file: str):
 
 def display_persona_info():
     """Display current persona information in the sidebar"""
-    if st.session_state.current_persona:
-        st.sidebar.subheader("Persona atual:")
-        persona = st.session_state.current_persona
+    persona = st.session_state.persona_bot.current_persona
+    if persona:
+        st.subheader("Persona atual:")
         
-        st.sidebar.write(f"**Nome:** {persona.get('name', 'Unknown')}")
-        st.sidebar.write(f"**Cargo:** {persona.get('role', 'Unknown')}")
-        st.sidebar.write(f"**Industria:** {persona.get('industry', 'Unknown')}")
-        st.sidebar.write(f"**Maturidade Tecnológica:** {persona.get('tech_maturity', 'Unknown')}")
+        st.write(f"**Nome:** {persona.get('name', 'Unknown')}")
+        st.write(f"**Cargo:** {persona.get('role', 'Unknown')}")
+        st.write(f"**Industria:** {persona.get('industry', 'Unknown')}")
+        st.write(f"**Maturidade Tecnológica:** {persona.get('tech_maturity', 'Unknown')}")
         
         # Show pain points
         pain_points = persona.get('pain_points', [])
         if pain_points:
-            st.sidebar.write("**Principais desafios:**")
+            st.write("**Principais desafios:**")
             for point in pain_points:
-                st.sidebar.write(f"• {point}")
+                st.write(f"• {point}")
         
         # Show goals
         goals = persona.get('goals', [])
         if goals:
-            st.sidebar.write("**Expectativas:**")
+            st.write("**Expectativas:**")
             for goal in goals:
-                st.sidebar.write(f"• {goal}")
+                st.write(f"• {goal}")
 
-def main():
-    """Main Streamlit application"""
-    initialize_session_state()
+def render_message(message: Message):
+    with st.chat_message(message.role):
+        st.markdown(message.content)
+
+@st.fragment
+def sidebar():
+    """
+    Persona search, selection and reset
     
-    # Header
-    st.title("🤖 AI Discovery Cards - Persona Bot")
-    st.markdown("---")
+    Runs as a fragment inside the sidebar, so typing a search or changing a
+    filter only reruns this function, not the chat transcript.
+    """
+    st.header("Seleção de Persona")
     
-    # Sidebar for persona selection
-    st.sidebar.header("Seleção de Persona")
+    # The catalog index is parsed once per process; filtering never re-reads the files
+    catalog = st.session_state.persona_bot.catalog
     
-    # Get available personas
-    available_personas = st.session_state.persona_bot.list_available_personas()
+    # Search and filters
+    search = st.text_input("Buscar persona:", placeholder="Nome, cargo ou indústria")
+    industry = st.selectbox(
+        "Indústria:",
+        options=[None] + catalog.industries(),
+        format_func=lambda value: "Todas" if value is None else value
+    )
+    role = st.selectbox(
+        "Cargo:",
+        options=[None] + catalog.roles(industry),
+        format_func=lambda value: "Todos" if value is None else value
+    )
+    matches = catalog.search(search, industry=industry, role=role)
+    labels = {entry.file: entry.label for entry in matches}
     
-    if not available_personas:
-        st.sidebar.error("No persona files found in the 'bots' directory!")
-        st.error("Please ensure you have persona configuration files (*.yaml) in the 'bots' directory.")
-        return
+    if not matches:
+        st.info("Nenhuma persona encontrada com esses filtros.")
     
     # Persona selection dropdown
-    selected_persona = st.sidebar.selectbox(
-        "Escolha uma persona:",
-        options=available_personas,
-        index=0 if available_personas else None,
+    selected_persona = st.selectbox(
+        f"Escolha uma persona ({len(matches)} de {len(catalog.entries())}):",
+        options=list(labels),
+        index=0 if labels else None,
+        format_func=labels.get,
         help="Selecione uma persona de cliente para interagir com ela."
     )
     
-    # Load persona button
-    if st.sidebar.button("Carregar Persona", type="primary"):
+    # Load persona button; a new persona changes the whole page, so rerun the app
+    if st.button("Carregar Persona", type="primary"):
         if selected_persona:
             load_persona(selected_persona)
             st.rerun()
@@ -192,31 +247,55 @@ def main():
     display_persona_info()
     
     # Reset conversation button
-    if st.sidebar.button("Reiniciar conversa"):
-        if st.session_state.current_persona:
-            st.session_state.messages = []
+    if st.button("Reiniciar conversa"):
+        if st.session_state.persona_bot.current_persona:
+            # Resetting picks up personas or templates reloaded since the session started
             st.session_state.persona_bot.reset_conversation()
             # Re-introduce the persona
-            intro_message = st.session_state.persona_bot.get_introduction_message()
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": intro_message
-            })
+            get_introduction(st.session_state.persona_bot)
             st.rerun()
+
+@st.fragment
+def older_messages(messages: List[Message]):
+    """Paginated view of the messages that scrolled out of the open transcript"""
+    pages = (len(messages) + CHAT_VISIBLE_MESSAGES - 1) // CHAT_VISIBLE_MESSAGES
+    with st.expander(f"Mensagens anteriores ({len(messages)})"):
+        # Only the selected page is rendered; changing it reruns just this fragment
+        page = st.number_input("Página", min_value=1, max_value=pages, value=pages) if pages > 1 else 1
+        start = (page - 1) * CHAT_VISIBLE_MESSAGES
+        for message in messages[start:start + CHAT_VISIBLE_MESSAGES]:
+            render_message(message)
+
+def transcript():
+    """
+    Draw the conversation on a full run
     
-    # Main chat interface
-    if not st.session_state.current_persona:
-        st.info("👈 Selecione uma persona e comece a conversar!")
-        return
-    
-    # Chat container
-    chat_container = st.container()
+    The newest CHAT_VISIBLE_MESSAGES are shown; older ones are paginated.
+    These elements stay on screen while the chat fragment reruns.
+    """
+    session = st.session_state.persona_bot.session
+    messages = session.transcript()
+    visible_from = max(0, len(messages) - CHAT_VISIBLE_MESSAGES)
+    if visible_from:
+        older_messages(messages[:visible_from])
+    for message in messages[visible_from:]:
+        render_message(message)
+    st.session_state.rendered_seq = session.next_seq
+
+@st.fragment
+def chat():
+    """
+    Chat input and the messages exchanged since the last full run
     
-    with chat_container:
-        # Display chat messages
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+    Sending a message reruns only this fragment, which draws the turns after
+    the transcript drawn by the full run. Once those reach
+    CHAT_VISIBLE_MESSAGES, the app reruns so the transcript is paginated again.
+    """
+    persona_bot = st.session_state.persona_bot
+    # Read once per run: with the API client or a shared store every read fetches the whole session
+    messages = persona_bot.transcript(st.session_state.rendered_seq)
+    for message in messages:
+        render_message(message)
     
     # Chat input
     if prompt := st.chat_input("Faça uma pergunta..."):
@@ -224,41 +303,179 @@ def main():
         sanitized_prompt = sanitize_input(prompt)
         if not sanitized_prompt:
             st.error("Entrada inválida. Por favor, verifique sua mensagem e tente novamente.")
-            st.stop()
-        
-        # Add user message to chat history
-        st.session_state.messages.append({"role": "user", "content": sanitized_prompt})
+            return
         
-        # Display user message
+        # Display user message; the bot adds the exchange to the session once the reply is complete
         with st.chat_message("user"):
             st.markdown(sanitized_prompt)
         
-        # Generate and display assistant response
+        # Generate and stream assistant response
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
-            with message_placeholder:
-                with st.spinner("Pensando..."):
-                    try:
-                        response = st.session_state.persona_bot.chat(sanitized_prompt)
-                        
-                        # Add assistant response to chat history
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                        
-                    except Exception as e:
-                        error_message = f"Desculpe, encontrei um erro: {html.escape(str(e))}"
-                        response = "Desculpe, encontrei um erro. Por favor, tente novamente ou entre em contato com o suporte se o problema persistir."
-                        
-                        # Log the error for monitoring
-                        st.error(error_message)
-                        st.warning("Este incidente foi registrado para monitoramento de segurança.")
-                        
-                        st.session_state.messages.append({
-                            "role": "assistant", 
-                            "content": response
-                        })
+            response = ""
+            reply = stream_reply(persona_bot, sanitized_prompt)
+            try:
+                for delta in reply:
+                    response += delta
+                    # Render the partial response with a typing cursor
+                    message_placeholder.markdown(response + "▌")
+                
+            except Exception as e:
+                error_message = f"Desculpe, encontrei um erro: {html.escape(str(e))}"
+                response = "Desculpe, encontrei um erro. Por favor, tente novamente ou entre em contato com o suporte se o problema persistir."
+                
+                # Log the error for monitoring
+                st.error(error_message)
+                st.warning("Este incidente foi registrado para monitoramento de segurança.")
+                
+                # Keep the failed exchange in the transcript without sending it to the model
+                persona_bot.add_notice(sanitized_prompt, role="user")
+                persona_bot.add_notice(response)
+            finally:
+                # A rerun or stop interrupts the loop above; closing stops the generation right away
+                reply.close()
             
-            # Replace spinner with actual response
+            # Replace the partial response with the final one
             message_placeholder.markdown(response)
+        
+        # Both the exchange and the notices of a failed reply add two messages
+        if len(messages) + 2 >= CHAT_VISIBLE_MESSAGES:
+            st.rerun()
+
+def panel_sidebar():
+    """
+    Panel persona selection
+    
+    Not a fragment: building or resetting the panel changes the whole page.
+    """
+    st.header("Painel de Personas")
+    catalog = st.session_state.persona_bot.catalog
+    panel = st.session_state.get("panel")
+    
+    industry = st.selectbox(
+        "Indústria:",
+        options=[None] + catalog.industries(),
+        format_func=lambda value: "Todas" if value is None else value,
+        key="panel_industry"
+    )
+    matches = catalog.search("", industry=industry)
+    labels = {entry.file: entry.label for entry in matches}
+    current = [persona_file for persona_file in (panel.bots if panel else []) if persona_file in labels]
+    selected = st.multiselect(
+        f"Personas do painel (até {MAX_PANEL_PERSONAS}):",
+        options=list(labels),
+        default=current or list(labels)[:MAX_PANEL_PERSONAS],
+        format_func=labels.get,
+        max_selections=MAX_PANEL_PERSONAS,
+        help="Todas as personas do painel respondem à mesma pergunta ao mesmo tempo."
+    )
+    
+    if st.button("Montar painel", type="primary", disabled=not selected):
+        if all(validate_persona_file(persona_file) for persona_file in selected):
+            try:
+                # Conversations already open for a persona that stays on the panel are kept
+                panel = PersonaPanel(
+                    st.session_state.persona_bot.engine,
+                    selected,
+                    session_ids=panel.session_ids if panel else None
+                )
+                panel.introduce()
+                st.session_state.panel = panel
+                st.rerun()
+            except Exception as e:
+                st.error(f"Erro montando o painel: {html.escape(str(e))}")
+        else:
+            st.error("Invalid persona file name. Please select a valid persona.")
+    
+    if panel and st.button("Reiniciar painel"):
+        panel.reset()
+        panel.introduce()
+        st.rerun()
+
+@st.fragment
+def panel_chat():
+    """
+    One column per panel persona; a question streams every answer side by side
+    
+    Runs as a fragment like chat(), so asking the panel does not redraw the sidebar.
+    """
+    panel = st.session_state.panel
+    columns = st.columns(len(panel.bots))
+    answer_areas = {}
+    for column, (persona_file, bot) in zip(columns, panel.bots.items()):
+        with column:
+            persona = bot.current_persona or {}
+            st.subheader(persona.get('name', persona_file))
+            st.caption(f"{persona.get('role', '')} · {persona.get('industry', '')}")
+            for message in bot.transcript()[-CHAT_VISIBLE_MESSAGES:]:
+                render_message(message)
+            answer_areas[persona_file] = st.container()
+    
+    if prompt := st.chat_input("Pergunte ao painel..."):
+        sanitized_prompt = sanitize_input(prompt)
+        if not sanitized_prompt:
+            st.error("Entrada inválida. Por favor, verifique sua mensagem e tente novamente.")
+            return
+        
+        placeholders = {}
+        for persona_file, area in answer_areas.items():
+            with area:
+                with st.chat_message("user"):
+                    st.markdown(sanitized_prompt)
+                with st.chat_message("assistant"):
+                    placeholders[persona_file] = st.empty()
+        
+        answers = {persona_file: "" for persona_file in panel.bots}
+        try:
+            # Answers arrive interleaved; each column shows its own with a typing cursor until done
+            for delta in panel.ask(sanitized_prompt):
+                if delta.done:
+                    placeholders[delta.persona_file].markdown(answers[delta.persona_file])
+                else:
+                    answers[delta.persona_file] += delta.text
+                    placeholders[delta.persona_file].markdown(answers[delta.persona_file] + "▌")
+        except Exception as e:
+            st.error(f"Desculpe, encontrei um erro: {html.escape(str(e))}")
+            st.warning("Este incidente foi registrado para monitoramento de segurança.")
+
+def main():
+    """Main Streamlit application"""
+    initialize_session_state()
+    
+    # Header
+    st.title("🤖 AI Discovery Cards - Persona Bot")
+    st.markdown("---")
+    
+    if not st.session_state.persona_bot.catalog.entries():
+        st.sidebar.error("No persona files found in the 'bots' directory!")
+        st.error("Please ensure you have persona configuration files (*.yaml) in the 'bots' directory.")
+        return
+    
+    # Panel mode fans one question out to several personas; it needs the in-process engine
+    mode = "Conversa"
+    if not PERSONA_API_URL:
+        mode = st.sidebar.radio("Modo:", ["Conversa", "Painel"], horizontal=True)
+    
+    if mode == "Painel":
+        with st.sidebar:
+            panel_sidebar()
+        if "panel" not in st.session_state:
+            st.info("👈 Escolha as personas e monte o painel para perguntar a todas ao mesmo tempo!")
+            return
+        panel_chat()
+        return
+    
+    # Sidebar for persona selection
+    with st.sidebar:
+        sidebar()
+    
+    # Main chat interface
+    if not st.session_state.persona_bot.current_persona:
+        st.info("👈 Selecione uma persona e comece a conversar!")
+        return
+    
+    transcript()
+    chat()
     
     # Configuration help
     # with st.sidebar:
@@ -0,0 +1,341 @@
+"""
+Batch runner
+Answers a question bank with every persona (the persona × question matrix) through the async Azure OpenAI
+client, with bounded concurrency, and appends one JSONL record per finished item so an interrupted run
+resumes where it stopped
+
+    python webapp/batch.py questions.jsonl --output answers.jsonl --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import bootstrap
+from cache import content_hash
+from concurrency import get_background_loop
+from deadline import CancelToken
+from persona_bot import AzureOpenAIClient, PersonaLoader, PromptBuilder
+
+logger = logging.getLogger(__name__)
+
+# Statuses of finished items; anything else (errors) is retried by the next run
+DONE_STATUSES = ("ok", "filtered")
+
+class Question(NamedTuple):
+    """One entry of the question file: a single question or a multi-turn script"""
+    id: str
+    turns: List[str]
+    # Persona files to ask; None for every persona of the run
+    personas: Optional[List[str]] = None
+
+def read_questions(path: str) -> Iterator[Question]:
+    """
+    Stream the questions of a file, one entry at a time
+
+    A ``.jsonl`` file holds one object per line: ``{"id": ..., "question": text}``
+    or, for a multi-turn script, ``{"id": ..., "turns": [text, ...]}``, with an
+    optional ``"personas": [file, ...]``. Any other file holds one question per
+    line; blank lines and lines starting with ``#`` are skipped. Entries
+    without an id are identified by a hash of their turns.
+
+    Raises:
+        ValueError: For an entry that is not valid JSON or has no question
+    """
+    jsonl = path.endswith(".jsonl")
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or (not jsonl and line.startswith("#")):
+                continue
+            if not jsonl:
+                yield Question(content_hash([line])[:12], [line])
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: invalid JSON: {e}")
+            turns = entry.get("turns") if isinstance(entry, dict) else None
+            if turns is None and isinstance(entry, dict) and "question" in entry:
+                turns = [entry["question"]]
+            if not turns or not all(isinstance(turn, str) and turn.strip() for turn in turns):
+                raise ValueError(f"{path}:{number}: expected a 'question' or a list of 'turns'")
+            personas = entry.get("personas")
+            yield Question(str(entry.get("id") or content_hash(turns)[:12]), turns, personas)
+
+class ResultLog:
+    """
+    Append-only JSONL output that is also the run's checkpoint
+
+    Every finished item is written (and flushed) as soon as it completes, so
+    records are in completion order. An item is identified by its persona,
+    question id and the hash of the persona's system prompt: after a prompt
+    or template change, the items it affects run again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def load(self) -> Set[Tuple[str, str, str]]:
+        """Keys of the items a previous run finished; drops a record left half-written by an interruption"""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            complete = data.rfind(b"\n") + 1
+            if complete < len(data):
+                logger.warning(f"Dropping an incomplete last record from {self.path}")
+                f.truncate(complete)
+        for line in data[:complete].decode("utf-8").splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping an unreadable record in {self.path}")
+                continue
+            if record.get("status") in DONE_STATUSES:
+                done.add(self.key(record["persona"], record["question_id"], record["prompt_hash"]))
+        return done
+
+    @staticmethod
+    def key(persona_file: str, question_id: str, prompt_hash: str) -> Tuple[str, str, str]:
+        return persona_file, question_id, prompt_hash
+
+    def write(self, record: Dict[str, Any]):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+class BatchRunner:
+    """
+    Runs the persona × question matrix on the shared background event loop
+
+    A fixed number of workers take items from a bounded queue that is filled
+    while the question file is read, so memory stays flat however long the
+    file is. Calls go through the client's process-wide limiter and each
+    deployment's rate limiter, which hold throughput at the quota and retry
+    429s. Turns of a multi-turn script run in order, each with the previous
+    answers as history.
+    """
+
+    def __init__(self, client: AzureOpenAIClient, loader: PersonaLoader, prompt_builder: PromptBuilder,
+                 concurrency: int = 16, timeout: float = None, progress_interval: float = 10.0):
+        """
+        Args:
+            client: Azure OpenAI client
+            loader: Loads the persona files
+            prompt_builder: Renders their system prompts
+            concurrency: Items in progress at once
+            timeout: Deadline of each turn in seconds (None for none)
+            progress_interval: Seconds between progress log lines
+        """
+        self.client = client
+        self.loader = loader
+        self.prompt_builder = prompt_builder
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.progress_interval = progress_interval
+        self._personas: Dict[str, Tuple[Dict[str, Any], str, str]] = {}
+        # Persona files that failed to load (reported once)
+        self._broken: Set[str] = set()
+        self.stats = {"queued": 0, "skipped": 0, "ok": 0, "filtered": 0, "failed": 0}
+
+    def persona(self, persona_file: str) -> Tuple[Dict[str, Any], str, str]:
+        """Persona config, system prompt and prompt hash, loaded once per run"""
+        persona = self._personas.get(persona_file)
+        if persona is None:
+            config = self.loader.load_persona(persona_file)
+            system_prompt = self.prompt_builder.build_system_prompt(config)
+            persona = self._personas[persona_file] = (config, system_prompt, content_hash(system_prompt)[:16])
+        return persona
+
+    async def run(self, questions: Iterator[Question], persona_files: List[str], log: ResultLog,
+                  done: Set[Tuple[str, str, str]] = frozenset()) -> Dict[str, int]:
+        """
+        Answer every question with every persona, skipping the items in done
+
+        Returns:
+            Counts of queued, skipped, ok, filtered and failed items
+
+        Raises:
+            OSError, ValueError: If the question file cannot be read (after the items queued so far finish)
+        """
+        queue: "asyncio.Queue[Optional[Tuple[str, Question]]]" = asyncio.Queue(maxsize=2 * self.concurrency)
+        stopped = asyncio.Event()
+        workers = [asyncio.ensure_future(self._worker(queue, log, stopped)) for _ in range(self.concurrency)]
+        reporter = asyncio.ensure_future(self._report_progress())
+        error = None
+        try:
+            try:
+                for question in questions:
+                    for persona_file in question.personas or persona_files:
+                        try:
+                            prompt_hash = self.persona(persona_file)[2]
+                        except Exception as e:
+                            self._record_failure(log, persona_file, question, e)
+                            continue
+                        if ResultLog.key(persona_file, question.id, prompt_hash) in done:
+                            self.stats["skipped"] += 1
+                            continue
+                        self.stats["queued"] += 1
+                        await queue.put((persona_file, question))
+            except (OSError, ValueError) as e:
+                # Broken question file: finish the items already queued before reporting it
+                error = e
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            # Interrupted: nothing may reach the log once run() returns
+            stopped.set()
+            for worker in workers:
+                worker.cancel()
+            reporter.cancel()
+        if error is not None:
+            raise error
+        return dict(self.stats)
+
+    async def _worker(self, queue: "asyncio.Queue[Optional[Tuple[str, Question]]]", log: ResultLog,
+                      stopped: asyncio.Event):
+        while not stopped.is_set():
+            item = await queue.get()
+            if item is None:
+                return
+            record = await self.answer(*item)
+            if stopped.is_set():
+                return
+            self.stats["failed" if record["status"] == "error" else record["status"]] += 1
+            log.write(record)
+
+    async def answer(self, persona_file: str, question: Question) -> Dict[str, Any]:
+        """Run one item (every turn of the question) and return its record"""
+        config, system_prompt, prompt_hash = self.persona(persona_file)
+        name = config.get("name", "Unknown")
+        history: List[Dict[str, str]] = []
+        turns: List[Dict[str, str]] = []
+        status, error = "ok", None
+        started = time.perf_counter()
+        for text in question.turns:
+            try:
+                answer = await self.client.acomplete(
+                    system_prompt, text, history, persona=name, cancel=CancelToken(self.timeout)
+                )
+            except Exception as e:
+                logger.warning(f"{persona_file} / {question.id} failed: {e}")
+                status, error = "error", f"{type(e).__name__}: {e}"
+                break
+            if answer is None:
+                # Filtered: later turns would continue from a reply the persona never gave
+                status = "filtered"
+                break
+            turns.append({"question": text, "answer": answer})
+            history.extend([{"role": "user", "content": text}, {"role": "assistant", "content": answer}])
+        record = {
+            "persona": persona_file,
+            "persona_name": name,
+            "question_id": question.id,
+            "prompt_hash": prompt_hash,
+            "status": status,
+            "turns": turns,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        if error:
+            record["error"] = error
+        return record
+
+    def _record_failure(self, log: ResultLog, persona_file: str, question: Question, error: Exception):
+        """Record an item whose persona could not be loaded"""
+        if persona_file not in self._broken:
+            self._broken.add(persona_file)
+            logger.error(f"Cannot load persona {persona_file}: {error}")
+        self.stats["failed"] += 1
+        log.write({
+            "persona": persona_file,
+            "question_id": question.id,
+            "prompt_hash": None,
+            "status": "error",
+            "turns": [],
+            "error": f"{type(error).__name__}: {error}",
+            "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        })
+
+    async def _report_progress(self):
+        started = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            finished = self.stats["ok"] + self.stats["filtered"] + self.stats["failed"]
+            rate = finished / (time.perf_counter() - started)
+            logger.info(f"Batch progress: {finished}/{self.stats['queued']} items, {rate:.1f}/s, "
+                        f"{self.stats['failed']} failed, {self.stats['skipped']} skipped")
+
+def main() -> int:
+    # .env may set the defaults below
+    bootstrap.configure()
+    parser = argparse.ArgumentParser(description="Answer a question bank with every persona and write the answers to JSONL")
+    parser.add_argument("questions", help="Question file: .jsonl entries or one question per line")
+    parser.add_argument("--output", required=True, help="JSONL output; rerunning with the same file resumes the run")
+    parser.add_argument("--personas", nargs="+", help="Persona files to ask (default: every persona in the bots directory)")
+    parser.add_argument("--bots-dir", help="Persona directory (default: bots/)")
+    parser.add_argument("--template", help="Prompt template file (default: the PERSONA_PROMPT_LAYOUT template)")
+    parser.add_argument("--concurrency", type=int,
+                        default=int(os.getenv("PERSONA_MAX_CONCURRENT_REQUESTS", "16")),
+                        help="Items in progress at once (also the client's concurrency limit)")
+    parser.add_argument("--timeout", type=float, default=float(os.getenv("PERSONA_REQUEST_TIMEOUT_SECONDS", "60")),
+                        help="Deadline of each turn in seconds (0 for none)")
+    args = parser.parse_args()
+    # The client sizes its limiters from the environment when it is created
+    os.environ["PERSONA_MAX_CONCURRENT_REQUESTS"] = str(args.concurrency)
+
+    loader = PersonaLoader(args.bots_dir)
+    persona_files = sorted(args.personas or loader.list_available_personas())
+    if not persona_files:
+        logger.error(f"No personas found in {loader.bots_directory}")
+        return 1
+    runner = BatchRunner(AzureOpenAIClient(), loader, PromptBuilder(args.template),
+                         concurrency=args.concurrency, timeout=args.timeout or None)
+    try:
+        for persona_file in persona_files:
+            runner.persona(persona_file)
+    except Exception as e:
+        logger.error(f"Cannot load persona {persona_file}: {e}")
+        return 1
+    log = ResultLog(args.output)
+    done = log.load()
+    if done:
+        logger.info(f"Resuming: {len(done)} items already answered in {args.output}")
+
+    started = time.perf_counter()
+    try:
+        stats = get_background_loop().run(runner.run(read_questions(args.questions), persona_files, log, done))
+    except KeyboardInterrupt:
+        logger.warning(f"Interrupted; run the same command again to resume from {args.output}")
+        return 130
+    except (OSError, ValueError) as e:
+        # Unreadable question file: the items finished so far are kept
+        logger.error(f"Batch stopped: {e}")
+        return 1
+    finally:
+        log.close()
+    elapsed = time.perf_counter() - started
+    finished = stats["ok"] + stats["filtered"] + stats["failed"]
+    print(f"{finished} items in {elapsed:.1f}s ({finished / elapsed if elapsed else 0:.1f}/s): {stats['ok']} ok, "
+          f"{stats['filtered']} filtered, {stats['failed']} failed, {stats['skipped']} already done")
+    return 1 if stats["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
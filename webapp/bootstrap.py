@@ -0,0 +1,23 @@
+"""
+Process start-up configuration
+Loads .env and configures logging once per process, however often Streamlit re-runs the app script
+"""
+import logging
+import threading
+
+_configured = False
+_configure_lock = threading.Lock()
+
+def configure():
+    """Load environment variables from .env and configure logging (idempotent)"""
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        # Imported here so processes that never call configure() do not pay for it
+        from dotenv import load_dotenv
+        load_dotenv()
+        logging.basicConfig(level=logging.INFO)
+        _configured = True
@@ -0,0 +1,175 @@
+"""
+Pre-compiled persona bundle
+Personas and the prompt template validated at deploy time and stored as one JSON file with content hashes
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache import content_hash
+from template import DEFAULT_PERSONA_VALUES, CompiledTemplate
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = 1
+BUNDLE_FILENAME = "persona-bundle.json"
+PERSONA_EXTENSIONS = (".yaml", ".yml")
+
+# Resolved on the first parse to libyaml's C loader (several times faster) when
+# PyYAML was built with it. PyYAML is only imported once a persona is not served
+# from the bundle, so a fully bundled start never pays for it.
+SafeLoader = None
+
+class BundleError(ValueError):
+    """Raised when persona files or the template fail validation"""
+
+class PersonaParseError(BundleError):
+    """Raised when a persona file is not valid YAML"""
+
+def parse_yaml(text: str) -> Any:
+    """
+    Parse YAML with the libyaml C loader when available
+
+    Raises:
+        PersonaParseError: If the text is not valid YAML
+    """
+    global SafeLoader
+    import yaml
+    if SafeLoader is None:
+        SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    try:
+        return yaml.load(text, Loader=SafeLoader)
+    except yaml.YAMLError as e:
+        raise PersonaParseError(str(e)) from e
+
+def validate_persona(persona_file: str, persona_config: Any) -> List[str]:
+    """
+    Check a parsed persona file
+
+    Returns:
+        List of problems (empty if the persona is valid)
+    """
+    if not isinstance(persona_config, dict):
+        return [f"{persona_file}: must contain a mapping"]
+    problems = []
+    if not isinstance(persona_config.get("name"), str) or not persona_config["name"].strip():
+        problems.append(f"{persona_file}: 'name' is required")
+    for key in ("pain_points", "goals"):
+        if key in persona_config and not isinstance(persona_config[key], list):
+            problems.append(f"{persona_file}: '{key}' must be a list")
+    return problems
+
+def build_bundle(bots_directory: str, template_path: str) -> Dict[str, Any]:
+    """
+    Parse and validate every persona file and the template
+
+    Args:
+        bots_directory: Directory containing the persona YAML files
+        template_path: Path of the prompt template
+
+    Returns:
+        Bundle dictionary, ready for write_bundle
+
+    Raises:
+        BundleError: If any persona file or the template is invalid
+    """
+    with open(template_path, "r", encoding="utf-8") as f:
+        template_content = f.read()
+    if not template_content.strip():
+        raise BundleError(f"{template_path}: template is empty")
+    template = CompiledTemplate(template_content)
+
+    personas = {}
+    problems = []
+    for persona_file in sorted(os.listdir(bots_directory)):
+        if not persona_file.endswith(PERSONA_EXTENSIONS):
+            continue
+        with open(os.path.join(bots_directory, persona_file), "r", encoding="utf-8") as f:
+            text = f.read()
+        try:
+            persona_config = parse_yaml(text)
+        except PersonaParseError as e:
+            problems.append(f"{persona_file}: {e}")
+            continue
+        persona_problems = validate_persona(persona_file, persona_config)
+        if persona_problems:
+            problems.extend(persona_problems)
+            continue
+        unknown, _ = template.check(persona_config, DEFAULT_PERSONA_VALUES)
+        if unknown:
+            logger.warning(f"{persona_file}: template placeholders with no value: {', '.join(unknown)}")
+        personas[persona_file] = {"hash": content_hash(text), "config": persona_config}
+
+    if problems:
+        raise BundleError("Invalid persona files:\n" + "\n".join(problems))
+
+    return {
+        "format": BUNDLE_FORMAT,
+        "template": {"hash": content_hash(template_content)},
+        "personas": personas,
+    }
+
+def write_bundle(bundle: Dict[str, Any], path: str):
+    """Write a bundle atomically (readers never see a partial file)"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(bundle, f, ensure_ascii=False, separators=(",", ":"), default=str)
+    os.replace(temp_path, path)
+
+class PersonaBundle:
+    """
+    Parsed configs from a bundle, used instead of YAML when the file is unchanged
+
+    Lookups take the hash of the file's current text and only return the
+    bundled config if it still matches, so an edited (or hot-reloaded) file
+    always falls back to YAML parsing. Returned configs are shared and read-only.
+    """
+
+    def __init__(self, data: Dict[str, Any], path: str = ""):
+        self.path = path
+        self.template_hash = data.get("template", {}).get("hash")
+        self._personas: Dict[str, Tuple[str, Dict[str, Any]]] = {
+            persona_file: (entry["hash"], entry["config"])
+            for persona_file, entry in data.get("personas", {}).items()
+        }
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: str) -> Optional["PersonaBundle"]:
+        """Read a bundle in a single I/O; return None if it is missing or unreadable"""
+        try:
+            data = json.loads(Path(path).read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring persona bundle {path}: {e}")
+            return None
+        if data.get("format") != BUNDLE_FORMAT:
+            logger.warning(f"Ignoring persona bundle {path}: unsupported format {data.get('format')}")
+            return None
+        logger.info(f"Loaded persona bundle with {len(data.get('personas', {}))} personas")
+        return cls(data, path)
+
+    def lookup(self, persona_file: str, file_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the bundled config for a file if its content is unchanged
+
+        Args:
+            persona_file: Persona file name
+            file_hash: content_hash of the file's current text
+
+        Returns:
+            Bundled config, or None if the file is not bundled or has changed
+        """
+        entry = self._personas.get(persona_file)
+        if entry is not None and entry[0] == file_hash:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {"personas": len(self._personas), "hits": self.hits, "misses": self.misses}
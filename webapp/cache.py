@@ -0,0 +1,394 @@
+"""
+In-process caches for the persona bot
+Bounded LRU/TTL cache primitives and the persona introduction cache built on them
+"""
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def content_hash(value: Any) -> str:
+    """
+    Return a stable SHA-256 hex digest of a string or JSON-serializable value
+
+    Args:
+        value: String, or any value json.dumps can serialize (dict keys are sorted)
+
+    Returns:
+        Hex digest string
+    """
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a fixed TTL
+
+    The least recently used entry is evicted once ``maxsize`` is reached, and
+    entries older than ``ttl`` seconds are treated as missing.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600.0, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, stored_at = entry
+            if self._clock() - stored_at > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Store value under key, evicting the least recently used entry if full"""
+        with self._lock:
+            self._entries[key] = (value, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove key and return its value (or default)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and the current size"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+class IntroCache:
+    """
+    Cache of persona introduction messages with several variants per key
+
+    Keys are built by the caller from the persona content hash, template hash,
+    deployment name and sampling settings. Until ``variants`` introductions are
+    stored for a key, a new one is generated on lookup; afterwards one of the
+    stored variants is returned at random. Concurrent lookups for the same key
+    share a single generation instead of stampeding the model.
+    """
+
+    def __init__(self, variants: int = 3, ttl: float = 3600.0, maxsize: int = 512):
+        self.variants = max(1, variants)
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, threading.Event] = {}
+        self._async_in_flight: Dict[Hashable, "asyncio.Future"] = {}
+
+    @staticmethod
+    def make_key(persona_config: Dict[str, Any], prompt_hash: str, deployment_name: str,
+                 sampling_params: Dict[str, Any]) -> str:
+        """
+        Build the cache key for a persona introduction
+
+        The hash of the rendered system prompt covers both the persona and the
+        template version, so reloaded personas or templates never hit stale entries.
+        """
+        return content_hash({
+            "persona": content_hash(persona_config),
+            "prompt": prompt_hash,
+            "deployment": deployment_name,
+            "sampling": sampling_params,
+        })
+
+    def get_or_generate(self, key: Hashable, generate: Callable[[], Optional[str]],
+                        wait_timeout: float = 60.0) -> Optional[str]:
+        """
+        Return a cached introduction for key, generating one if needed
+
+        Args:
+            key: Cache key (see make_key)
+            generate: Callable returning a new introduction, or None if it failed
+                (failures are never cached)
+            wait_timeout: Seconds to wait for another thread's in-flight generation
+
+        Returns:
+            Introduction text, or None if generation failed
+        """
+        while True:
+            with self._lock:
+                variants: List[str] = self._cache.get(key) or []
+                if len(variants) >= self.variants:
+                    return random.choice(variants)
+
+                event = self._in_flight.get(key)
+                if event is not None and variants:
+                    # Someone is already adding a variant; serve an existing one
+                    return random.choice(variants)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+
+            if not owner:
+                event.wait(wait_timeout)
+                continue
+
+            try:
+                intro = generate()
+                if intro:
+                    self.add(key, intro)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                event.set()
+            return intro
+
+    async def get_or_generate_async(self, key: Hashable, generate: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        """
+        Async variant of get_or_generate for callers on the background event loop
+
+        Args:
+            key: Cache key (see make_key)
+            generate: Coroutine function returning a new introduction, or None if it failed
+
+        Returns:
+            Introduction text, or None if generation failed
+        """
+        while True:
+            variants: List[str] = self._cache.get(key) or []
+            if len(variants) >= self.variants:
+                return random.choice(variants)
+
+            pending = self._async_in_flight.get(key)
+            if pending is not None:
+                if variants:
+                    return random.choice(variants)
+                await asyncio.shield(pending)
+                continue
+
+            pending = self._async_in_flight[key] = asyncio.get_running_loop().create_future()
+            try:
+                intro = await generate()
+                if intro:
+                    self.add(key, intro)
+                return intro
+            finally:
+                del self._async_in_flight[key]
+                pending.set_result(None)
+
+    def add(self, key: Hashable, intro: str):
+        """Store an additional introduction variant for key"""
+        with self._lock:
+            variants = list(self._cache.get(key) or [])
+            if intro not in variants:
+                variants.append(intro)
+            self._cache.set(key, variants[-self.variants:])
+
+    def is_full(self, key: Hashable) -> bool:
+        """Return True if key already holds the configured number of variants"""
+        return len(self._cache.get(key) or []) >= self.variants
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+def normalize_question(text: str) -> str:
+    """
+    Normalize a user question for cache matching
+
+    Undoes the HTML escaping applied by the web app's sanitize_input, strips
+    accents, case-folds, drops punctuation and collapses whitespace, so that
+    "Quais são seus principais desafios?" and "quais sao seus  principais
+    desafios" normalize to the same string.
+    """
+    text = html.unescape(text)
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+def _trigram_vector(text: str) -> Tuple[Counter, float]:
+    """Character trigram counts of text and their Euclidean norm"""
+    padded = f"  {text} "
+    grams = Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+    norm = math.sqrt(sum(count * count for count in grams.values()))
+    return grams, norm
+
+def _cosine(a: Tuple[Counter, float], b: Tuple[Counter, float]) -> float:
+    grams_a, norm_a = a
+    grams_b, norm_b = b
+    if not norm_a or not norm_b:
+        return 0.0
+    if len(grams_a) > len(grams_b):
+        grams_a, grams_b = grams_b, grams_a
+    dot = sum(count * grams_b.get(gram, 0) for gram, count in grams_a.items())
+    return dot / (norm_a * norm_b)
+
+class ResponseCache:
+    """
+    Cache of persona answers for repeated first-turn and short-history questions
+
+    Entries are grouped in namespaces keyed by the system prompt hash and the
+    (short) conversation history, and within a namespace by the normalized
+    question. On an exact miss, a character-trigram cosine similarity search
+    over the namespace finds near-duplicates above ``similarity_threshold``.
+    Storage is bounded by LRU and TTL eviction; the similarity index holds at
+    most ``maxsize`` questions too, dropping those of the least recently used
+    namespaces first.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0, similarity_threshold: float = 0.9):
+        self.similarity_threshold = similarity_threshold
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # Namespaces in LRU order; every conversation turn opens a new one
+        self._index: "OrderedDict[str, OrderedDict[str, Tuple[Counter, float]]]" = OrderedDict()
+        self._indexed = 0
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def get(self, system_prompt: str, conversation_history: List[Dict[str, str]], question: str) -> Optional[str]:
+        """
+        Return the cached answer for question, or None on a miss
+
+        Args:
+            system_prompt: System prompt of the persona being asked
+            conversation_history: History preceding the question
+            question: The user's question
+        """
+        namespace = self._namespace(system_prompt, conversation_history)
+        normalized = normalize_question(question)
+
+        response = self._cache.get((namespace, normalized))
+        if response is not None:
+            self._count("hits")
+            return response
+
+        match = self._find_similar(namespace, normalized)
+        if match is not None:
+            response = self._cache.get((namespace, match))
+            if response is not None:
+                self._count("similar_hits")
+                return response
+            self._forget(namespace, match)
+
+        self._count("misses")
+        return None
+
+    def set(self, system_prompt: str, conversation_history: List[Dict[str, str]], question: str, response: str):
+        """Store the answer to question"""
+        namespace = self._namespace(system_prompt, conversation_history)
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+
+        self._cache.set((namespace, normalized), response)
+        with self._lock:
+            entries = self._index.setdefault(namespace, OrderedDict())
+            self._index.move_to_end(namespace)
+            if normalized not in entries:
+                self._indexed += 1
+            entries[normalized] = _trigram_vector(normalized)
+            entries.move_to_end(normalized)
+            while self._indexed > self._cache.maxsize:
+                oldest_namespace, oldest = next(iter(self._index.items()))
+                oldest.popitem(last=False)
+                self._indexed -= 1
+                if not oldest:
+                    del self._index[oldest_namespace]
+
+    def clear(self):
+        self._cache.clear()
+        with self._lock:
+            self._index.clear()
+            self._indexed = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and storage stats"""
+        stats = self._cache.stats()
+        with self._lock:
+            stats.update({
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "indexed": self._indexed,
+            })
+        return stats
+
+    def _find_similar(self, namespace: str, normalized: str) -> Optional[str]:
+        if self.similarity_threshold >= 1.0 or not normalized:
+            return None
+        vector = _trigram_vector(normalized)
+        best, best_score = None, self.similarity_threshold
+        with self._lock:
+            entries = self._index.get(namespace)
+            if entries is None:
+                return None
+            self._index.move_to_end(namespace)
+            candidates = list(entries.items())
+        for candidate, candidate_vector in candidates:
+            score = _cosine(vector, candidate_vector)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _forget(self, namespace: str, normalized: str):
+        """Drop an index entry whose cached answer was evicted or expired"""
+        with self._lock:
+            entries = self._index.get(namespace)
+            if entries is not None and entries.pop(normalized, None) is not None:
+                self._indexed -= 1
+                if not entries:
+                    del self._index[namespace]
+
+    def _namespace(self, system_prompt: str, conversation_history: List[Dict[str, str]]) -> str:
+        history = [
+            (message["role"], normalize_question(message["content"]) if message["role"] == "user" else message["content"])
+            for message in conversation_history
+        ]
+        return content_hash({"prompt": content_hash(system_prompt), "history": history})
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
@@ -0,0 +1,184 @@
+"""
+Persona catalog
+A compact metadata index of the persona files in bots/, parsed once and searchable without touching disk
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from bundle import PERSONA_EXTENSIONS, PersonaBundle, PersonaParseError, parse_yaml
+from cache import content_hash, normalize_question
+
+logger = logging.getLogger(__name__)
+
+class PersonaEntry:
+    """Index entry for one persona file; the full config is loaded only when the persona is used"""
+
+    __slots__ = ("file", "name", "role", "industry", "tech_maturity", "file_hash", "mtime", "size", "search_text")
+
+    def __init__(self, file: str, config: Dict[str, Any], file_hash: str, mtime: float, size: int):
+        self.file = file
+        # Roles, industries and maturity levels repeat across personas; share the strings
+        self.name = str(config.get("name") or file)
+        self.role = sys.intern(str(config.get("role") or ""))
+        self.industry = sys.intern(str(config.get("industry") or ""))
+        self.tech_maturity = sys.intern(str(config.get("tech_maturity") or ""))
+        self.file_hash = file_hash
+        self.mtime = mtime
+        self.size = size
+        self.search_text = normalize_question(f"{self.name} {self.role} {self.industry}")
+
+    @property
+    def label(self) -> str:
+        """Display text for selection widgets"""
+        details = " · ".join(part for part in (self.role, self.industry) if part)
+        return f"{self.name} — {details}" if details else self.name
+
+class PersonaCatalog:
+    """
+    Metadata index of the persona files in a directory
+
+    Each file is parsed once; afterwards listing, filtering and searching only
+    touch the in-memory index. ``refresh`` re-stats the directory and re-parses
+    only files whose size or modification time changed. Listing calls trigger
+    a refresh at most every ``rescan_interval`` seconds (0 disables it).
+    """
+
+    def __init__(self, bots_directory: str, rescan_interval: float = 60.0, bundle: PersonaBundle = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            bots_directory: Directory containing the persona YAML files
+            rescan_interval: Minimum seconds between automatic directory rescans
+            bundle: Pre-parsed configs used instead of YAML for unchanged files
+            clock: Monotonic time source (overridable in tests)
+        """
+        self.bots_directory = bots_directory
+        self.bundle = bundle
+        self.rescan_interval = rescan_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: Dict[str, PersonaEntry] = {}
+        self._sorted: List[PersonaEntry] = []
+        # (mtime, size) of files that failed to parse, so they are not re-parsed every scan
+        self._invalid: Dict[str, tuple] = {}
+        self._scanned_at: Optional[float] = None
+
+    def refresh(self) -> bool:
+        """
+        Rescan the directory, re-indexing new and changed files
+
+        Returns:
+            True if the index changed
+        """
+        with self._lock:
+            self._scanned_at = self._clock()
+            try:
+                scanned = {
+                    entry.name: entry.stat()
+                    for entry in os.scandir(self.bots_directory)
+                    if entry.is_file() and entry.name.endswith(PERSONA_EXTENSIONS)
+                }
+            except FileNotFoundError:
+                scanned = {}
+            except OSError as e:
+                logger.error(f"Error listing persona files: {e}")
+                return False
+
+            entries = {}
+            for file, stat in scanned.items():
+                current = self._entries.get(file)
+                if current is not None and current.mtime == stat.st_mtime and current.size == stat.st_size:
+                    entries[file] = current
+                    continue
+                if self._invalid.get(file) == (stat.st_mtime, stat.st_size):
+                    entry = None
+                else:
+                    entry = self._index_file(file, stat)
+                if entry is None:
+                    self._invalid[file] = (stat.st_mtime, stat.st_size)
+                    # Keep serving the last valid version of a file that was broken by an edit
+                    if current is not None:
+                        entries[file] = current
+                    continue
+                self._invalid.pop(file, None)
+                entries[file] = entry
+
+            changed = entries.keys() != self._entries.keys() or any(
+                entry.file_hash != self._entries[file].file_hash for file, entry in entries.items()
+            )
+            self._entries = entries
+            if changed:
+                self._sorted = sorted(entries.values(), key=lambda item: (item.name.casefold(), item.file))
+                logger.info(f"Persona catalog indexed {len(entries)} personas")
+            return changed
+
+    def files(self) -> List[str]:
+        """Persona file names, sorted by persona name"""
+        return [entry.file for entry in self.entries()]
+
+    def entries(self) -> List[PersonaEntry]:
+        """Every index entry, sorted by persona name"""
+        self._maybe_refresh()
+        return self._sorted
+
+    def get(self, file: str) -> Optional[PersonaEntry]:
+        self._maybe_refresh()
+        return self._entries.get(file)
+
+    def search(self, query: str = "", industry: str = None, role: str = None) -> List[PersonaEntry]:
+        """
+        Filter the index
+
+        Args:
+            query: Free text matched (accent- and case-insensitively) against name, role and industry
+            industry: Exact industry to keep, or None for all
+            role: Exact role to keep, or None for all
+
+        Returns:
+            Matching entries, sorted by persona name
+        """
+        terms = normalize_question(query).split() if query else []
+        return [
+            entry for entry in self.entries()
+            if (industry is None or entry.industry == industry)
+            and (role is None or entry.role == role)
+            and all(term in entry.search_text for term in terms)
+        ]
+
+    def industries(self) -> List[str]:
+        return sorted({entry.industry for entry in self.entries() if entry.industry})
+
+    def roles(self, industry: str = None) -> List[str]:
+        return sorted({
+            entry.role for entry in self.entries()
+            if entry.role and (industry is None or entry.industry == industry)
+        })
+
+    def stats(self) -> Dict[str, int]:
+        return {"personas": len(self._entries), "industries": len({entry.industry for entry in self._sorted})}
+
+    def _maybe_refresh(self):
+        scanned_at = self._scanned_at
+        if scanned_at is None or (self.rescan_interval > 0 and self._clock() - scanned_at >= self.rescan_interval):
+            self.refresh()
+
+    def _index_file(self, file: str, stat: os.stat_result) -> Optional[PersonaEntry]:
+        path = os.path.join(self.bots_directory, file)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            file_hash = content_hash(text)
+            config = self.bundle.lookup(file, file_hash) if self.bundle else None
+            if config is None:
+                config = parse_yaml(text)
+        except (OSError, PersonaParseError) as e:
+            logger.warning(f"Skipping persona file {file}: {e}")
+            return None
+        if not isinstance(config, dict):
+            logger.warning(f"Skipping persona file {file}: not a mapping")
+            return None
+        return PersonaEntry(file, config, file_hash, stat.st_mtime, stat.st_size)
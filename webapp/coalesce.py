@@ -0,0 +1,329 @@
+"""
+Request coalescing for Azure OpenAI calls
+Identical requests in flight at the same time share one upstream call: its result, or its stream replayed to every reader
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional
+
+from cache import content_hash
+from deadline import CancelToken, DeadlineExceeded, RequestCancelled, cancel_scope
+
+logger = logging.getLogger(__name__)
+
+class SharedRequestCancelled(RuntimeError):
+    """The call another request was waiting on was cancelled before it produced anything"""
+
+class _Flight:
+    """One upstream call and everything it produced so far"""
+
+    __slots__ = ("chunks", "result", "error", "done", "cancelled", "readers")
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        # The leader stopped before producing a result; waiting callers make their own call
+        self.cancelled = False
+        # Callers still reading, the leader included
+        self.readers = 1
+
+class RequestCoalescer:
+    """
+    Single-flight for model calls
+
+    The first request for a key (the leader) makes the upstream call; identical
+    requests that arrive while it is in flight (followers) wait for it instead
+    of calling the model again. Completions hand the same result (or error) to
+    every caller. Streams are fanned out: each follower replays the deltas
+    produced so far and then receives new ones as the leader reads them, so a
+    late joiner still gets the whole answer. If a stream's leader stops
+    reading while followers remain, the rest of the stream is drained for them
+    on a background thread (or task) until the last of them stops reading too.
+
+    Thread callers (the sync client) and coroutines on the background event
+    loop (the async client) are tracked separately; requests only coalesce
+    with requests of the same kind.
+    """
+
+    def __init__(self, wait_timeout: float = 120.0):
+        """
+        Args:
+            wait_timeout: Seconds a follower waits for the leader's next delta or result
+        """
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._async_flights: Dict[Hashable, _Flight] = {}
+        self._async_changed: Optional[asyncio.Condition] = None
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(deployment: str, messages: List[Dict[str, Any]], params: Dict[str, Any], stream: bool) -> str:
+        """Key of a request: deployment, full message list and sampling parameters"""
+        return content_hash({"deployment": deployment, "messages": messages, "params": params, "stream": stream})
+
+    def run(self, key: Hashable, call: Callable[[], Any], cancel: CancelToken = None) -> Any:
+        """
+        Return call()'s result, sharing it with identical calls in flight
+
+        cancel bounds and interrupts a follower's wait; the leader's call handles its own.
+        """
+        while True:
+            flight, leader = self._join(self._flights, key)
+            if leader:
+                return self._lead(key, flight, call)
+            with self._changed:
+                self._wait(lambda: flight.done, "Timed out waiting for a shared request", cancel)
+            if not flight.cancelled:
+                return self._outcome(flight)
+
+    def stream(self, key: Hashable, open_stream: Callable[[], Iterator[str]], cancel: CancelToken = None) -> Iterator[str]:
+        """Yield the deltas of open_stream(), fanned out to identical streams in flight"""
+        while True:
+            flight, leader = self._join(self._flights, key)
+            if leader:
+                yield from self._lead_stream(key, flight, open_stream())
+                return
+
+            index = 0
+            try:
+                while True:
+                    with self._changed:
+                        self._wait(lambda: flight.done or len(flight.chunks) > index, "Timed out waiting for a shared stream", cancel)
+                        chunks = flight.chunks[index:]
+                        done = flight.done
+                    if done and flight.cancelled and index == 0:
+                        # Nothing was read yet: make our own call instead
+                        break
+                    for chunk in chunks:
+                        yield chunk
+                    index += len(chunks)
+                    if done:
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+            finally:
+                self._leave(flight)
+
+    async def arun(self, key: Hashable, call: Callable[[], Awaitable[Any]], cancel: CancelToken = None) -> Any:
+        """Async variant of run for coroutines on one event loop"""
+        changed = self._async_condition()
+        while True:
+            flight, leader = self._join(self._async_flights, key)
+            if leader:
+                try:
+                    flight.result = await call()
+                except BaseException as e:
+                    await self._afinish(key, flight, e)
+                    raise
+                await self._afinish(key, flight)
+                return flight.result
+            async with cancel_scope(cancel), changed:
+                await asyncio.wait_for(changed.wait_for(lambda: flight.done), self.wait_timeout)
+            if not flight.cancelled:
+                return self._outcome(flight)
+
+    async def astream(self, key: Hashable, open_stream: Callable[[], AsyncIterator[str]],
+                      cancel: CancelToken = None) -> AsyncIterator[str]:
+        """Async variant of stream for coroutines on one event loop"""
+        changed = self._async_condition()
+        while True:
+            flight, leader = self._join(self._async_flights, key)
+            if leader:
+                upstream = open_stream()
+                try:
+                    async for delta in upstream:
+                        flight.chunks.append(delta)
+                        async with changed:
+                            changed.notify_all()
+                        yield delta
+                except GeneratorExit:
+                    if self._leave(flight):
+                        asyncio.ensure_future(self._adrain(key, flight, upstream))
+                    else:
+                        await self._afinish(key, flight, SharedRequestCancelled("Shared stream was closed"))
+                        await upstream.aclose()
+                    raise
+                except BaseException as e:
+                    await self._afinish(key, flight, e)
+                    raise
+                await self._afinish(key, flight)
+                return
+
+            index = 0
+            try:
+                while True:
+                    async with cancel_scope(cancel), changed:
+                        await asyncio.wait_for(
+                            changed.wait_for(lambda: flight.done or len(flight.chunks) > index), self.wait_timeout
+                        )
+                        chunks = flight.chunks[index:]
+                        done = flight.done
+                    if done and flight.cancelled and index == 0:
+                        break
+                    for chunk in chunks:
+                        yield chunk
+                    index += len(chunks)
+                    if done:
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+            finally:
+                self._leave(flight)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "upstream_calls": self.upstream_calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights) + len(self._async_flights),
+            }
+
+    def _wait(self, predicate: Callable[[], bool], message: str, cancel: Optional[CancelToken]):
+        """Wait on the condition (held by the caller) until predicate holds, checking cancel between slices"""
+        if cancel is None:
+            if not self._changed.wait_for(predicate, self.wait_timeout):
+                raise TimeoutError(message)
+            return
+        deadline = time.monotonic() + self.wait_timeout
+        while not self._changed.wait_for(predicate, min(CancelToken.POLL_INTERVAL, deadline - time.monotonic())):
+            cancel.check()
+            if time.monotonic() >= deadline:
+                raise TimeoutError(message)
+
+    def _join(self, flights: Dict[Hashable, _Flight], key: Hashable) -> (_Flight, bool):
+        """Return the flight for key and whether the caller leads it (makes the upstream call)"""
+        with self._lock:
+            flight = flights.get(key)
+            if flight is None:
+                flight = flights[key] = _Flight()
+                self.upstream_calls += 1
+                return flight, True
+            flight.readers += 1
+            self.coalesced += 1
+            return flight, False
+
+    def _leave(self, flight: _Flight) -> bool:
+        """
+        A reader stops reading flight's stream
+
+        Returns:
+            Whether other readers remain
+        """
+        with self._lock:
+            flight.readers -= 1
+            return flight.readers > 0
+
+    @staticmethod
+    def _close(upstream: Iterator[str]):
+        close = getattr(upstream, "close", None)
+        if close is not None:
+            close()
+
+    def _lead(self, key: Hashable, flight: _Flight, call: Callable[[], Any]) -> Any:
+        try:
+            flight.result = call()
+        except BaseException as e:
+            self._finish(key, flight, e)
+            raise
+        self._finish(key, flight)
+        return flight.result
+
+    def _lead_stream(self, key: Hashable, flight: _Flight, upstream: Iterator[str]) -> Iterator[str]:
+        try:
+            for delta in upstream:
+                with self._changed:
+                    flight.chunks.append(delta)
+                    self._changed.notify_all()
+                yield delta
+        except GeneratorExit:
+            if self._leave(flight):
+                # Keep reading for the followers without holding up the caller that closed the stream
+                threading.Thread(target=self._drain, args=(key, flight, upstream), name="coalesce-drain", daemon=True).start()
+            else:
+                self._finish(key, flight, SharedRequestCancelled("Shared stream was closed"))
+                self._close(upstream)
+            raise
+        except BaseException as e:
+            self._finish(key, flight, e)
+            raise
+        self._finish(key, flight)
+
+    def _drain(self, key: Hashable, flight: _Flight, upstream: Iterator[str]):
+        try:
+            for delta in upstream:
+                with self._changed:
+                    if flight.readers <= 0:
+                        break
+                    flight.chunks.append(delta)
+                    self._changed.notify_all()
+            else:
+                self._finish(key, flight)
+                return
+        except Exception as e:
+            logger.warning(f"Shared stream failed after its first reader left: {e}")
+            self._finish(key, flight, e)
+            return
+        # The last follower left too: stop generating for nobody
+        self._finish(key, flight, SharedRequestCancelled("Shared stream was closed"))
+        self._close(upstream)
+
+    async def _adrain(self, key: Hashable, flight: _Flight, upstream: AsyncIterator[str]):
+        changed = self._async_condition()
+        try:
+            async for delta in upstream:
+                with self._lock:
+                    abandoned = flight.readers <= 0
+                if abandoned:
+                    # The last follower left too: stop generating for nobody
+                    await self._afinish(key, flight, SharedRequestCancelled("Shared stream was closed"))
+                    await upstream.aclose()
+                    return
+                flight.chunks.append(delta)
+                async with changed:
+                    changed.notify_all()
+        except Exception as e:
+            logger.warning(f"Shared stream failed after its first reader left: {e}")
+            await self._afinish(key, flight, e)
+            return
+        await self._afinish(key, flight)
+
+    def _finish(self, key: Hashable, flight: _Flight, error: BaseException = None):
+        with self._changed:
+            self._settle(self._flights, key, flight, error)
+            self._changed.notify_all()
+
+    async def _afinish(self, key: Hashable, flight: _Flight, error: BaseException = None):
+        with self._lock:
+            self._settle(self._async_flights, key, flight, error)
+        async with self._async_condition():
+            self._async_condition().notify_all()
+
+    def _settle(self, flights: Dict[Hashable, _Flight], key: Hashable, flight: _Flight, error: Optional[BaseException]):
+        """Mark a flight done; new requests for key start a fresh upstream call from now on"""
+        if flights.get(key) is flight:
+            del flights[key]
+        if error is not None and (not isinstance(error, Exception) or isinstance(error, (RequestCancelled, DeadlineExceeded))):
+            # Cancellation, deadline or interpreter exit of the leader: waiting callers must not inherit it
+            error = SharedRequestCancelled("Shared request was cancelled")
+        # Callers still waiting for a cancelled request retry on their own if they got nothing yet
+        flight.cancelled = isinstance(error, SharedRequestCancelled)
+        flight.error = error
+        flight.done = True
+
+    def _outcome(self, flight: _Flight) -> Any:
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _async_condition(self) -> asyncio.Condition:
+        # Created on the event loop that runs the async client (the process-wide background loop)
+        if self._async_changed is None:
+            self._async_changed = asyncio.Condition()
+        return self._async_changed
@@ -0,0 +1,160 @@
+"""
+Concurrency primitives for the async persona bot engine
+A process-wide request limiter and a background event loop the sync Streamlit UI can drive
+"""
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, Optional
+
+import metrics
+from deadline import CancelToken, DeadlineExceeded, RequestCancelled, cancel_scope
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(RuntimeError):
+    """Raised when the limiter's wait queue is full or the wait timed out"""
+
+class ConcurrencyLimiter:
+    """
+    Bounds the number of in-flight LLM calls across every session
+
+    At most ``max_concurrency`` calls run at once; up to ``max_queue`` more may
+    wait for a slot (for at most ``queue_timeout`` seconds). Further callers are
+    rejected immediately with QueueFullError instead of piling up. The time
+    spent waiting for a slot is recorded so queueing shows up separately from
+    generation latency.
+
+    Must only be used from a single event loop.
+    """
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 64, queue_timeout: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self._stats = {
+            "acquired": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "last_wait_seconds": 0.0,
+        }
+
+    @asynccontextmanager
+    async def slot(self, cancel: CancelToken = None) -> AsyncIterator[float]:
+        """
+        Hold one concurrency slot for the duration of the block
+
+        Args:
+            cancel: Deadline and cancellation of the request; they bound the wait in the queue
+
+        Yields:
+            Seconds spent waiting in the queue
+        """
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise QueueFullError("Too many requests are waiting for the model")
+
+        started = time.perf_counter()
+        self.waiting += 1
+        timeout = self.queue_timeout if cancel is None else cancel.limit(self.queue_timeout)
+        try:
+            async with cancel_scope(cancel):
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=timeout)
+        except (RequestCancelled, DeadlineExceeded):
+            raise
+        except asyncio.TimeoutError:
+            if cancel is not None and cancel.expired:
+                raise DeadlineExceeded("Request deadline exceeded while waiting for the model")
+            self._stats["timed_out"] += 1
+            raise QueueFullError(f"Timed out after {self.queue_timeout:.0f}s waiting for the model")
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - started
+        self._record_wait(waited)
+        self.active += 1
+        try:
+            yield waited
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, active calls and queue-wait timing"""
+        snapshot = dict(self._stats)
+        snapshot.update({
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "avg_wait_seconds": snapshot["total_wait_seconds"] / snapshot["acquired"] if snapshot["acquired"] else 0.0,
+        })
+        return snapshot
+
+    def _record_wait(self, waited: float):
+        self._stats["acquired"] += 1
+        self._stats["total_wait_seconds"] += waited
+        self._stats["last_wait_seconds"] = waited
+        self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        metrics.observe("queue_wait", waited)
+        if waited > 1.0:
+            logger.info(f"Request waited {waited:.2f}s for a model slot ({self.waiting} still waiting)")
+
+class BackgroundEventLoop:
+    """
+    A single asyncio event loop running in a daemon thread
+
+    Lets synchronous code (Streamlit script threads) run coroutines and consume
+    async generators on one shared loop, so all sessions share the same async
+    client, connection pool and limiter.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="persona-bot-loop", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coroutine: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the background loop and wait for its result"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def iterate(self, async_iterator: AsyncIterator[Any]) -> Iterator[Any]:
+        """Consume an async iterator from synchronous code, item by item"""
+        try:
+            while True:
+                try:
+                    yield self.run(async_iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            # Closing the generator early (e.g. the caller stopped reading) cancels the upstream call
+            aclose = getattr(async_iterator, "aclose", None)
+            if aclose is not None:
+                self.run(aclose())
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+def get_background_loop() -> BackgroundEventLoop:
+    """Return the process-wide background event loop, starting it on first use"""
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                _background_loop = BackgroundEventLoop()
+    return _background_loop
@@ -0,0 +1,248 @@
+"""
+Request deadlines and cooperative cancellation
+A CancelToken travels with one chat turn from the UI or API down to the Azure OpenAI call, bounding
+every wait on the way and letting a newer request, a reset or a closed tab stop it
+"""
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Dict, Hashable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class RequestCancelled(RuntimeError):
+    """The request was cancelled before it finished (superseded, reset or abandoned)"""
+
+class DeadlineExceeded(TimeoutError):
+    """The request ran out of time"""
+
+class CancelToken:
+    """
+    Deadline and cancellation state of one request
+
+    Every layer that waits on behalf of the request (queueing, rate limiting,
+    retries, the HTTP call, reading the stream) checks the token, so a
+    cancelled or expired request stops at the next check. Waits the token
+    cannot wake up are sliced so they notice a cancellation within
+    ``POLL_INTERVAL`` seconds.
+    """
+
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, timeout: float = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            timeout: Seconds the request may take in total (None or 0 for no deadline)
+            clock: Monotonic time source (overridable in tests)
+        """
+        self._clock = clock
+        self.deadline = clock() + timeout if timeout else None
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """
+        Cancel the request; callbacks registered with on_cancel run in the calling thread
+
+        Returns:
+            False if the token was already cancelled
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancellation callback failed: {e}")
+        return True
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and self._clock() >= self.deadline
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (None without one, never negative)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - self._clock())
+
+    def check(self):
+        """Raise RequestCancelled or DeadlineExceeded if the request should stop"""
+        if self.cancelled:
+            raise RequestCancelled(f"Request {self.reason}")
+        if self.expired:
+            raise DeadlineExceeded("Request deadline exceeded")
+
+    def limit(self, seconds: Optional[float]) -> Optional[float]:
+        """The smaller of seconds and the time left, for a wait that has its own timeout"""
+        remaining = self.remaining()
+        if remaining is None:
+            return seconds
+        return remaining if seconds is None else min(seconds, remaining)
+
+    def sleep(self, seconds: float):
+        """Sleep, waking up early to raise if the request is cancelled; never sleeps past the deadline"""
+        self.check()
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            raise DeadlineExceeded("Request deadline exceeded while waiting")
+        end = self._clock() + seconds
+        while True:
+            left = end - self._clock()
+            if left <= 0:
+                return
+            # cancel() sets the event, so the wait ends as soon as the request is cancelled
+            self._event.wait(left)
+            self.check()
+
+    async def asleep(self, seconds: float):
+        """Async variant of sleep"""
+        self.check()
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            raise DeadlineExceeded("Request deadline exceeded while waiting")
+        end = self._clock() + seconds
+        while True:
+            left = end - self._clock()
+            if left <= 0:
+                return
+            await asyncio.sleep(min(left, self.POLL_INTERVAL))
+            self.check()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Run callback when the token is cancelled (right away if it already is)
+
+        Returns:
+            A function that unregisters the callback
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+@asynccontextmanager
+async def cancel_scope(token: Optional[CancelToken]) -> AsyncIterator[None]:
+    """
+    Interrupt the awaits inside the block when token is cancelled or its deadline passes
+
+    The current task is cancelled from the event loop and the resulting
+    CancelledError is turned into RequestCancelled or DeadlineExceeded. Only
+    use it around code that does not yield to a caller (no ``yield`` inside
+    the block), or the caller's task would be interrupted instead.
+    """
+    if token is None:
+        yield
+        return
+    token.check()
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    state = {"active": True, "interrupted": False}
+
+    def interrupt():
+        # Runs on the loop thread, so it cannot race with the block exiting
+        if state["active"]:
+            state["interrupted"] = True
+            task.cancel()
+
+    unregister = token.on_cancel(lambda: loop.call_soon_threadsafe(interrupt))
+    remaining = token.remaining()
+    timer = loop.call_later(remaining, interrupt) if remaining is not None else None
+    try:
+        yield
+    except asyncio.CancelledError:
+        if not state["interrupted"]:
+            raise
+        uncancel = getattr(task, "uncancel", None)
+        if uncancel is not None:
+            uncancel()
+        if token.cancelled:
+            raise RequestCancelled(f"Request {token.reason}")
+        raise DeadlineExceeded("Request deadline exceeded")
+    finally:
+        state["active"] = False
+        unregister()
+        if timer is not None:
+            timer.cancel()
+
+class RequestTracker:
+    """
+    The request in progress for each conversation
+
+    Starting a request for a session cancels the one it supersedes, and a
+    reset or a persona switch cancels whatever is still running, so nobody
+    pays for answers that will never be shown.
+    """
+
+    def __init__(self, timeout: float = None):
+        """
+        Args:
+            timeout: Default deadline of a request in seconds (None or 0 for none)
+        """
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._active: Dict[Hashable, CancelToken] = {}
+        self._stats = {"started": 0, "superseded": 0, "cancelled": 0}
+
+    def start(self, key: Hashable, token: CancelToken = None) -> CancelToken:
+        """Register the request of a session (a new token with the default deadline if none given)"""
+        if token is None:
+            token = CancelToken(self.timeout)
+        with self._lock:
+            previous = self._active.get(key)
+            self._active[key] = token
+            self._stats["started"] += 1
+        if previous is not None and previous is not token and previous.cancel("superseded"):
+            with self._lock:
+                self._stats["superseded"] += 1
+        return token
+
+    def finish(self, key: Hashable, token: CancelToken):
+        """Forget a finished request (unless a newer one already replaced it)"""
+        with self._lock:
+            if self._active.get(key) is token:
+                del self._active[key]
+
+    def cancel(self, key: Hashable, reason: str = "cancelled") -> bool:
+        """Cancel the session's request in progress, if any"""
+        with self._lock:
+            token = self._active.pop(key, None)
+        if token is None or not token.cancel(reason):
+            return False
+        with self._lock:
+            self._stats["cancelled"] += 1
+        return True
+
+    @contextmanager
+    def track(self, key: Hashable, token: CancelToken = None) -> Iterator[CancelToken]:
+        """start() for the duration of the block"""
+        token = self.start(key, token)
+        try:
+            yield token
+        finally:
+            self.finish(key, token)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["active"] = len(self._active)
+        return snapshot
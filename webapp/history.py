@@ -0,0 +1,160 @@
+"""
+Token-budget-aware conversation history
+Counts message tokens once and packs the newest turns that fit the input budget
+"""
+import logging
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to a character heuristic
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Approximate per-message framing overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Private keys stored on history messages; never sent to the API
+TOKENS_KEY = "_tokens"
+SUMMARIZED_KEY = "_summarized"
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a discovery interview between workshop participants "
+    "and a customer persona. Update the existing summary with the new exchanges. Keep every "
+    "fact, number, commitment and open question; drop greetings and repetition. Write in the "
+    "same language as the conversation, in at most 150 words."
+)
+
+class Tokenizer:
+    """Local token counter using tiktoken when available, otherwise ~4 characters per token"""
+
+    def __init__(self, encoding_name: str = "o200k_base"):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logger.warning(f"Could not load tokenizer '{encoding_name}', using an estimate instead: {e}")
+        self.count_text = lru_cache(maxsize=256)(self._count_text)
+
+    def _count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return max(1, len(text) // 4)
+
+class HistoryManager:
+    """
+    Selects the conversation history sent with each request
+
+    Token counts are computed once per message and cached on the message under
+    a private key. The newest turns are packed until the input-token budget
+    (system prompt + history + new user message) is used up. Leading system
+    messages (e.g. a rolling summary) are always kept.
+    """
+
+    def __init__(self, input_token_budget: int = 6000, tokenizer: Tokenizer = None):
+        self.input_token_budget = input_token_budget
+        self.tokenizer = tokenizer or Tokenizer(os.getenv("PERSONA_TOKENIZER_ENCODING", "o200k_base"))
+
+    def count(self, message: Dict[str, Any]) -> int:
+        """Return the token count of a message, caching it on the message"""
+        tokens = message.get(TOKENS_KEY)
+        if tokens is None:
+            tokens = self.tokenizer.count_text(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+            message[TOKENS_KEY] = tokens
+        return tokens
+
+    def count_text(self, text: str) -> int:
+        """Return the token count of a piece of text (memoized for repeated prompts)"""
+        return self.tokenizer.count_text(text) + MESSAGE_OVERHEAD_TOKENS
+
+    def select(self, history: List[Dict[str, Any]], system_prompt: str = "", user_message: str = "") -> List[Dict[str, Any]]:
+        """
+        Return the newest messages of history that fit the input-token budget
+
+        Args:
+            history: Conversation history, oldest first
+            system_prompt: System prompt sent with the request
+            user_message: New user message sent with the request
+
+        Returns:
+            The selected message objects (not copies), oldest first
+        """
+        if not history:
+            return []
+
+        pinned_count = 0
+        while pinned_count < len(history) and history[pinned_count]["role"] == "system":
+            pinned_count += 1
+        pinned = history[:pinned_count]
+
+        remaining = self.input_token_budget - self.count_text(system_prompt)
+        if user_message:
+            remaining -= self.count_text(user_message)
+        remaining -= sum(self.count(message) for message in pinned)
+
+        start = len(history)
+        for index in range(len(history) - 1, pinned_count - 1, -1):
+            cost = self.count(history[index])
+            if cost > remaining:
+                break
+            remaining -= cost
+            start = index
+
+        # Do not open the window with an assistant reply whose question was dropped
+        if start < len(history) and start > pinned_count and history[start]["role"] == "assistant":
+            start += 1
+
+        return pinned + history[start:]
+
+    def to_api_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Strip private bookkeeping keys before sending messages to the API"""
+        return [{"role": message["role"], "content": message["content"]} for message in messages]
+
+    def fold_into_summary(self, summary: Optional[str], dropped: List[Dict[str, Any]], summarize) -> Optional[str]:
+        """
+        Fold messages that left the window into the rolling summary
+
+        Args:
+            summary: Current summary text (None if there is none yet)
+            dropped: Messages no longer selected that are not yet summarized
+            summarize: Callable(system_prompt, user_message) -> Optional[str]
+
+        Returns:
+            Updated summary (the previous one if summarization failed)
+        """
+        if not dropped:
+            return summary
+        try:
+            updated = summarize(SUMMARY_SYSTEM_PROMPT, self._summary_request(summary, dropped))
+        except Exception as e:
+            logger.warning(f"Failed to update conversation summary: {e}")
+            return summary
+        return self._apply_summary(summary, dropped, updated)
+
+    async def afold_into_summary(self, summary: Optional[str], dropped: List[Dict[str, Any]], summarize) -> Optional[str]:
+        """Async variant of fold_into_summary; summarize is a coroutine function"""
+        if not dropped:
+            return summary
+        try:
+            updated = await summarize(SUMMARY_SYSTEM_PROMPT, self._summary_request(summary, dropped))
+        except Exception as e:
+            logger.warning(f"Failed to update conversation summary: {e}")
+            return summary
+        return self._apply_summary(summary, dropped, updated)
+
+    def _summary_request(self, summary: Optional[str], dropped: List[Dict[str, Any]]) -> str:
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in dropped)
+        return f"Existing summary:\n{summary or '(none)'}\n\nNew exchanges:\n{transcript}"
+
+    def _apply_summary(self, summary: Optional[str], dropped: List[Dict[str, Any]], updated: Optional[str]) -> Optional[str]:
+        if not updated:
+            return summary
+        for message in dropped:
+            message[SUMMARIZED_KEY] = True
+        return updated
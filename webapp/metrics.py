@@ -0,0 +1,368 @@
+"""
+Hot-path instrumentation for the persona bot
+Timing spans, labelled counters/histograms, a Prometheus-style endpoint, periodic JSON logs and a sampling profiler
+"""
+import bisect
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[LabelKey, float] = collections.defaultdict(float)
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        with self._lock:
+            self._values[_label_key(labels)] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {_format_labels(key) or "total": value for key, value in self._values.items()}
+
+class Histogram:
+    """Fixed-bucket histogram with labels"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [bucket counts..., +Inf count, sum]
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in sorted(self._series.items())]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean and approximate p50/p95 (bucket upper bounds) per label set"""
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        result = {}
+        for key, series in items:
+            count = sum(series[:-1])
+            result[_format_labels(key) or "total"] = {
+                "count": count,
+                "mean": series[-1] / count if count else 0.0,
+                "p50": self._quantile(series, count, 0.50),
+                "p95": self._quantile(series, count, 0.95),
+            }
+        return result
+
+    def _quantile(self, series: list, count: int, quantile: float) -> float:
+        if not count:
+            return 0.0
+        threshold = quantile * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, series):
+            cumulative += bucket_count
+            if cumulative >= threshold:
+                return bound
+        return float("inf")
+
+class MetricsRegistry:
+    """Process-wide set of counters, histograms and gauge collectors"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, float]]] = {}
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        return self._get_or_create(name, lambda: Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(name, lambda: Histogram(name, help_text, buckets))
+
+    def register_collector(self, prefix: str, collect: Callable[[], Dict[str, float]]):
+        """
+        Register a callable whose numeric results are exported as gauges
+
+        Args:
+            prefix: Metric name prefix, e.g. 'persona_bot_token_provider'
+            collect: Returns a flat dict of name -> number (e.g. a component's stats())
+        """
+        with self._lock:
+            self._collectors[prefix] = collect
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines: List[str] = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, values in self._collect(collectors):
+            for name, value in values:
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                lines.append(f"{prefix}_{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a JSON-serializable summary of every metric"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        result: Dict[str, Any] = {metric.name: metric.snapshot() for metric in metrics}
+        for prefix, values in self._collect(collectors):
+            result[prefix] = dict(values)
+        return result
+
+    def _collect(self, collectors: List[Tuple[str, Callable[[], Dict[str, Any]]]]) -> Iterator[Tuple[str, List[Tuple[str, float]]]]:
+        for prefix, collect in collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                logger.debug(f"Metrics collector {prefix} failed: {e}")
+                continue
+            numeric = [(name, float(value)) for name, value in sorted(values.items())
+                       if isinstance(value, (int, float)) and not isinstance(value, bool)]
+            yield prefix, numeric
+
+    def _get_or_create(self, name: str, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+registry = MetricsRegistry()
+
+SPAN_SECONDS = registry.histogram(
+    "persona_bot_span_seconds", "Duration of instrumented hot-path operations"
+)
+TOKENS_TOTAL = registry.counter(
+    "persona_bot_tokens_total", "Tokens reported by response.usage, by kind, persona and deployment"
+)
+REQUESTS_TOTAL = registry.counter(
+    "persona_bot_openai_requests_total", "Azure OpenAI requests by outcome, persona and deployment"
+)
+CANCELLED_TOTAL = registry.counter(
+    "persona_bot_cancelled_requests_total",
+    "Azure OpenAI requests stopped before they finished, by reason, stage, persona and deployment"
+)
+CANCELLED_TOKENS = registry.counter(
+    "persona_bot_cancelled_tokens_total",
+    "Estimated completion tokens not generated because a request was stopped early"
+)
+
+@contextmanager
+def span(name: str, **labels: Any) -> Iterator[None]:
+    """Time a block and record it in persona_bot_span_seconds{span=name, ...}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - started, span=name, **labels)
+
+def observe(name: str, seconds: float, **labels: Any):
+    """Record a duration measured elsewhere (e.g. time-to-first-token)"""
+    SPAN_SECONDS.observe(seconds, span=name, **labels)
+
+def record_usage(usage: Any, persona: Optional[str], deployment: str):
+    """Count prompt, completion and cached prompt tokens from an OpenAI usage object"""
+    if usage is None:
+        return
+    TOKENS_TOTAL.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt", persona=persona, deployment=deployment)
+    TOKENS_TOTAL.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion", persona=persona, deployment=deployment)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) if details is not None else 0
+    TOKENS_TOTAL.inc(cached or 0, kind="cached", persona=persona, deployment=deployment)
+
+def record_cancelled(reason: str, stage: str, persona: Optional[str], deployment: str, tokens_saved: int = 0):
+    """
+    Count a request stopped early
+
+    Args:
+        reason: Why it stopped, e.g. superseded, reset, interrupted, closed or deadline
+        stage: waiting (before the first token), streaming, or completion (a non-streamed
+            call, which the service finishes anyway)
+        tokens_saved: Estimated completion tokens the service did not have to generate
+    """
+    CANCELLED_TOTAL.inc(reason=reason, stage=stage, persona=persona, deployment=deployment)
+    if tokens_saved:
+        CANCELLED_TOKENS.inc(tokens_saved, reason=reason, persona=persona, deployment=deployment)
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> Any:
+    """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread"""
+    # http.server pulls in http.client and ssl; only import it when the endpoint is enabled
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body = json.dumps(registry.snapshot(), default=str).encode("utf-8")
+                content_type = "application/json"
+            elif self.path.startswith("/metrics"):
+                body = registry.render_prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
+
+def start_json_logger(interval: float) -> threading.Thread:
+    """Log a one-line JSON metrics snapshot every interval seconds"""
+    def run():
+        while True:
+            time.sleep(interval)
+            logger.info("metrics " + json.dumps(registry.snapshot(), default=str, separators=(",", ":")))
+
+    thread = threading.Thread(target=run, name="metrics-logger", daemon=True)
+    thread.start()
+    return thread
+
+class SamplingProfiler:
+    """
+    Low-overhead wall-clock sampler of every thread's Python stack
+
+    Every ``interval`` seconds the current frames are collected and aggregated as
+    collapsed stacks (``frame;frame;frame count``), the input format of
+    flamegraph.pl and speedscope. The output file is rewritten every
+    ``flush_interval`` seconds.
+    """
+
+    def __init__(self, output_path: str, interval: float = 0.01, flush_interval: float = 60.0):
+        self.output_path = output_path
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self._stacks: Dict[str, int] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self) -> "SamplingProfiler":
+        self._thread.start()
+        logger.info(f"Sampling profiler writing collapsed stacks to {self.output_path}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def flush(self):
+        lines = [f"{stack} {count}" for stack, count in sorted(self._stacks.items(), key=lambda item: -item[1])]
+        with open(self.output_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        last_flush = time.monotonic()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = ";".join(f"{entry.name} ({os.path.basename(entry.filename)}:{entry.lineno})"
+                                 for entry in traceback.extract_stack(frame))
+                self._stacks[stack] += 1
+            if time.monotonic() - last_flush > self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+def start_exporters_from_env():
+    """
+    Start the configured exporters once per process
+
+    PERSONA_METRICS_PORT starts the HTTP endpoint, PERSONA_METRICS_LOG_INTERVAL_SECONDS
+    the periodic JSON log line and PERSONA_PROFILER_OUTPUT the sampling profiler.
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+
+    port = os.getenv("PERSONA_METRICS_PORT")
+    if port:
+        try:
+            start_metrics_server(int(port), os.getenv("PERSONA_METRICS_HOST", "127.0.0.1"))
+        except OSError as e:
+            # Another worker process may already own the port
+            logger.warning(f"Could not start metrics endpoint on port {port}: {e}")
+
+    interval = float(os.getenv("PERSONA_METRICS_LOG_INTERVAL_SECONDS", "0"))
+    if interval > 0:
+        start_json_logger(interval)
+
+    profiler_output = os.getenv("PERSONA_PROFILER_OUTPUT")
+    if profiler_output:
+        SamplingProfiler(
+            profiler_output,
+            interval=float(os.getenv("PERSONA_PROFILER_INTERVAL_SECONDS", "0.01"))
+        ).start()
+
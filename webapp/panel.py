@@ -0,0 +1,114 @@
+"""
+Persona panel
+Asks the same question to several personas at once, each in its own session, and merges their streamed answers
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple
+
+import metrics
+from concurrency import get_background_loop
+from persona_bot import PersonaBot, PersonaEngine
+
+logger = logging.getLogger(__name__)
+
+MAX_PANEL_PERSONAS = int(os.getenv("PERSONA_PANEL_MAX_PERSONAS", "6"))
+
+class PanelDelta(NamedTuple):
+    """A piece of one persona's answer; the last one for each persona has done set and no text"""
+    persona_file: str
+    text: str
+    done: bool = False
+
+class PersonaPanel:
+    """
+    Several personas answering the same questions side by side
+
+    Each persona gets its own PersonaBot, and therefore its own session and
+    history. A question is sent to all of them at once on the shared
+    background event loop, so the calls share the engine's concurrency
+    limiter and rate limiter with every other session, and the whole panel
+    takes about as long as its slowest answer.
+    """
+
+    def __init__(self, engine: PersonaEngine, persona_files: List[str], session_ids: Dict[str, str] = None):
+        """
+        Args:
+            engine: Shared engine
+            persona_files: Personas on the panel, in display order (duplicates are ignored)
+            session_ids: Sessions to resume per persona file; the others start new sessions
+        """
+        persona_files = list(dict.fromkeys(persona_files))
+        if not persona_files:
+            raise ValueError("A panel needs at least one persona")
+        if len(persona_files) > MAX_PANEL_PERSONAS:
+            raise ValueError(f"A panel can have at most {MAX_PANEL_PERSONAS} personas")
+
+        session_ids = session_ids or {}
+        self.engine = engine
+        self.bots: Dict[str, PersonaBot] = {}
+        for persona_file in persona_files:
+            bot = PersonaBot(engine, session_id=session_ids.get(persona_file))
+            if bot.persona_file != persona_file:
+                bot.load_persona(persona_file)
+            self.bots[persona_file] = bot
+
+    @property
+    def session_ids(self) -> Dict[str, str]:
+        return {persona_file: bot.session_id for persona_file, bot in self.bots.items()}
+
+    async def aintroduce(self) -> Dict[str, str]:
+        """Introduce every persona whose conversation is still empty, concurrently"""
+        pending = {persona_file: bot for persona_file, bot in self.bots.items() if not bot.transcript()}
+        intros = await asyncio.gather(*(bot.aget_introduction_message() for bot in pending.values()))
+        return dict(zip(pending, intros))
+
+    async def aask(self, question: str) -> AsyncIterator[PanelDelta]:
+        """
+        Send a question to every persona and yield their answers as they stream in
+
+        Deltas of different personas are interleaved in arrival order. Each
+        answer is added to its persona's session when it completes.
+        """
+        queue: "asyncio.Queue[PanelDelta]" = asyncio.Queue()
+        started = time.perf_counter()
+
+        async def answer(persona_file: str, bot: PersonaBot):
+            try:
+                async for delta in bot.achat_stream(question):
+                    await queue.put(PanelDelta(persona_file, delta))
+            except Exception as e:
+                logger.error(f"Panel answer from {persona_file} failed: {e}")
+                await queue.put(PanelDelta(persona_file, bot.openai_client.error_message(e)))
+            finally:
+                await queue.put(PanelDelta(persona_file, "", done=True))
+
+        tasks = [asyncio.ensure_future(answer(persona_file, bot)) for persona_file, bot in self.bots.items()]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                delta = await queue.get()
+                if delta.done:
+                    remaining -= 1
+                yield delta
+        finally:
+            # A reader that stops early cancels the answers still streaming
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            metrics.observe("panel_question", time.perf_counter() - started, personas=len(tasks))
+
+    def introduce(self) -> Dict[str, str]:
+        """Synchronous aintroduce, run on the shared background event loop"""
+        return get_background_loop().run(self.aintroduce())
+
+    def ask(self, question: str) -> Iterator[PanelDelta]:
+        """Synchronous aask, run on the shared background event loop"""
+        return get_background_loop().iterate(self.aask(question))
+
+    def reset(self):
+        """Reset every persona's conversation"""
+        for bot in self.bots.values():
+            bot.reset_conversation()
@@ -2,35 +2,56 @@
 Persona Bot Backend Logic
 Handles loading persona configurations and interacting with Azure OpenAI
 """
-import yaml
+import asyncio
 import os
-from typing import Dict, Any, List
-from openai import AzureOpenAI
-from azure.identity import DefaultAzureCredential
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple
 import logging
-from dotenv import load_dotenv
 from pathlib import Path
+import bootstrap
+import metrics
+from token_provider import CachedTokenProvider
+from cache import IntroCache, ResponseCache, TTLCache, content_hash
+from template import DEFAULT_PERSONA_VALUES, CompiledTemplate, template_filename
+from bundle import BUNDLE_FILENAME, PersonaBundle, PersonaParseError, parse_yaml
+from catalog import PersonaCatalog
+from watcher import FileWatcher
+from history import HistoryManager
+from prompt_profile import PROMPT_CACHE_MIN_TOKENS, profile_prompt, shared_prefix
+from session_store import Message, Session, SessionStore, create_session_store
+from concurrency import ConcurrencyLimiter, QueueFullError
+from coalesce import RequestCoalescer
+from deadline import CancelToken, DeadlineExceeded, RequestCancelled, RequestTracker, cancel_scope
+from rate_limit import RateLimitTimeout, is_throttled
+from routing import AsyncPrimedStream, DeploymentRouter, PrimedStream, deployments_from_env, metric_slug
 
-# Load environment variables from .env file
-load_dotenv()
+# The OpenAI and Azure Identity SDKs take most of the import time; they are
+# imported when the first client is created, after the first page rendered
+if TYPE_CHECKING:
+    from openai import AsyncAzureOpenAI
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Get the root directory of the project (parent of webapp/)
 # This works both locally and in Azure
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Safe fallback returned when Azure OpenAI returns no content (usually filtered)
+FILTERED_FALLBACK_MESSAGE = "I apologize, but I cannot provide a response to that request. Please try rephrasing your question."
+
 class PersonaLoader:
     """Handles loading and parsing persona configuration files"""
     
-    def __init__(self, bots_directory: str = None):
+    def __init__(self, bots_directory: str = None, bundle: PersonaBundle = None):
         if bots_directory is None:
             # Use absolute path based on project root
             self.bots_directory = str(BASE_DIR / "bots")
         else:
             self.bots_directory = bots_directory
+        # Pre-parsed configs from the deployment bundle, used while files are unchanged
+        self.bundle = bundle
     
     def load_persona(self, persona_file: str) -> Dict[str, Any]:
         """
@@ -45,14 +66,18 @@ class PersonaLoader:
         try:
             file_path = os.path.join(self.bots_directory, persona_file)
             with open(file_path, 'r', encoding='utf-8') as f:
-                persona_config = yaml.safe_load(f)
+                text = f.read()
+            
+            persona_config = self.bundle.lookup(persona_file, content_hash(text)) if self.bundle else None
+            if persona_config is None:
+                persona_config = parse_yaml(text)
             
             logger.info(f"Successfully loaded persona: {persona_config.get('name', 'Unknown')}")
             return persona_config
         except FileNotFoundError:
             logger.error(f"Persona file not found: {file_path}")
             raise
-        except yaml.YAMLError as e:
+        except PersonaParseError as e:
             logger.error(f"Error parsing YAML file: {e}")
             raise
     
@@ -76,13 +101,21 @@ class PersonaLoader:
 class PromptBuilder:
     """Handles building prompts from templates and persona data"""
     
+    # Text used when a persona omits one of the standard fields
+    DEFAULT_VALUES = DEFAULT_PERSONA_VALUES
+    
     def __init__(self, template_path: str = None):
         if template_path is None:
-            # Use absolute path based on project root
-            self.template_path = str(BASE_DIR / "templates" / "prompt-template.txt")
+            # Use absolute path based on project root; PERSONA_PROMPT_LAYOUT picks the template
+            self.template_path = str(BASE_DIR / "templates" / template_filename())
         else:
             self.template_path = template_path
         self.template_content = self._load_template()
+        self.template_hash = content_hash(self.template_content)
+        # Parse the placeholders once; rendering is then a single pass
+        self.template = CompiledTemplate(self.template_content)
+        # Rendered prompts by (persona hash, template version)
+        self._prompts = TTLCache(maxsize=int(os.getenv("PERSONA_PROMPT_CACHE_SIZE", "256")), ttl=float("inf"))
     
     def _load_template(self) -> str:
         """Load the prompt template from file"""
@@ -99,6 +132,10 @@ class PromptBuilder:
         """
         Build a system prompt by injecting persona data into the template
         
+        Any persona key can be referenced as {{key}} (or {{key|default}}); lists
+        are rendered comma-separated. Prompts are memoized per persona content
+        and template version.
+        
         Args:
             persona_config: Persona configuration dictionary
             
@@ -106,44 +143,56 @@ class PromptBuilder:
             Formatted system prompt string
         """
         try:
-            # Format list items for pain points and goals
-            pain_points = self._format_list(persona_config.get('pain_points', []))
-            goals = self._format_list(persona_config.get('goals', []))
-            
-            # Replace placeholders in template
-            prompt = self.template_content.replace('{{name}}', persona_config.get('name', 'Unknown'))
-            prompt = prompt.replace('{{role}}', persona_config.get('role', 'Unknown Role'))
-            prompt = prompt.replace('{{industry}}', persona_config.get('industry', 'Unknown Industry'))
-            prompt = prompt.replace('{{pain_points}}', pain_points)
-            prompt = prompt.replace('{{goals}}', goals)
-            prompt = prompt.replace('{{tech_maturity}}', persona_config.get('tech_maturity', 'Unknown'))
-            prompt = prompt.replace('{{tone}}', persona_config.get('tone', 'Professional'))
-            prompt = prompt.replace('{{sample_dialogue}}', persona_config.get('sample_dialogue', ''))
+            with metrics.span("build_system_prompt"):
+                key = (content_hash(persona_config), self.template_hash)
+                prompt = self._prompts.get(key)
+                if prompt is None:
+                    self._check_placeholders(persona_config)
+                    prompt = self.template.render(persona_config, self.DEFAULT_VALUES)
+                    self._prompts.set(key, prompt)
             
             return prompt
         except Exception as e:
             logger.error(f"Error building system prompt: {e}")
             raise
     
-    def _format_list(self, items: List[str]) -> str:
-        """Format a list of items as a readable string"""
-        if not items:
-            return "None specified"
-        return ", ".join(items)
+    def _check_placeholders(self, persona_config: Dict[str, Any]):
+        """Warn about placeholders the persona cannot fill and persona fields the template ignores"""
+        unknown, unused = self.template.check(persona_config, self.DEFAULT_VALUES)
+        name = persona_config.get('name', 'Unknown')
+        if unknown:
+            logger.warning(f"Prompt template placeholders with no value for persona {name}: {', '.join(unknown)}")
+        if unused:
+            logger.warning(f"Persona {name} fields not used by the prompt template: {', '.join(unused)}")
 
 class AzureOpenAIClient:
     """Handles communication with Azure OpenAI service using Managed Identity"""
     
-    def __init__(self):
+    def __init__(self, credential: Any = None):
+        """
+        Args:
+            credential: Optional Azure credential; defaults to DefaultAzureCredential
+        """
+        # Endpoints and deployments to route across (one unless AZURE_OPENAI_DEPLOYMENTS is set)
+        deployment_settings = deployments_from_env()
+        if not all(settings.get("endpoint") or os.getenv("AZURE_OPENAI_ENDPOINT") for settings in deployment_settings):
+            raise ValueError("AZURE_OPENAI_ENDPOINT environment variable must be set")
+        
         # Use Azure DefaultAzureCredential for both local development (az login) and production (managed identity)
         logger.info("Initializing Azure OpenAI client with Managed Identity")
         try:
-            credential = DefaultAzureCredential()
-            self.client = AzureOpenAI(
-                azure_ad_token_provider=lambda: credential.get_token("https://cognitiveservices.azure.com/.default").token,
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview"),
-                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+            if credential is None:
+                from azure.identity import DefaultAzureCredential
+                credential = DefaultAzureCredential()
+            # Cache the token and refresh it ahead of expiry instead of calling the credential per request
+            self.token_provider = CachedTokenProvider(
+                credential,
+                refresh_margin=float(os.getenv("AZURE_TOKEN_REFRESH_MARGIN_SECONDS", "300")),
+                refresh_backoff=float(os.getenv("AZURE_TOKEN_REFRESH_BACKOFF_SECONDS", "30"))
             )
+            # Each deployment has its own clients, RPM/TPM budget, adaptive concurrency and 429 retries,
+            # shared by sync and async calls
+            self.router = DeploymentRouter.from_env(self.token_provider, deployment_settings)
             logger.info("Successfully initialized Azure OpenAI client with Managed Identity")
         except Exception as e:
             logger.error(f"Failed to initialize Azure OpenAI client: {e}")
@@ -151,13 +200,315 @@ class AzureOpenAIClient:
             logger.error("or that Managed Identity is properly configured for production")
             raise ValueError("Unable to authenticate with Azure OpenAI. Please check your authentication setup.")
         
-        self.deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o-mini")
+        # The primary deployment names the model in cache keys; every deployment in a pool must serve the same model
+        primary = self.router.primary
+        self.client = primary.client
+        self.deployment_name = primary.deployment
+        self.rate_limiter = primary.rate_limiter
+        self.history_manager = HistoryManager(
+            input_token_budget=int(os.getenv("PERSONA_INPUT_TOKEN_BUDGET", "6000"))
+        )
         
-        # Validate configuration
-        if not os.getenv("AZURE_OPENAI_ENDPOINT"):
-            raise ValueError("AZURE_OPENAI_ENDPOINT environment variable must be set")
+        # Process-wide limiter, created on first use of the async path
+        self._limiter = None
+        
+        # Moving average of completion lengths, to estimate what an early cancellation saved
+        self._typical_completion_tokens: Optional[float] = None
+        
+        # Identical requests in flight at the same time (e.g. a room loading the same persona) share one call
+        self.coalescer = None
+        if os.getenv("AZURE_OPENAI_COALESCE_REQUESTS", "true").lower() == "true":
+            self.coalescer = RequestCoalescer()
+            metrics.registry.register_collector("persona_bot_coalescer", self.coalescer.stats)
+        
+        # Export the shared components' counters as gauges
+        metrics.registry.register_collector("persona_bot_token_provider", self.token_provider.metrics)
+        metrics.registry.register_collector("persona_bot_rate_limiter", self.rate_limiter.stats)
+        metrics.registry.register_collector("persona_bot_router", self.router.stats)
+        if len(self.router.deployments) > 1:
+            for deployment in self.router.deployments:
+                metrics.registry.register_collector(f"persona_bot_deployment_{metric_slug(deployment.name)}", deployment.stats)
+        metrics.registry.register_collector(
+            "persona_bot_async_limiter", lambda: self._limiter.stats() if self._limiter is not None else {}
+        )
+    
+    def _sampling_params(self) -> Dict[str, Any]:
+        """Read the sampling settings from the environment, clamped to safe limits"""
+        # Security limits
+        max_tokens = min(int(os.getenv("AZURE_OPENAI_MAX_TOKENS", "500")), 1000)
+        temperature = max(0.0, min(1.0, float(os.getenv("AZURE_OPENAI_TEMPERATURE", "0.7"))))
+        top_p = max(0.0, min(1.0, float(os.getenv("AZURE_OPENAI_TOP_P", "0.9"))))
+        return {
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "frequency_penalty": 0.0,
+            "presence_penalty": 0.0,
+            "stop": None  # Let Azure OpenAI handle natural stopping
+        }
+    
+    def _build_messages(self, system_prompt: str, user_message: str, conversation_history: List[Dict[str, str]] = None) -> List[Dict[str, str]]:
+        """Assemble the chat message list sent to Azure OpenAI"""
+        messages = [{"role": "system", "content": system_prompt}]
+        
+        # Add conversation history if provided, keeping the newest turns that fit the input-token budget
+        if conversation_history:
+            recent_history = self.history_manager.select(conversation_history, system_prompt, user_message)
+            messages.extend(self.history_manager.to_api_messages(recent_history))
+        
+        # Add current user message
+        messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    def error_message(self, error: Exception) -> str:
+        """Map an exception raised by the OpenAI SDK to a safe, user-facing message"""
+        if isinstance(error, RequestCancelled):
+            # Superseded, reset or abandoned: nobody is waiting for this answer
+            logger.info(f"Response not generated: {error}")
+            return "The request was cancelled."
+        logger.error(f"Error generating response: {error}")
+        if isinstance(error, (QueueFullError, RateLimitTimeout)) or is_throttled(error):
+            return "I apologize, but the service is very busy right now. Please try again in a moment."
+        elif isinstance(error, DeadlineExceeded):
+            return "I apologize, but the response took too long. Please try again."
+        elif "authentication" in str(error).lower() or "unauthorized" in str(error).lower():
+            return "Authentication error: Please ensure you have proper permissions to access Azure OpenAI. Check the documentation for setup instructions."
+        elif "content_filter" in str(error).lower():
+            return "I apologize, but I cannot provide a response to that request due to content policy restrictions. Please try rephrasing your question."
+        else:
+            return "I apologize, but I'm experiencing technical difficulties. Please try again later."
+    
+    @property
+    def async_client(self) -> "AsyncAzureOpenAI":
+        """AsyncAzureOpenAI client of the primary deployment, sharing the cached token provider"""
+        return self.router.primary.async_client
+    
+    @property
+    def limiter(self) -> ConcurrencyLimiter:
+        """Process-wide limiter for async calls (bound to the background event loop)"""
+        if self._limiter is None:
+            self._limiter = ConcurrencyLimiter(
+                max_concurrency=int(os.getenv("PERSONA_MAX_CONCURRENT_REQUESTS", "16")),
+                max_queue=int(os.getenv("PERSONA_MAX_QUEUED_REQUESTS", "64")),
+                queue_timeout=float(os.getenv("PERSONA_QUEUE_TIMEOUT_SECONDS", "30"))
+            )
+        return self._limiter
+    
+    def _response_content(self, response: Any) -> Optional[str]:
+        """Log content filter results of a completion and return its content (None if empty)"""
+        # Log content filtering results if available
+        if hasattr(response, 'prompt_filter_results') and response.prompt_filter_results:
+            logger.info(f"Prompt filter results: {response.prompt_filter_results}")
+        
+        if (hasattr(response, 'choices') and response.choices and 
+            hasattr(response.choices[0], 'content_filter_results') and 
+            response.choices[0].content_filter_results):
+            logger.info(f"Content filter results: {response.choices[0].content_filter_results}")
+        
+        if response.choices and response.choices[0].message.content:
+            return response.choices[0].message.content
+        
+        logger.warning("No content returned from Azure OpenAI, possibly filtered")
+        return None
+    
+    def _chunk_delta(self, chunk: Any) -> Optional[str]:
+        """Log content filter results of a streamed chunk and return its text delta"""
+        # Azure sends prompt filter results on a chunk without choices
+        if getattr(chunk, 'prompt_filter_results', None):
+            logger.info(f"Prompt filter results: {chunk.prompt_filter_results}")
+        
+        if not chunk.choices:
+            return None
+        
+        choice = chunk.choices[0]
+        if getattr(choice, 'finish_reason', None) == "content_filter":
+            logger.warning("Streaming response stopped by content filter")
+            content_filter_results = getattr(choice, 'content_filter_results', None)
+            if content_filter_results:
+                logger.info(f"Content filter results: {content_filter_results}")
+        
+        return choice.delta.content if choice.delta else None
+    
+    @staticmethod
+    def _has_content(chunk: Any) -> bool:
+        """True for a streamed chunk that carries text"""
+        return bool(chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content)
+    
+    async def _aopen_stream(self, deployment: Any, messages: List[Dict[str, str]], params: Dict[str, Any],
+                            cancel: Optional[CancelToken]) -> AsyncPrimedStream:
+        """Open a stream on deployment and read up to its first token"""
+        stream = await deployment.async_client.chat.completions.create(
+            model=deployment.deployment,
+            messages=messages,
+            stream=True,
+            **params,
+            **self._stream_params(),
+            **self._call_options(deployment, cancel)
+        )
+        return await AsyncPrimedStream.open(stream, self._has_content)
+    
+    def _estimate_tokens(self, messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """Estimated quota cost of a request: prompt tokens plus the completion allowance"""
+        return sum(self.history_manager.count_text(message["content"]) for message in messages) + max_tokens
+    
+    def _used_tokens(self, response: Any) -> Optional[int]:
+        usage = getattr(response, 'usage', None)
+        return getattr(usage, 'total_tokens', None) if usage else None
+    
+    def _stream_params(self) -> Dict[str, Any]:
+        """Extra parameters for streamed requests"""
+        # Ask for a final usage chunk so streamed calls report tokens too (API version 2024-09-01-preview or later)
+        if os.getenv("AZURE_OPENAI_STREAM_USAGE", "false").lower() == "true":
+            return {"stream_options": {"include_usage": True}}
+        return {}
+    
+    @staticmethod
+    def _call_options(deployment: Any, cancel: Optional[CancelToken]) -> Dict[str, Any]:
+        """Per-call options: an HTTP timeout no longer than the request's remaining time"""
+        if cancel is None or cancel.deadline is None:
+            return {}
+        cancel.check()
+        return {"timeout": cancel.limit(deployment.timeout)}
+    
+    def _record_completion_tokens(self, tokens: Optional[int]):
+        """Fold the length of a finished completion into the moving average"""
+        if not tokens:
+            return
+        typical = self._typical_completion_tokens
+        # Unsynchronized on purpose: a lost update only skews an estimate
+        self._typical_completion_tokens = tokens if typical is None else 0.9 * typical + 0.1 * tokens
+    
+    def _count_cancelled(self, reason: str, stage: str, labels: Dict[str, Any], max_tokens: int, generated: int = 0):
+        """
+        Count a request stopped early and the completion tokens that stopping it saved
+        
+        The saving is the typical completion length minus what was already
+        generated; nothing is claimed before a completion finished to measure.
+        Non-streamed calls save nothing: the service finishes them even when
+        nobody reads the result.
+        """
+        saved = 0
+        typical = self._typical_completion_tokens
+        if stage != "completion" and typical:
+            saved = max(0, round(min(typical, max_tokens)) - generated)
+        metrics.record_cancelled(reason, stage, labels["persona"], labels["deployment"], saved)
+        logger.info(f"Request {reason} while {stage}; about {saved} completion tokens not generated")
+    
+    @staticmethod
+    def _cancel_reason(error: BaseException, cancel: Optional[CancelToken]) -> str:
+        if isinstance(error, DeadlineExceeded) or (cancel is not None and not cancel.reason and cancel.expired):
+            return "deadline"
+        if cancel is not None and cancel.reason:
+            return cancel.reason
+        # The reader closed the stream (e.g. the client disconnected)
+        return "closed"
+    
+    @contextmanager
+    def _observe_request(self, persona: Optional[str], stream: bool, max_tokens: int = 0,
+                         cancel: CancelToken = None) -> Iterator[Dict[str, Any]]:
+        """Time an OpenAI call (rate-limit wait and retries included) and count its outcome"""
+        labels = {"deployment": self.deployment_name, "persona": persona, "stream": str(stream).lower()}
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield labels
+        except (RequestCancelled, DeadlineExceeded) as e:
+            # Stopped before the first token (streams) or before the result (completions)
+            outcome = "deadline" if isinstance(e, DeadlineExceeded) else "cancelled"
+            self._count_cancelled(self._cancel_reason(e, cancel), "waiting" if stream else "completion", labels, max_tokens)
+            raise
+        except Exception as e:
+            outcome = "throttled" if is_throttled(e) else "error"
+            raise
+        except BaseException:
+            # The reader stopped consuming the stream (GeneratorExit / cancellation)
+            outcome = "cancelled"
+            raise
+        finally:
+            metrics.observe("openai_request", time.perf_counter() - started, **labels)
+            metrics.REQUESTS_TOTAL.inc(outcome=outcome, **labels)
+    
+    def complete(self, system_prompt: str, user_message: str, conversation_history: List[Dict[str, str]] = None,
+                 persona: str = None, cancel: CancelToken = None) -> Optional[str]:
+        """
+        Generate a response, letting API errors propagate to the caller
+        
+        Throttled (429) and transient failures are retried through the shared
+        rate limiter, honoring Retry-After.
+        
+        Args:
+            system_prompt: The system prompt with persona context
+            user_message: The user's message
+            conversation_history: Optional list of previous messages
+            persona: Persona name used to label metrics
+            cancel: Deadline and cancellation of the request (raises DeadlineExceeded / RequestCancelled)
+            
+        Returns:
+            Generated response string, or None if no content was returned (possibly filtered)
+        """
+        messages = self._build_messages(system_prompt, user_message, conversation_history)
+        params = self._sampling_params()
+        if self.coalescer is None:
+            return self._complete(messages, params, persona, cancel)
+        key = self.coalescer.make_key(self.deployment_name, messages, params, stream=False)
+        return self.coalescer.run(key, lambda: self._complete(messages, params, persona, cancel), cancel=cancel)
+    
+    def _complete(self, messages: List[Dict[str, str]], params: Dict[str, Any], persona: Optional[str],
+                  cancel: Optional[CancelToken] = None) -> Optional[str]:
+        """One upstream call for complete"""
+        with self._observe_request(persona, stream=False, max_tokens=params["max_tokens"], cancel=cancel) as labels:
+            # Generate response with content filtering
+            response, permit, deployment = self.router.open(
+                lambda deployment: deployment.client.chat.completions.create(
+                    model=deployment.deployment,
+                    messages=messages,
+                    **params,
+                    **self._call_options(deployment, cancel)
+                ),
+                self._estimate_tokens(messages, params["max_tokens"]),
+                cancel=cancel
+            )
+            labels["deployment"] = deployment.name
+            permit.release(used_tokens=self._used_tokens(response))
+        usage = getattr(response, 'usage', None)
+        metrics.record_usage(usage, persona, deployment.name)
+        self._record_completion_tokens(getattr(usage, 'completion_tokens', None))
+        return self._response_content(response)
+    
+    async def acomplete(self, system_prompt: str, user_message: str, conversation_history: List[Dict[str, str]] = None,
+                        persona: str = None, cancel: CancelToken = None) -> Optional[str]:
+        """Async variant of complete, bounded by the process-wide limiter"""
+        messages = self._build_messages(system_prompt, user_message, conversation_history)
+        params = self._sampling_params()
+        if self.coalescer is None:
+            return await self._acomplete(messages, params, persona, cancel)
+        key = self.coalescer.make_key(self.deployment_name, messages, params, stream=False)
+        return await self.coalescer.arun(key, lambda: self._acomplete(messages, params, persona, cancel), cancel=cancel)
+    
+    async def _acomplete(self, messages: List[Dict[str, str]], params: Dict[str, Any], persona: Optional[str],
+                         cancel: Optional[CancelToken] = None) -> Optional[str]:
+        """One upstream call for acomplete"""
+        with self._observe_request(persona, stream=False, max_tokens=params["max_tokens"], cancel=cancel) as labels:
+            async with self.limiter.slot(cancel), cancel_scope(cancel):
+                response, permit, deployment = await self.router.aopen(
+                    lambda deployment: deployment.async_client.chat.completions.create(
+                        model=deployment.deployment,
+                        messages=messages,
+                        **params,
+                        **self._call_options(deployment, cancel)
+                    ),
+                    self._estimate_tokens(messages, params["max_tokens"]),
+                    cancel=cancel
+                )
+                labels["deployment"] = deployment.name
+                permit.release(used_tokens=self._used_tokens(response))
+        usage = getattr(response, 'usage', None)
+        metrics.record_usage(usage, persona, deployment.name)
+        self._record_completion_tokens(getattr(usage, 'completion_tokens', None))
+        return self._response_content(response)
     
-    def generate_response(self, system_prompt: str, user_message: str, conversation_history: List[Dict[str, str]] = None) -> str:
+    def generate_response(self, system_prompt: str, user_message: str, conversation_history: List[Dict[str, str]] = None,
+                          persona: str = None, cancel: CancelToken = None) -> str:
         """
         Generate a response using Azure OpenAI with Managed Identity authentication and content filtering
         
@@ -165,109 +516,822 @@ class AzureOpenAIClient:
             system_prompt: The system prompt with persona context
             user_message: The user's message
             conversation_history: Optional list of previous messages
+            persona: Persona name used to label metrics
+            cancel: Deadline and cancellation of the request
             
         Returns:
             Generated response string
         """
         try:
-            # Security limits
-            max_tokens = min(int(os.getenv("AZURE_OPENAI_MAX_TOKENS", "500")), 1000)
-            temperature = max(0.0, min(1.0, float(os.getenv("AZURE_OPENAI_TEMPERATURE", "0.7"))))
-            top_p = max(0.0, min(1.0, float(os.getenv("AZURE_OPENAI_TOP_P", "0.9"))))
+            response = self.complete(system_prompt, user_message, conversation_history, persona=persona, cancel=cancel)
             
-            # Build message list
-            messages = [{"role": "system", "content": system_prompt}]
+            # Return the response or a safe fallback
+            return response if response else FILTERED_FALLBACK_MESSAGE
             
-            # Add conversation history if provided (limit to last 10 messages for context window management)
-            if conversation_history:
-                # Limit conversation history to prevent token overflow
-                recent_history = conversation_history[-10:] if len(conversation_history) > 10 else conversation_history
-                messages.extend(recent_history)
+        except Exception as e:
+            return self.error_message(e)
+    
+    def complete_stream(self, system_prompt: str, user_message: str, conversation_history: List[Dict[str, str]] = None,
+                        persona: str = None, cancel: CancelToken = None) -> Iterator[str]:
+        """
+        Stream a response as text deltas, letting API errors propagate to the caller
+        
+        Content filter results are logged the same way as in complete. Nothing is
+        yielded if no content was returned (possibly filtered).
+        
+        cancel bounds the wait for the first token; after that the caller stops
+        reading when it wants to stop, and closing the iterator closes the
+        upstream stream so the service stops generating.
+        
+        Args:
+            system_prompt: The system prompt with persona context
+            user_message: The user's message
+            conversation_history: Optional list of previous messages
+            persona: Persona name used to label metrics
+            cancel: Deadline and cancellation of the request
             
-            # Add current user message
-            messages.append({"role": "user", "content": user_message})
+        Yields:
+            Response text deltas
+        """
+        messages = self._build_messages(system_prompt, user_message, conversation_history)
+        params = self._sampling_params()
+        if self.coalescer is None:
+            return self._complete_stream(messages, params, persona, cancel)
+        key = self.coalescer.make_key(self.deployment_name, messages, {**params, **self._stream_params()}, stream=True)
+        return self.coalescer.stream(key, lambda: self._complete_stream(messages, params, persona, cancel), cancel=cancel)
+    
+    def _complete_stream(self, messages: List[Dict[str, str]], params: Dict[str, Any], persona: Optional[str],
+                         cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        """One upstream streamed call for complete_stream"""
+        received_content = False
+        with self._observe_request(persona, stream=True, max_tokens=params["max_tokens"], cancel=cancel) as labels:
+            started = time.perf_counter()
+            # The routed request includes the wait for the first token, so routing and hedging compare TTFT
+            stream, permit, deployment = self.router.open(
+                lambda deployment: PrimedStream(
+                    deployment.client.chat.completions.create(
+                        model=deployment.deployment,
+                        messages=messages,
+                        stream=True,
+                        **params,
+                        **self._stream_params(),
+                        **self._call_options(deployment, cancel)
+                    ),
+                    self._has_content,
+                    cancel
+                ),
+                self._estimate_tokens(messages, params["max_tokens"]),
+                stream=True,
+                discard=lambda stream: stream.close(),
+                cancel=cancel
+            )
+            labels["deployment"] = deployment.name
             
-            # Generate response with content filtering
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                frequency_penalty=0.0,
-                presence_penalty=0.0,
-                stop=None  # Let Azure OpenAI handle natural stopping
+            usage_chunk = None
+            generated = 0
+            try:
+                for chunk in stream:
+                    if getattr(chunk, 'usage', None):
+                        usage_chunk = chunk
+                    delta = self._chunk_delta(chunk)
+                    if delta:
+                        if not received_content:
+                            metrics.observe("openai_ttft", time.perf_counter() - started, **labels)
+                        received_content = True
+                        generated += 1
+                        yield delta
+            except Exception as e:
+                permit.release(error=e)
+                raise
+            except GeneratorExit as e:
+                # The reader stopped early; closing the stream below stops the generation
+                self._count_cancelled(self._cancel_reason(e, cancel), "streaming", labels, params["max_tokens"], generated)
+                raise
+            finally:
+                permit.release(used_tokens=self._used_tokens(usage_chunk))
+                stream.close()
+            usage = getattr(usage_chunk, 'usage', None)
+            metrics.record_usage(usage, persona, deployment.name)
+            # One content chunk is about one token when the service does not report usage
+            self._record_completion_tokens(getattr(usage, 'completion_tokens', None) or generated)
+        
+        if not received_content:
+            logger.warning("No content returned from Azure OpenAI, possibly filtered")
+    
+    async def acomplete_stream(self, system_prompt: str, user_message: str, conversation_history: List[Dict[str, str]] = None,
+                               persona: str = None, cancel: CancelToken = None) -> AsyncIterator[str]:
+        """Async variant of complete_stream; holds a limiter slot until the stream ends"""
+        messages = self._build_messages(system_prompt, user_message, conversation_history)
+        params = self._sampling_params()
+        if self.coalescer is None:
+            upstream = self._acomplete_stream(messages, params, persona, cancel)
+        else:
+            key = self.coalescer.make_key(self.deployment_name, messages, {**params, **self._stream_params()}, stream=True)
+            upstream = self.coalescer.astream(key, lambda: self._acomplete_stream(messages, params, persona, cancel), cancel=cancel)
+        try:
+            async for delta in upstream:
+                yield delta
+        finally:
+            # Pass an early close on, so the call (or this reader's share of it) is released promptly
+            await upstream.aclose()
+    
+    async def _acomplete_stream(self, messages: List[Dict[str, str]], params: Dict[str, Any],
+                                persona: Optional[str], cancel: Optional[CancelToken] = None) -> AsyncIterator[str]:
+        """One upstream streamed call for acomplete_stream"""
+        received_content = False
+        with self._observe_request(persona, stream=True, max_tokens=params["max_tokens"], cancel=cancel) as labels:
+            started = time.perf_counter()
+            async with self.limiter.slot(cancel):
+                # Only the wait for the first token is interrupted from outside: the scope must not span a yield
+                async with cancel_scope(cancel):
+                    stream, permit, deployment = await self.router.aopen(
+                        lambda deployment: self._aopen_stream(deployment, messages, params, cancel),
+                        self._estimate_tokens(messages, params["max_tokens"]),
+                        stream=True,
+                        discard=lambda stream: stream.close(),
+                        cancel=cancel
+                    )
+                labels["deployment"] = deployment.name
+                
+                usage_chunk = None
+                generated = 0
+                try:
+                    async for chunk in stream:
+                        if getattr(chunk, 'usage', None):
+                            usage_chunk = chunk
+                        delta = self._chunk_delta(chunk)
+                        if delta:
+                            if not received_content:
+                                metrics.observe("openai_ttft", time.perf_counter() - started, **labels)
+                            received_content = True
+                            generated += 1
+                            yield delta
+                except Exception as e:
+                    permit.release(error=e)
+                    raise
+                except BaseException as e:
+                    # GeneratorExit or task cancellation: the reader stopped early
+                    self._count_cancelled(self._cancel_reason(e, cancel), "streaming", labels, params["max_tokens"], generated)
+                    raise
+                finally:
+                    permit.release(used_tokens=self._used_tokens(usage_chunk))
+                    # Release the HTTP connection promptly if the reader stops early, which stops the generation
+                    await stream.close()
+            usage = getattr(usage_chunk, 'usage', None)
+            metrics.record_usage(usage, persona, deployment.name)
+            self._record_completion_tokens(getattr(usage, 'completion_tokens', None) or generated)
+        
+        if not received_content:
+            logger.warning("No content returned from Azure OpenAI, possibly filtered")
+    
+    def generate_response_stream(self, system_prompt: str, user_message: str, conversation_history: List[Dict[str, str]] = None,
+                                 persona: str = None, cancel: CancelToken = None) -> Iterator[str]:
+        """
+        Generate a response as a stream of text deltas, yielded as soon as they arrive
+        
+        If the stream ends without any content (e.g. filtered) or fails before the
+        first delta, the corresponding safe fallback message is yielded instead.
+        
+        Args:
+            system_prompt: The system prompt with persona context
+            user_message: The user's message
+            conversation_history: Optional list of previous messages
+            persona: Persona name used to label metrics
+            cancel: Deadline and cancellation of the request
+            
+        Yields:
+            Response text deltas
+        """
+        received_content = False
+        try:
+            for delta in self.complete_stream(system_prompt, user_message, conversation_history, persona=persona, cancel=cancel):
+                received_content = True
+                yield delta
+            
+            if not received_content:
+                yield FILTERED_FALLBACK_MESSAGE
+        
+        except Exception as e:
+            message = self.error_message(e)
+            # Do not append an error notice to a partially streamed answer
+            if not received_content:
+                yield message
+
+class PersonaSnapshot:
+    """
+    One version of the prompt template and the personas rendered with it
+    
+    A snapshot is never modified after it is replaced, except for personas
+    being added to it as they are first loaded; reloads build a new one and
+    swap it in with a single assignment.
+    """
+    
+    def __init__(self, version: int, prompt_builder: PromptBuilder,
+                 personas: Dict[str, Tuple[Dict[str, Any], str, Optional[str]]] = None):
+        self.version = version
+        self.prompt_builder = prompt_builder
+        # persona file -> (config, system prompt, catalog hash of the file it was read from)
+        self.personas = personas if personas is not None else {}
+
+class PersonaEngine:
+    """
+    Process-wide resources shared by every chat session
+    
+    Holds the Azure credential and OpenAI client (with its HTTP connection pool),
+    the prompt template and the parsed personas. It is created once per process
+    and is safe to use from multiple Streamlit script threads at the same time.
+    
+    The template and personas live in a versioned PersonaSnapshot. reload()
+    re-reads what changed on disk and swaps in a new snapshot; sessions keep
+    the persona and prompt they loaded until they reset.
+    """
+    
+    def __init__(self, bots_directory: str = None, template_path: str = None, openai_client: "AzureOpenAIClient" = None,
+                 session_store: SessionStore = None):
+        bootstrap.configure()
+        # Validated configs compiled by create_deployment_package.py; YAML is the fallback
+        self.bundle = PersonaBundle.load(os.getenv("PERSONA_BUNDLE_PATH", str(BASE_DIR / BUNDLE_FILENAME)))
+        self.persona_loader = PersonaLoader(bots_directory, self.bundle)
+        # Metadata index for listing and search; full configs are loaded on first use
+        self.catalog = PersonaCatalog(
+            self.persona_loader.bots_directory,
+            rescan_interval=float(os.getenv("PERSONA_CATALOG_RESCAN_SECONDS", "60")),
+            bundle=self.bundle
+        )
+        # Created on first use (or by prewarm()) so the first page renders before the SDKs load
+        self._openai_client = openai_client
+        self._client_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._snapshot = PersonaSnapshot(1, PromptBuilder(template_path))
+        if self.bundle is not None and self.bundle.template_hash != self.prompt_builder.template_hash:
+            logger.warning("Prompt template changed since the persona bundle was built; rebuild it on the next deploy")
+        self._watcher = None
+        # Last prompt_report(), exported as gauges
+        self._prompt_report = None
+        
+        # Introductions are nearly static, so reuse a few variants per persona
+        if os.getenv("PERSONA_INTRO_CACHE_ENABLED", "true").lower() == "true":
+            self.intro_cache = IntroCache(
+                variants=int(os.getenv("PERSONA_INTRO_CACHE_VARIANTS", "3")),
+                ttl=float(os.getenv("PERSONA_INTRO_CACHE_TTL_SECONDS", "3600"))
             )
+        else:
+            self.intro_cache = None
+        
+        # Optional cache for repeated first-turn questions
+        if os.getenv("PERSONA_RESPONSE_CACHE_ENABLED", "false").lower() == "true":
+            self.response_cache = ResponseCache(
+                maxsize=int(os.getenv("PERSONA_RESPONSE_CACHE_SIZE", "1024")),
+                ttl=float(os.getenv("PERSONA_RESPONSE_CACHE_TTL_SECONDS", "3600")),
+                similarity_threshold=float(os.getenv("PERSONA_RESPONSE_CACHE_SIMILARITY", "0.9"))
+            )
+        else:
+            self.response_cache = None
+        self.response_cache_max_history = int(os.getenv("PERSONA_RESPONSE_CACHE_MAX_HISTORY", "2"))
+        
+        # Fold turns that no longer fit the budget into a rolling summary
+        self.summarize_history = os.getenv("PERSONA_HISTORY_SUMMARY_ENABLED", "false").lower() == "true"
+        
+        # Transcripts of every session: the history shown in the UI and sent to the model
+        self.sessions = session_store if session_store is not None else create_session_store()
+        
+        if self.intro_cache is not None:
+            metrics.registry.register_collector("persona_bot_intro_cache", self.intro_cache.stats)
+        if self.response_cache is not None:
+            metrics.registry.register_collector("persona_bot_response_cache", self.response_cache.stats)
+        metrics.registry.register_collector("persona_bot_catalog", self.catalog.stats)
+        metrics.registry.register_collector("persona_bot_system_prompt", self._prompt_stats)
+        
+        # The request in progress per session: a new message supersedes it, a reset cancels it
+        self.requests = RequestTracker(timeout=float(os.getenv("PERSONA_REQUEST_TIMEOUT_SECONDS", "60")))
+        metrics.registry.register_collector("persona_bot_requests", self.requests.stats)
+        metrics.registry.register_collector("persona_bot_sessions", self.sessions.stats)
+        if self.bundle is not None:
+            metrics.registry.register_collector("persona_bot_bundle", self.bundle.stats)
+    
+    @property
+    def openai_client(self) -> AzureOpenAIClient:
+        """Shared Azure OpenAI client, created on first use"""
+        if self._openai_client is None:
+            with self._client_lock:
+                if self._openai_client is None:
+                    with metrics.span("openai_client_init"):
+                        self._openai_client = AzureOpenAIClient()
+        return self._openai_client
+    
+    def prewarm(self):
+        """
+        Do the first request's one-time work ahead of time
+        
+        Creates the Azure OpenAI client (importing the SDKs), fetches the first
+        token and loads every persona and its prompt. Meant for a background
+        thread while the first page is served; failures are logged and the work
+        is simply redone lazily on first use.
+        """
+        started = time.perf_counter()
+        try:
+            self.openai_client.token_provider.get_token()
+        except Exception as e:
+            logger.warning(f"Pre-warm could not prepare the Azure OpenAI client: {e}")
+        
+        for persona_file in self.list_available_personas():
+            try:
+                self.get_persona(persona_file)
+            except Exception as e:
+                logger.warning(f"Pre-warm could not load {persona_file}: {e}")
+        
+        try:
+            self._log_prompt_report()
+        except Exception as e:
+            logger.warning(f"Pre-warm could not profile the system prompts: {e}")
+        
+        elapsed = time.perf_counter() - started
+        metrics.observe("prewarm", elapsed)
+        logger.info(f"Pre-warm finished in {elapsed:.2f}s")
+    
+    def get_persona(self, persona_file: str) -> Tuple[Dict[str, Any], str]:
+        """
+        Get a parsed persona and its system prompt, loading them on first use
+        
+        Args:
+            persona_file: Name of the persona file (e.g., 'maria-silva.yaml')
             
-            # Log content filtering results if available
-            if hasattr(response, 'prompt_filter_results') and response.prompt_filter_results:
-                logger.info(f"Prompt filter results: {response.prompt_filter_results}")
+        Returns:
+            Tuple of (persona configuration, system prompt). The configuration is
+            shared between sessions and must be treated as read-only.
+        """
+        snapshot = self._snapshot
+        cached = snapshot.personas.get(persona_file)
+        if cached is not None:
+            return cached[0], cached[1]
+        
+        # Parse outside the lock so a slow file read does not block other sessions
+        entry = self.catalog.get(persona_file)
+        persona_config = self._load_validated(persona_file)
+        system_prompt = snapshot.prompt_builder.build_system_prompt(persona_config)
+        
+        with self._lock:
+            cached = snapshot.personas.setdefault(
+                persona_file, (persona_config, system_prompt, entry.file_hash if entry else None)
+            )
+        return cached[0], cached[1]
+    
+    def prompt_report(self, count_text: Callable[[str], int] = None) -> Dict[str, Any]:
+        """
+        Input-token cost of every persona's system prompt with the current template
+        
+        Args:
+            count_text: Token counter; defaults to the Azure OpenAI client's tokenizer
             
-            if (hasattr(response, 'choices') and response.choices and 
-                hasattr(response.choices[0], 'content_filter_results') and 
-                response.choices[0].content_filter_results):
-                logger.info(f"Content filter results: {response.choices[0].content_filter_results}")
+        Returns:
+            Dict with the template file, one profile per persona (see
+            prompt_profile.profile_prompt), the tokens all prompts share as a
+            prefix and whether that prefix is long enough to be cached by the
+            provider across personas
+        """
+        if count_text is None:
+            count_text = self.openai_client.history_manager.tokenizer.count_text
+        prompt_builder = self.prompt_builder
+        profiles = []
+        prompts = []
+        for persona_file in self.list_available_personas():
+            persona_config, system_prompt = self.get_persona(persona_file)
+            profile = profile_prompt(prompt_builder.template, persona_config, count_text, prompt_builder.DEFAULT_VALUES)
+            profile["file"] = persona_file
+            profiles.append(profile)
+            prompts.append(system_prompt)
+        shared_tokens = count_text(shared_prefix(prompts))
+        report = {
+            "template": os.path.basename(prompt_builder.template_path),
+            "personas": profiles,
+            "shared_prefix_tokens": shared_tokens,
+            "shared_prefix_cacheable": shared_tokens >= PROMPT_CACHE_MIN_TOKENS,
+        }
+        self._prompt_report = report
+        return report
+    
+    def _log_prompt_report(self):
+        """Log each persona's system prompt size and anything the profiler flagged"""
+        report = self.prompt_report()
+        for profile in report["personas"]:
+            logger.info(
+                f"System prompt of {profile['file']}: {profile['total_tokens']} tokens "
+                f"({profile['static_prefix_tokens']} in the static prefix)"
+            )
+            for warning in profile["warnings"]:
+                logger.warning(f"System prompt of {profile['file']}: {warning}")
+        logger.info(
+            f"System prompts share a {report['shared_prefix_tokens']}-token prefix "
+            f"(provider prompt caching starts at {PROMPT_CACHE_MIN_TOKENS})"
+        )
+    
+    def _prompt_stats(self) -> Dict[str, float]:
+        report = self._prompt_report
+        if report is None or not report["personas"]:
+            return {}
+        totals = [profile["total_tokens"] for profile in report["personas"]]
+        return {
+            "personas": len(totals),
+            "max_tokens": max(totals),
+            "mean_tokens": round(sum(totals) / len(totals), 1),
+            "shared_prefix_tokens": report["shared_prefix_tokens"],
+            "warnings": sum(len(profile["warnings"]) for profile in report["personas"]),
+        }
+    
+    @property
+    def prompt_builder(self) -> PromptBuilder:
+        """Prompt builder of the current snapshot"""
+        return self._snapshot.prompt_builder
+    
+    @property
+    def version(self) -> int:
+        """Version of the current snapshot; increases on every reload that changed something"""
+        return self._snapshot.version
+    
+    def reload(self) -> bool:
+        """
+        Re-read changed persona files and the template, then swap in a new snapshot
+        
+        Only personas already loaded into the current snapshot whose file
+        changed are re-parsed; the rest load lazily as before. A file or
+        template that fails to parse or validate keeps its previous version.
+        In-flight chats are unaffected: they hold their own prompt strings.
+        
+        Returns:
+            True if a new snapshot was installed
+        """
+        with self._reload_lock:
+            snapshot = self._snapshot
+            self.catalog.refresh()
+            prompt_builder = self._reload_template(snapshot.prompt_builder)
+            template_changed = prompt_builder is not snapshot.prompt_builder
             
-            # Return the response or a safe fallback
-            if response.choices and response.choices[0].message.content:
-                return response.choices[0].message.content
-            else:
-                logger.warning("No content returned from Azure OpenAI, possibly filtered")
-                return "I apologize, but I cannot provide a response to that request. Please try rephrasing your question."
+            with self._lock:
+                loaded = list(snapshot.personas.items())
+            
+            personas = {}
+            changed = template_changed
+            for persona_file, (persona_config, system_prompt, file_hash) in loaded:
+                entry = self.catalog.get(persona_file)
+                if entry is None:
+                    # Deleted: drop it; sessions using it keep their own copy
+                    changed = True
+                    continue
+                reparsed = False
+                if entry.file_hash != file_hash:
+                    try:
+                        persona_config = self._load_validated(persona_file)
+                        file_hash = entry.file_hash
+                        reparsed = True
+                    except Exception as e:
+                        logger.error(f"Keeping the previous version of {persona_file}: {e}")
+                if reparsed or template_changed:
+                    system_prompt = prompt_builder.build_system_prompt(persona_config)
+                changed = changed or reparsed
+                personas[persona_file] = (persona_config, system_prompt, file_hash)
             
+            if not changed:
+                return False
+            
+            # Derived caches (prompts, intros, responses) are keyed by content hashes,
+            # so entries of the previous version are simply never hit again
+            self._snapshot = PersonaSnapshot(snapshot.version + 1, prompt_builder, personas)
+            logger.info(f"Installed persona snapshot version {self._snapshot.version}")
+            return True
+    
+    def start_watcher(self, poll_interval: float = 2.0) -> FileWatcher:
+        """Reload automatically when files in bots/ or the template change"""
+        if self._watcher is None:
+            self._watcher = FileWatcher(
+                [self.persona_loader.bots_directory, self.prompt_builder.template_path],
+                self.reload,
+                poll_interval=poll_interval
+            ).start()
+        return self._watcher
+    
+    def _load_validated(self, persona_file: str) -> Dict[str, Any]:
+        """Load a persona file and check it is usable"""
+        persona_config = self.persona_loader.load_persona(persona_file)
+        if not isinstance(persona_config, dict):
+            raise ValueError(f"Persona file {persona_file} must contain a mapping")
+        return persona_config
+    
+    def _reload_template(self, prompt_builder: PromptBuilder) -> PromptBuilder:
+        """Return a new PromptBuilder if the template changed and is valid, else the given one"""
+        try:
+            with open(prompt_builder.template_path, 'r', encoding='utf-8') as f:
+                template_content = f.read()
+        except OSError as e:
+            logger.error(f"Keeping the previous prompt template: {e}")
+            return prompt_builder
+        if content_hash(template_content) == prompt_builder.template_hash:
+            return prompt_builder
+        if not template_content.strip():
+            logger.error("Keeping the previous prompt template: the new one is empty")
+            return prompt_builder
+        try:
+            return PromptBuilder(prompt_builder.template_path)
         except Exception as e:
-            logger.error(f"Error generating response: {e}")
-            if "authentication" in str(e).lower() or "unauthorized" in str(e).lower():
-                return "Authentication error: Please ensure you have proper permissions to access Azure OpenAI. Check the documentation for setup instructions."
-            elif "content_filter" in str(e).lower():
-                return "I apologize, but I cannot provide a response to that request due to content policy restrictions. Please try rephrasing your question."
-            else:
-                return "I apologize, but I'm experiencing technical difficulties. Please try again later."
-            return "I apologize, but I'm having trouble responding right now. Please try again in a moment."
+            logger.error(f"Keeping the previous prompt template: {e}")
+            return prompt_builder
+    
+    def get_introduction_message(self, persona_config: Dict[str, Any], system_prompt: str) -> str:
+        """
+        Get an introduction message for a persona, served from the intro cache when possible
+        
+        Args:
+            persona_config: Persona configuration dictionary
+            system_prompt: System prompt built for the persona
+            
+        Returns:
+            Introduction message (or a safe fallback if generation failed)
+        """
+        intro_prompt = self._introduction_prompt(persona_config)
+        
+        if self.intro_cache is None:
+            return self.openai_client.generate_response(
+                system_prompt=system_prompt,
+                user_message=intro_prompt,
+                conversation_history=[],
+                persona=persona_config.get('name')
+            )
+        
+        key = self._intro_cache_key(persona_config, system_prompt)
+        
+        errors = []
+        
+        def generate() -> Optional[str]:
+            try:
+                return self.openai_client.complete(system_prompt, intro_prompt, [], persona=persona_config.get('name'))
+            except Exception as e:
+                errors.append(self.openai_client.error_message(e))
+                return None
+        
+        intro = self.intro_cache.get_or_generate(key, generate)
+        if intro:
+            return intro
+        # Failures are not cached; the next load will try again
+        return errors[0] if errors else FILTERED_FALLBACK_MESSAGE
+    
+    async def aget_introduction_message(self, persona_config: Dict[str, Any], system_prompt: str) -> str:
+        """Async variant of get_introduction_message"""
+        intro_prompt = self._introduction_prompt(persona_config)
+        errors = []
+        
+        async def generate() -> Optional[str]:
+            try:
+                return await self.openai_client.acomplete(system_prompt, intro_prompt, [], persona=persona_config.get('name'))
+            except Exception as e:
+                errors.append(self.openai_client.error_message(e))
+                return None
+        
+        if self.intro_cache is None:
+            intro = await generate()
+        else:
+            intro = await self.intro_cache.get_or_generate_async(self._intro_cache_key(persona_config, system_prompt), generate)
+        if intro:
+            return intro
+        return errors[0] if errors else FILTERED_FALLBACK_MESSAGE
+    
+    def get_cached_response(self, persona_config: Dict[str, Any], system_prompt: str,
+                            conversation_history: List[Dict[str, str]], user_message: str) -> Optional[str]:
+        """
+        Look up a cached answer for a first-turn or short-history question
+        
+        Returns:
+            Cached response, or None if caching does not apply or nothing matched
+        """
+        if not self._response_cache_applies(persona_config, conversation_history):
+            return None
+        return self.response_cache.get(system_prompt, conversation_history, user_message)
+    
+    def store_cached_response(self, persona_config: Dict[str, Any], system_prompt: str,
+                              conversation_history: List[Dict[str, str]], user_message: str, response: str):
+        """Store a generated answer in the response cache if caching applies"""
+        if self._response_cache_applies(persona_config, conversation_history):
+            self.response_cache.set(system_prompt, conversation_history, user_message, response)
+    
+    def _response_cache_applies(self, persona_config: Dict[str, Any], conversation_history: List[Dict[str, str]]) -> bool:
+        if self.response_cache is None:
+            return False
+        # Personas can opt out with `response_cache: false` in their YAML
+        if persona_config.get('response_cache', True) is False:
+            return False
+        return len(conversation_history) <= self.response_cache_max_history
+    
+    def warm_intro_cache(self):
+        """Fill the intro cache with every variant for every persona in the bots directory"""
+        if self.intro_cache is None:
+            return
+        
+        for persona_file in self.list_available_personas():
+            try:
+                persona_config, system_prompt = self.get_persona(persona_file)
+                key = self._intro_cache_key(persona_config, system_prompt)
+                intro_prompt = self._introduction_prompt(persona_config)
+                while not self.intro_cache.is_full(key):
+                    intro = self.openai_client.complete(system_prompt, intro_prompt, [], persona=persona_config.get('name'))
+                    if not intro:
+                        break
+                    self.intro_cache.add(key, intro)
+            except Exception as e:
+                logger.warning(f"Intro cache warm-up failed for {persona_file}: {e}")
+        logger.info(f"Intro cache warm-up finished: {self.intro_cache.stats()}")
+    
+    def _introduction_prompt(self, persona_config: Dict[str, Any]) -> str:
+        name = persona_config.get('name', 'Unknown')
+        role = persona_config.get('role', 'Unknown Role')
+        industry = persona_config.get('industry', 'Unknown Industry')
+        
+        return f"Introduce yourself briefly as {name}, mention your role as {role} in {industry}, and invite participants to ask you questions about your work and challenges."
+    
+    def _intro_cache_key(self, persona_config: Dict[str, Any], system_prompt: str) -> str:
+        return IntroCache.make_key(
+            persona_config,
+            content_hash(system_prompt),
+            self.openai_client.deployment_name,
+            self.openai_client._sampling_params()
+        )
+    
+    def list_available_personas(self) -> List[str]:
+        """List all available persona files, sorted by persona name"""
+        return self.catalog.files()
+
+_shared_engine = None
+_shared_engine_lock = threading.Lock()
+
+def get_shared_engine(session_store: SessionStore = None) -> PersonaEngine:
+    """
+    Return the process-wide PersonaEngine, creating it on first use
+    
+    Args:
+        session_store: Session store for the engine if this call creates it
+    """
+    global _shared_engine
+    if _shared_engine is None:
+        with _shared_engine_lock:
+            if _shared_engine is None:
+                _shared_engine = PersonaEngine(session_store=session_store)
+                metrics.start_exporters_from_env()
+                if os.getenv("PERSONA_HOT_RELOAD", "true").lower() == "true":
+                    _shared_engine.start_watcher(float(os.getenv("PERSONA_HOT_RELOAD_POLL_SECONDS", "2")))
+                _start_warmup(_shared_engine)
+    return _shared_engine
+
+def _start_warmup(engine: PersonaEngine):
+    """Run the optional pre-warm and intro cache warm-up on one background thread"""
+    steps = []
+    if os.getenv("PERSONA_PREWARM", "false").lower() == "true":
+        steps.append(engine.prewarm)
+    if os.getenv("PERSONA_INTRO_WARMUP", "false").lower() == "true":
+        steps.append(engine.warm_intro_cache)
+    if not steps:
+        return
+    
+    def run():
+        for step in steps:
+            step()
+    
+    threading.Thread(target=run, name="engine-warmup", daemon=True).start()
 
 class PersonaBot:
-    """Main class that orchestrates the persona bot functionality"""
+    """
+    Per-session conversation state on top of a shared PersonaEngine
+    
+    The transcript and rolling summary live in the engine's session store,
+    the single source of truth for both the UI and the model history. The bot
+    only keeps the session id and references to the shared persona and prompt,
+    so an idle session can be evicted from memory (and, with the SQLite store,
+    resumed later) no matter how long the UI holds on to the bot.
+    """
     
-    def __init__(self, bots_directory: str = None, template_path: str = None):
-        self.persona_loader = PersonaLoader(bots_directory)
-        self.prompt_builder = PromptBuilder(template_path)
-        self.openai_client = AzureOpenAIClient()
+    def __init__(self, engine: PersonaEngine = None, session_id: str = None, session: Session = None):
+        """
+        Args:
+            engine: Shared engine; defaults to the process-wide one
+            session_id: Session to resume; a new session is started if it is unknown
+            session: Session already read from the store, used for the bot's whole life
+                instead of reading the store on every access (for a bot serving one request)
+        """
+        self.engine = engine if engine is not None else get_shared_engine()
+        self._session = session
+        if session is None:
+            session = self.engine.sessions.open(session_id)
+        self.session_id = session.id
+        self.persona_file = None
+        self.persona_version = None
         self.current_persona = None
         self.system_prompt = None
-        self.conversation_history = []
+        if session.persona_file:
+            self._resume(session)
+    
+    @property
+    def openai_client(self) -> AzureOpenAIClient:
+        return self.engine.openai_client
+    
+    @property
+    def session(self) -> Session:
+        """This conversation's session, started again empty if it was evicted"""
+        if self._session is not None:
+            return self._session
+        session = self.engine.sessions.open(self.session_id)
+        if session.persona_file is None and self.persona_file:
+            self._pin(session)
+        return session
+    
+    @property
+    def catalog(self) -> PersonaCatalog:
+        return self.engine.catalog
+    
+    @property
+    def conversation_history(self) -> List[Message]:
+        """Messages sent to the model as history"""
+        return self.session.context_messages()
+    
+    @property
+    def history_summary(self) -> Optional[str]:
+        return self.session.summary
+    
+    def transcript(self, since_seq: int = 0) -> List[Message]:
+        """Messages to show in the UI, oldest first (see Session.transcript)"""
+        return self.session.transcript(since_seq)
+    
+    def add_notice(self, content: str, role: str = "assistant"):
+        """Record a message that is shown in the UI but never sent to the model"""
+        session = self.session
+        session.append(role, content, context=False)
+        self.engine.sessions.save(session)
+    
+    def _pin(self, session: Session):
+        """Record the bot's persona and prompt version on the session, which keeps them until it resets"""
+        session.persona_file = self.persona_file
+        session.persona_version = self.persona_version
+        session.system_prompt = self.system_prompt
+    
+    def _resume(self, session: Session):
+        """
+        Reload the persona of a session resumed from the store
+        
+        The session keeps the system prompt it was pinned to, even if a reload
+        installed a newer snapshot since; only reset_conversation() moves it on.
+        """
+        try:
+            self.current_persona, system_prompt = self.engine.get_persona(session.persona_file)
+            if session.system_prompt is None:
+                # Stored before prompts were pinned: pin the current one from now on
+                session.persona_version, session.system_prompt = self.engine.version, system_prompt
+            self.persona_version = session.persona_version
+            self.system_prompt = session.system_prompt
+            self.persona_file = session.persona_file
+            logger.info(f"Resumed session with {len(session.messages)} messages")
+        except Exception as e:
+            logger.warning(f"Could not resume persona {session.persona_file}: {e}")
     
     def load_persona(self, persona_file: str) -> Dict[str, Any]:
         """Load a persona and prepare the system prompt"""
-        self.current_persona = self.persona_loader.load_persona(persona_file)
-        self.system_prompt = self.prompt_builder.build_system_prompt(self.current_persona)
-        self.conversation_history = []  # Reset conversation history
+        with metrics.span("load_persona"):
+            # Pin the snapshot version; the session keeps this prompt until it resets
+            self.persona_version = self.engine.version
+            self.current_persona, self.system_prompt = self.engine.get_persona(persona_file)
+        self.persona_file = persona_file
+        # Reset conversation history; an answer still being generated for the old persona is not wanted
+        self.engine.requests.cancel(self.session_id, "persona_changed")
+        session = self.session
+        self._pin(session)
+        session.clear()
+        self.engine.sessions.save(session)
         return self.current_persona
     
     def get_introduction_message(self) -> str:
-        """Get an introduction message from the persona"""
+        """Get an introduction message from the persona and add it to the transcript"""
         if not self.current_persona:
             return "Hello! I'm a customer persona. Please load a persona configuration first."
         
-        name = self.current_persona.get('name', 'Unknown')
-        role = self.current_persona.get('role', 'Unknown Role')
-        industry = self.current_persona.get('industry', 'Unknown Industry')
-        
-        intro_prompt = f"Introduce yourself briefly as {name}, mention your role as {role} in {industry}, and invite participants to ask you questions about your work and challenges."
-        
-        response = self.openai_client.generate_response(
-            system_prompt=self.system_prompt,
-            user_message=intro_prompt,
-            conversation_history=[]
-        )
+        intro = self.engine.get_introduction_message(self.current_persona, self.system_prompt)
+        self.add_notice(intro)
+        return intro
+    
+    async def aget_introduction_message(self) -> str:
+        """Async variant of get_introduction_message"""
+        if not self.current_persona:
+            return "Hello! I'm a customer persona. Please load a persona configuration first."
         
-        return response
+        intro = await self.engine.aget_introduction_message(self.current_persona, self.system_prompt)
+        await asyncio.to_thread(self.add_notice, intro)
+        return intro
     
-    def chat(self, user_message: str) -> str:
+    def chat(self, user_message: str, cancel: CancelToken = None) -> str:
         """
         Process a user message and return a persona response
         
+        The request supersedes one still running for this session. A
+        cancelled request (superseded, reset or abandoned) is not added to the
+        conversation.
+        
         Args:
             user_message: The user's input message
+            cancel: Deadline and cancellation of the request; defaults to PERSONA_REQUEST_TIMEOUT_SECONDS
             
         Returns:
             Persona's response
@@ -275,28 +1339,257 @@ class PersonaBot:
         if not self.current_persona or not self.system_prompt:
             return "Please load a persona configuration first."
         
-        # Generate response
-        response = self.openai_client.generate_response(
-            system_prompt=self.system_prompt,
-            user_message=user_message,
-            conversation_history=self.conversation_history
-        )
+        with self.engine.requests.track(self.session_id, cancel) as token:
+            session = self.session
+            history = session.context_messages()
+            cached = self.engine.get_cached_response(self.current_persona, self.system_prompt, history, user_message)
+            if cached is not None:
+                self._append_exchange(session, user_message, cached)
+                return cached
+            
+            # Generate response
+            try:
+                response = self.openai_client.complete(
+                    system_prompt=self.system_prompt,
+                    user_message=user_message,
+                    conversation_history=self._request_history(session, history),
+                    persona=self.current_persona.get('name'),
+                    cancel=token
+                )
+                if response:
+                    self.engine.store_cached_response(
+                        self.current_persona, self.system_prompt, history, user_message, response
+                    )
+                else:
+                    response = FILTERED_FALLBACK_MESSAGE
+            except Exception as e:
+                response = self.openai_client.error_message(e)
+            if token.cancelled:
+                return response
         
         # Update conversation history
-        self.conversation_history.append({"role": "user", "content": user_message})
-        self.conversation_history.append({"role": "assistant", "content": response})
+        self._append_exchange(session, user_message, response)
+        
+        return response
+    
+    def chat_stream(self, user_message: str, cancel: CancelToken = None) -> Iterator[str]:
+        """
+        Process a user message and stream the persona response as it is generated
+        
+        The full reply is committed to the conversation history once the stream
+        has been consumed. The request supersedes one still running for this
+        session; the token is checked between deltas, and a cancelled stream is
+        closed upstream and left out of the conversation. When the deadline
+        passes mid-answer, the part already shown is kept.
         
-        # Keep only last 10 exchanges to manage token usage
-        if len(self.conversation_history) > 20:
-            self.conversation_history = self.conversation_history[-20:]
+        Args:
+            user_message: The user's input message
+            cancel: Deadline and cancellation of the request; defaults to PERSONA_REQUEST_TIMEOUT_SECONDS
+            
+        Yields:
+            Persona's response text deltas
+        """
+        if not self.current_persona or not self.system_prompt:
+            yield "Please load a persona configuration first."
+            return
         
+        with self.engine.requests.track(self.session_id, cancel) as token:
+            session = self.session
+            history = session.context_messages()
+            cached = self.engine.get_cached_response(self.current_persona, self.system_prompt, history, user_message)
+            if cached is not None:
+                yield cached
+                self._append_exchange(session, user_message, cached)
+                return
+            
+            chunks = []
+            stream = self.openai_client.complete_stream(
+                system_prompt=self.system_prompt,
+                user_message=user_message,
+                conversation_history=self._request_history(session, history),
+                persona=self.current_persona.get('name'),
+                cancel=token
+            )
+            try:
+                for delta in stream:
+                    if token.cancelled or token.expired:
+                        break
+                    chunks.append(delta)
+                    yield delta
+                else:
+                    if chunks:
+                        self.engine.store_cached_response(
+                            self.current_persona, self.system_prompt, history, user_message, "".join(chunks)
+                        )
+                    else:
+                        chunks.append(FILTERED_FALLBACK_MESSAGE)
+                        yield FILTERED_FALLBACK_MESSAGE
+            except Exception as e:
+                message = self.openai_client.error_message(e)
+                # Do not append an error notice to a partially streamed answer
+                if not chunks:
+                    chunks.append(message)
+                    yield message
+            finally:
+                # Stops the generation if we stopped reading early
+                stream.close()
+            if token.cancelled:
+                return
+        
+        self._append_exchange(session, user_message, "".join(chunks))
+    
+    async def achat(self, user_message: str, cancel: CancelToken = None) -> str:
+        """Async variant of chat, bounded by the process-wide limiter"""
+        if not self.current_persona or not self.system_prompt:
+            return "Please load a persona configuration first."
+        
+        with self.engine.requests.track(self.session_id, cancel) as token:
+            session = self.session
+            history = session.context_messages()
+            cached = self.engine.get_cached_response(self.current_persona, self.system_prompt, history, user_message)
+            if cached is not None:
+                await self._aappend_exchange(session, user_message, cached)
+                return cached
+            
+            try:
+                response = await self.openai_client.acomplete(
+                    system_prompt=self.system_prompt,
+                    user_message=user_message,
+                    conversation_history=self._request_history(session, history),
+                    persona=self.current_persona.get('name'),
+                    cancel=token
+                )
+                if response:
+                    self.engine.store_cached_response(
+                        self.current_persona, self.system_prompt, history, user_message, response
+                    )
+                else:
+                    response = FILTERED_FALLBACK_MESSAGE
+            except Exception as e:
+                response = self.openai_client.error_message(e)
+            if token.cancelled:
+                return response
+        
+        await self._aappend_exchange(session, user_message, response)
         return response
     
+    async def achat_stream(self, user_message: str, cancel: CancelToken = None) -> AsyncIterator[str]:
+        """Async variant of chat_stream, bounded by the process-wide limiter"""
+        if not self.current_persona or not self.system_prompt:
+            yield "Please load a persona configuration first."
+            return
+        
+        with self.engine.requests.track(self.session_id, cancel) as token:
+            session = self.session
+            history = session.context_messages()
+            cached = self.engine.get_cached_response(self.current_persona, self.system_prompt, history, user_message)
+            if cached is not None:
+                yield cached
+                await self._aappend_exchange(session, user_message, cached)
+                return
+            
+            chunks = []
+            stream = self.openai_client.acomplete_stream(
+                system_prompt=self.system_prompt,
+                user_message=user_message,
+                conversation_history=self._request_history(session, history),
+                persona=self.current_persona.get('name'),
+                cancel=token
+            )
+            try:
+                async for delta in stream:
+                    if token.cancelled or token.expired:
+                        break
+                    chunks.append(delta)
+                    yield delta
+                else:
+                    if chunks:
+                        self.engine.store_cached_response(
+                            self.current_persona, self.system_prompt, history, user_message, "".join(chunks)
+                        )
+                    else:
+                        chunks.append(FILTERED_FALLBACK_MESSAGE)
+                        yield FILTERED_FALLBACK_MESSAGE
+            except Exception as e:
+                message = self.openai_client.error_message(e)
+                # Do not append an error notice to a partially streamed answer
+                if not chunks:
+                    chunks.append(message)
+                    yield message
+            finally:
+                await stream.aclose()
+            if token.cancelled:
+                return
+        
+        await self._aappend_exchange(session, user_message, "".join(chunks))
+    
+    def _request_history(self, session: Session, history: List[Message]) -> List[Any]:
+        """History sent with the next request, led by the rolling summary if there is one"""
+        if not session.summary:
+            return history
+        summary_message = {"role": "system", "content": f"Summary of the conversation so far:\n{session.summary}"}
+        return [summary_message] + history
+    
+    def _append_exchange(self, session: Session, user_message: str, response: str):
+        """Record a user/assistant exchange in the session"""
+        pending = self._record_exchange(session, user_message, response)
+        if pending:
+            session.summary = self.openai_client.history_manager.fold_into_summary(
+                session.summary, pending, self.openai_client.complete
+            )
+            self.engine.sessions.save(session)
+    
+    async def _aappend_exchange(self, session: Session, user_message: str, response: str):
+        """Async variant of _append_exchange; the store writes (SQLite) run in a worker thread"""
+        pending = await asyncio.to_thread(self._record_exchange, session, user_message, response)
+        if pending:
+            session.summary = await self.openai_client.history_manager.afold_into_summary(
+                session.summary, pending, self.openai_client.acomplete
+            )
+            await asyncio.to_thread(self.engine.sessions.save, session)
+    
+    def _record_exchange(self, session: Session, user_message: str, response: str) -> List[Message]:
+        """
+        Append an exchange and move the model history window past the turns that no longer fit the budget
+        
+        The transcript keeps every message (up to the ring buffer size); only
+        the window sent to the model moves.
+        
+        Returns:
+            Messages that left the window and still need to be folded into the rolling summary
+        """
+        session.append("user", user_message)
+        session.append("assistant", response)
+        
+        history = session.context_messages()
+        kept = self.openai_client.history_manager.select(self._request_history(session, history), self.system_prompt)
+        kept_history = [message for message in kept if isinstance(message, Message)]
+        session.context_start = kept_history[0].seq if kept_history else session.next_seq
+        dropped = [message for message in history if message.seq < session.context_start]
+        self.engine.sessions.save(session)
+        
+        if not self.engine.summarize_history:
+            return []
+        return [message for message in dropped if not message.summarized]
+    
     def list_available_personas(self) -> List[str]:
         """List all available persona files"""
-        return self.persona_loader.list_available_personas()
+        return self.engine.list_available_personas()
     
     def reset_conversation(self):
-        """Reset the conversation history"""
-        self.conversation_history = []
-        logger.info("Conversation history reset")
\ No newline at end of file
+        """Reset the conversation history, picking up a reloaded persona or template"""
+        self.engine.requests.cancel(self.session_id, "reset")
+        if self.persona_file and self.persona_version != self.engine.version:
+            try:
+                self.persona_version = self.engine.version
+                self.current_persona, self.system_prompt = self.engine.get_persona(self.persona_file)
+                logger.info(f"Session switched to persona snapshot version {self.persona_version}")
+            except Exception as e:
+                # Deleted or broken on disk: keep chatting with the version already loaded
+                logger.warning(f"Keeping the loaded version of {self.persona_file}: {e}")
+        session = self.session
+        if self.persona_file:
+            self._pin(session)
+        session.clear()
+        self.engine.sessions.save(session)
+        logger.info("Conversation history reset")
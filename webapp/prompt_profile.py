@@ -0,0 +1,121 @@
+"""
+System prompt token profiling
+Tokenizes rendered persona prompts per template field and flags oversized, repeated or uncacheable content
+"""
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, List
+
+from template import CompiledTemplate, Slot, format_value
+
+logger = logging.getLogger(__name__)
+
+# Azure OpenAI caches prompt prefixes of at least this many tokens (then in 128-token steps)
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# Sentences shorter than this many words are not reported as repeated
+_MIN_REPEATED_WORDS = 6
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+_NON_WORD = re.compile(r"[^\w\s]")
+# "Q:" / "A:" speaker labels of sample dialogues
+_SPEAKER = re.compile(r"^\s*\w{1,2}:\s*")
+
+def _normalize(sentence: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", _SPEAKER.sub("", sentence).lower()).split())
+
+def profile_prompt(template: CompiledTemplate, persona_config: Dict[str, Any], count_text: Callable[[str], int],
+                   defaults: Dict[str, Any] = None, field_token_limit: int = None,
+                   prompt_token_limit: int = None) -> Dict[str, Any]:
+    """
+    Break down what a persona's system prompt costs in input tokens
+
+    Every slot is rendered and tokenized on its own, so the field costs add up
+    to roughly (not exactly) the prompt's total: tokens can merge across a
+    field's boundaries.
+
+    Args:
+        template: Compiled prompt template
+        persona_config: Persona configuration
+        count_text: Token counter, e.g. Tokenizer.count_text
+        defaults: Fallback text per key, as in CompiledTemplate.render
+        field_token_limit: Flag a field above this many tokens (PERSONA_PROMPT_FIELD_MAX_TOKENS)
+        prompt_token_limit: Flag a prompt above this many tokens (PERSONA_PROMPT_MAX_TOKENS)
+
+    Returns:
+        Dict with the persona name, total tokens, tokens of the static prefix (the
+        text before the first placeholder), tokens of the template's own text, the
+        cost of each field (most expensive first) and a list of warnings
+    """
+    if field_token_limit is None:
+        field_token_limit = int(os.getenv("PERSONA_PROMPT_FIELD_MAX_TOKENS", "400"))
+    if prompt_token_limit is None:
+        prompt_token_limit = int(os.getenv("PERSONA_PROMPT_MAX_TOKENS", "1500"))
+    defaults = defaults or {}
+
+    literals: List[str] = []
+    fields: Dict[str, Dict[str, Any]] = {}
+    values: Dict[str, str] = {}
+    for part in template.parts:
+        if not isinstance(part, Slot):
+            literals.append(part)
+            continue
+        value = part.lookup(persona_config)
+        if value is None:
+            value = part.default if part.default is not None else defaults.get(part.key, "")
+        text = format_value(value)
+        field = fields.get(part.key)
+        if field is None:
+            values[part.key] = text
+            field = fields[part.key] = {"tokens": count_text(text), "occurrences": 0}
+        field["occurrences"] += 1
+
+    prefix = template.parts[0] if template.parts and not isinstance(template.parts[0], Slot) else ""
+    total = count_text(template.render(persona_config, defaults))
+    name = persona_config.get("name", "Unknown")
+    warnings: List[str] = []
+
+    if total > prompt_token_limit:
+        warnings.append(f"Prompt has {total} tokens (limit {prompt_token_limit})")
+    for key, field in fields.items():
+        if field["tokens"] > field_token_limit:
+            warnings.append(f"Field '{key}' has {field['tokens']} tokens (limit {field_token_limit})")
+        if field["occurrences"] > 1 and field["tokens"] > 20:
+            warnings.append(f"Field '{key}' ({field['tokens']} tokens) is rendered {field['occurrences']} times")
+    warnings.extend(_repeated_sentences(values))
+
+    return {
+        "persona": name,
+        "total_tokens": total,
+        "static_prefix_tokens": count_text(prefix),
+        "template_tokens": count_text("".join(literals)),
+        "fields": {
+            key: {**field, "total": field["tokens"] * field["occurrences"]}
+            for key, field in sorted(fields.items(), key=lambda item: -item[1]["tokens"] * item[1]["occurrences"])
+        },
+        "warnings": warnings,
+    }
+
+def shared_prefix(prompts: List[str]) -> str:
+    """Longest text every prompt starts with: what the provider can cache across personas"""
+    return os.path.commonprefix(prompts) if prompts else ""
+
+def _repeated_sentences(values: Dict[str, str]) -> List[str]:
+    """Warnings for sentences that appear more than once in the rendered fields"""
+    seen: Dict[str, str] = {}
+    warnings = []
+    reported = set()
+    for key, text in values.items():
+        for sentence in _SENTENCE_SPLIT.split(text):
+            normalized = _normalize(sentence)
+            if len(normalized.split()) < _MIN_REPEATED_WORDS:
+                continue
+            first = seen.get(normalized)
+            if first is None:
+                seen[normalized] = key
+                continue
+            if normalized not in reported:
+                reported.add(normalized)
+                where = f"'{key}'" if first == key else f"'{first}' and '{key}'"
+                warnings.append(f"Repeated text in {where}: \"{sentence.strip()[:60]}\"")
+    return warnings
@@ -0,0 +1,282 @@
+"""
+Adaptive rate limiting for Azure OpenAI calls
+Process-wide RPM/TPM token buckets, AIMD concurrency control and 429/Retry-After aware retries
+"""
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+from deadline import CancelToken
+
+logger = logging.getLogger(__name__)
+
+class RateLimitTimeout(RuntimeError):
+    """Raised when a request could not get rate-limit capacity in time"""
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second up to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self.tokens = capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available (0 if available now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """Return unused tokens (e.g. when a completion used fewer than max_tokens)"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read the Retry-After delay from an API error's response headers, if present"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_throttled(error: Exception) -> bool:
+    """True for HTTP 429 responses"""
+    return getattr(error, "status_code", None) == 429
+
+def is_retryable(error: Exception) -> bool:
+    """True for throttling, timeouts, connection failures and 5xx responses"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in (408, 409, 429) or status_code >= 500
+    # Connection errors carry no status code; match by class name to stay SDK-agnostic
+    return any(cls.__name__ in ("APIConnectionError", "APITimeoutError") for cls in type(error).__mro__)
+
+def backoff_delay(attempt: int, base_delay: float = 0.5, max_delay: float = 20.0) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+class Permit:
+    """Capacity held by one in-flight request; release it exactly once"""
+
+    def __init__(self, limiter: "AdaptiveRateLimiter", estimated_tokens: int):
+        self._limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self._released = False
+
+    def release(self, error: Optional[Exception] = None, used_tokens: Optional[int] = None):
+        """
+        Args:
+            error: Exception the request failed with, if any
+            used_tokens: Actual total tokens from response.usage, to refund the estimate
+        """
+        if self._released:
+            return
+        self._released = True
+        self._limiter._release(self, error, used_tokens)
+
+class AdaptiveRateLimiter:
+    """
+    Process-wide limiter shared by every session's sync and async calls
+
+    Requests are admitted when the RPM bucket has a request, the TPM bucket has
+    the estimated tokens (prompt estimate + max_tokens), no Retry-After cooldown
+    is active and fewer than the current concurrency limit are in flight. The
+    concurrency limit follows AIMD: it grows by ~1 per limit-worth of successful
+    calls and is halved on every 429.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_concurrency: int = 16, min_concurrency: int = 1,
+                 decrease_factor: float = 0.5, acquire_timeout: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            rpm: Deployment requests-per-minute quota (0 disables the request bucket)
+            tpm: Deployment tokens-per-minute quota (0 disables the token bucket)
+            max_concurrency: Upper bound of the adaptive concurrency limit
+            min_concurrency: Lower bound of the adaptive concurrency limit
+            decrease_factor: Multiplier applied to the limit on throttling
+            acquire_timeout: Maximum seconds a request waits for capacity
+            clock: Monotonic time source (overridable in tests)
+        """
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.request_bucket = TokenBucket(rpm / 60.0, rpm, clock) if rpm else None
+        self.token_bucket = TokenBucket(tpm / 60.0, tpm, clock) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease_factor = decrease_factor
+        self.acquire_timeout = acquire_timeout
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._stats = {
+            "admitted": 0,
+            "throttled": 0,
+            "errors": 0,
+            "retries": 0,
+            "total_wait_seconds": 0.0,
+        }
+
+    def acquire(self, estimated_tokens: int, cancel: CancelToken = None) -> Permit:
+        """Block until the request may be sent and return its permit; cancel bounds and interrupts the wait"""
+        started = self._clock()
+        while True:
+            wait = self._try_acquire(estimated_tokens)
+            if wait == 0.0:
+                return self._admitted(estimated_tokens, started)
+            if self._clock() - started + wait > self.acquire_timeout:
+                raise RateLimitTimeout("Timed out waiting for Azure OpenAI rate-limit capacity")
+            if cancel is not None:
+                cancel.sleep(min(wait, 0.25))
+            else:
+                time.sleep(min(wait, 0.25))
+
+    async def acquire_async(self, estimated_tokens: int, cancel: CancelToken = None) -> Permit:
+        """Async variant of acquire; waits without blocking the event loop"""
+        started = self._clock()
+        while True:
+            wait = self._try_acquire(estimated_tokens)
+            if wait == 0.0:
+                return self._admitted(estimated_tokens, started)
+            if self._clock() - started + wait > self.acquire_timeout:
+                raise RateLimitTimeout("Timed out waiting for Azure OpenAI rate-limit capacity")
+            if cancel is not None:
+                await cancel.asleep(min(wait, 0.25))
+            else:
+                await asyncio.sleep(min(wait, 0.25))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return admission/throttling counters and the current adaptive state"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                "in_flight": self.in_flight,
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "cooldown_seconds": max(0.0, self.blocked_until - self._clock()),
+            })
+        return snapshot
+
+    def record_retry(self):
+        with self._lock:
+            self._stats["retries"] += 1
+
+    def wait_time(self, estimated_tokens: int) -> float:
+        """Seconds until a request of this size would be admitted (0 if now), without taking capacity"""
+        with self._lock:
+            return self._wait_time(estimated_tokens)
+
+    def _wait_time(self, estimated_tokens: int) -> float:
+        now = self._clock()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= int(self.concurrency_limit):
+            return 0.05
+
+        wait = 0.0
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.wait_time(1))
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.wait_time(estimated_tokens))
+        return wait
+
+    def _try_acquire(self, estimated_tokens: int) -> float:
+        """Take capacity if available; otherwise return the seconds to wait"""
+        with self._lock:
+            wait = self._wait_time(estimated_tokens)
+            if wait > 0.0:
+                return wait
+
+            if self.request_bucket is not None:
+                self.request_bucket.take(1)
+            if self.token_bucket is not None:
+                self.token_bucket.take(estimated_tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def _admitted(self, estimated_tokens: int, started: float) -> Permit:
+        waited = self._clock() - started
+        metrics.observe("rate_limit_wait", waited)
+        with self._lock:
+            self._stats["admitted"] += 1
+            self._stats["total_wait_seconds"] += waited
+        return Permit(self, estimated_tokens)
+
+    def _release(self, permit: Permit, error: Optional[Exception], used_tokens: Optional[int]):
+        with self._lock:
+            self.in_flight -= 1
+            if error is None:
+                # Additive increase: roughly +1 per limit-worth of successful calls
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1.0 / self.concurrency_limit)
+                if used_tokens is not None and self.token_bucket is not None and used_tokens < permit.estimated_tokens:
+                    self.token_bucket.give_back(permit.estimated_tokens - used_tokens)
+            elif is_throttled(error):
+                # Multiplicative decrease and a shared cooldown for every session
+                self._stats["throttled"] += 1
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit * self.decrease_factor)
+                retry_after = retry_after_seconds(error)
+                if retry_after is not None:
+                    self.blocked_until = max(self.blocked_until, self._clock() + retry_after)
+                logger.warning(
+                    f"Azure OpenAI throttled the request; concurrency limit now {self.concurrency_limit:.1f}"
+                    + (f", retrying after {retry_after:.1f}s" if retry_after is not None else "")
+                )
+            else:
+                self._stats["errors"] += 1
+
+class RetryPolicy:
+    """When to retry throttled and transient failures; DeploymentRouter runs the retry loop"""
+
+    def __init__(self, limiter: AdaptiveRateLimiter, max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 20.0):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying, or None if the error should propagate"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        self.limiter.record_retry()
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            # The limiter already holds every session back until Retry-After; add jitter
+            return retry_after + random.uniform(0, self.base_delay)
+        return backoff_delay(attempt, self.base_delay, self.max_delay)
@@ -0,0 +1,632 @@
+"""
+Deployment routing for Azure OpenAI calls
+A pool of endpoints/deployments with weights and quotas, latency- and error-aware selection,
+circuit breaking of failing deployments and optional hedged requests
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from deadline import CancelToken
+from rate_limit import AdaptiveRateLimiter, Permit, RetryPolicy, is_retryable, is_throttled
+
+if TYPE_CHECKING:
+    from openai import AsyncAzureOpenAI
+
+logger = logging.getLogger(__name__)
+
+def deployments_from_env() -> List[Dict[str, Any]]:
+    """
+    Read the deployment pool configuration
+
+    AZURE_OPENAI_DEPLOYMENTS holds a JSON list of objects with ``endpoint``,
+    ``deployment``, and optionally ``name``, ``weight``, ``rpm``, ``tpm``,
+    ``max_concurrency`` and ``api_version``; missing fields fall back to the
+    single-deployment AZURE_OPENAI_* variables. Without it, the pool is the
+    one deployment those variables describe.
+
+    Returns:
+        Deployment settings, one dict per deployment
+    """
+    raw = os.getenv("AZURE_OPENAI_DEPLOYMENTS", "").strip()
+    if not raw:
+        return [{}]
+    try:
+        items = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"AZURE_OPENAI_DEPLOYMENTS is not valid JSON: {e}")
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        raise ValueError("AZURE_OPENAI_DEPLOYMENTS must be a non-empty JSON list of objects")
+    return items
+
+class DeploymentHealth:
+    """
+    Recent behaviour of one deployment and its circuit breaker
+
+    Latency is an EWMA per request kind (time to the full completion, or to
+    the first streamed token). The error rate is an EWMA of failures (errors
+    and 429s). After ``failure_threshold`` consecutive server or connection
+    failures the circuit opens and the deployment is skipped for a cooldown
+    that doubles on every failed probe; after the cooldown, one request probes
+    it and a success closes the circuit again.
+    """
+
+    def __init__(self, alpha: float = 0.2, failure_threshold: int = 5, cooldown: float = 30.0,
+                 max_cooldown: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        self.alpha = alpha
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.latency: Dict[bool, Optional[float]] = {False: None, True: None}
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.current_cooldown = cooldown
+        self.circuit_open = False
+        self.probing = False
+        self.ejections = 0
+
+    def available(self) -> bool:
+        """True if the circuit is closed, or open with the cooldown over and no probe running"""
+        with self._lock:
+            if not self.circuit_open:
+                return True
+            return not self.probing and self._clock() >= self.open_until
+
+    def started(self):
+        with self._lock:
+            if self.circuit_open and self._clock() >= self.open_until:
+                self.probing = True
+
+    def succeeded(self, latency: float, stream: bool):
+        with self._lock:
+            previous = self.latency[stream]
+            self.latency[stream] = latency if previous is None else previous + self.alpha * (latency - previous)
+            self.error_rate *= 1.0 - self.alpha
+            self.consecutive_failures = 0
+            if self.circuit_open:
+                logger.info("Deployment recovered; closing its circuit")
+            self.circuit_open = False
+            self.probing = False
+            self.current_cooldown = self.cooldown
+
+    def failed(self, error: Exception):
+        """Record a failure; errors that say nothing about the deployment (e.g. 400) only end a probe"""
+        with self._lock:
+            self.probing = False
+            throttled = is_throttled(error)
+            if not throttled and not is_retryable(error):
+                return
+            self.error_rate += self.alpha * (1.0 - self.error_rate)
+            if throttled:
+                # Quota pressure is handled by the deployment's rate limiter (Retry-After cooldown)
+                return
+            self.consecutive_failures += 1
+            if self.circuit_open:
+                self.current_cooldown = min(self.max_cooldown, self.current_cooldown * 2)
+                self.open_until = self._clock() + self.current_cooldown
+            elif self.consecutive_failures >= self.failure_threshold:
+                self.circuit_open = True
+                self.ejections += 1
+                self.open_until = self._clock() + self.current_cooldown
+
+    def abandoned(self):
+        """The request was cancelled (e.g. it lost a hedge); nothing is learned from it"""
+        with self._lock:
+            self.probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "latency_ms": round((self.latency[False] or 0.0) * 1000, 1),
+                "ttft_ms": round((self.latency[True] or 0.0) * 1000, 1),
+                "error_rate": round(self.error_rate, 4),
+                "circuit_open": 1 if self.circuit_open else 0,
+                "ejections": self.ejections,
+            }
+
+class Deployment:
+    """One Azure OpenAI endpoint/deployment pair with its own clients, quota and health"""
+
+    def __init__(self, settings: Dict[str, Any], token_provider: Any, max_retries: int = 4):
+        """
+        Args:
+            settings: One entry of deployments_from_env()
+            token_provider: Shared CachedTokenProvider (one Entra ID token covers every Azure OpenAI resource)
+            max_retries: Retries for throttled and transient failures
+        """
+        from openai import AzureOpenAI
+
+        self.endpoint = settings.get("endpoint") or os.getenv("AZURE_OPENAI_ENDPOINT")
+        if not self.endpoint:
+            raise ValueError("AZURE_OPENAI_ENDPOINT environment variable must be set")
+        self.deployment = settings.get("deployment") or os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o-mini")
+        self.name = settings.get("name") or (
+            self.deployment if not settings else f"{self.deployment}@{urlparse(self.endpoint).netloc}"
+        )
+        self.weight = max(0.01, float(settings.get("weight", 1.0)))
+        self.api_version = settings.get("api_version") or os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview")
+        self._token_provider = token_provider
+        self._async_client = None
+        # Upper bound for one HTTP call (for streams: the wait for each chunk); request deadlines can shorten it
+        self.timeout = float(os.getenv("AZURE_OPENAI_TIMEOUT_SECONDS", "60"))
+
+        self.client = AzureOpenAI(
+            azure_ad_token_provider=token_provider,
+            api_version=self.api_version,
+            azure_endpoint=self.endpoint,
+            timeout=self.timeout,
+            max_retries=0  # Retries go through the router and the deployment's rate limiter instead
+        )
+        self.rate_limiter = AdaptiveRateLimiter(
+            rpm=int(settings.get("rpm", os.getenv("AZURE_OPENAI_RPM", "0"))),
+            tpm=int(settings.get("tpm", os.getenv("AZURE_OPENAI_TPM", "0"))),
+            max_concurrency=int(settings.get("max_concurrency", os.getenv("PERSONA_MAX_CONCURRENT_REQUESTS", "16")))
+        )
+        self.retry_policy = RetryPolicy(self.rate_limiter, max_retries=max_retries)
+        self.health = DeploymentHealth(
+            failure_threshold=int(os.getenv("AZURE_OPENAI_CIRCUIT_FAILURES", "5")),
+            cooldown=float(os.getenv("AZURE_OPENAI_CIRCUIT_COOLDOWN_SECONDS", "30"))
+        )
+
+    @property
+    def async_client(self) -> "AsyncAzureOpenAI":
+        if self._async_client is None:
+            from openai import AsyncAzureOpenAI
+            self._async_client = AsyncAzureOpenAI(
+                azure_ad_token_provider=self._token_provider.get_token_async,
+                api_version=self.api_version,
+                azure_endpoint=self.endpoint,
+                timeout=self.timeout,
+                max_retries=0
+            )
+        return self._async_client
+
+    def score(self, estimated_tokens: int, stream: bool, default_latency: float) -> float:
+        """Expected cost of sending a request here (lower is better)"""
+        latency = self.health.latency[stream]
+        if latency is None:
+            latency = default_latency
+        queue = self.rate_limiter.wait_time(estimated_tokens)
+        load = 1 + self.rate_limiter.in_flight
+        return (latency * load + queue) * (1.0 + 4.0 * self.health.error_rate) / self.weight
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self.health.stats()
+        snapshot.update({f"limiter_{name}": value for name, value in self.rate_limiter.stats().items()})
+        return snapshot
+
+class DeploymentRouter:
+    """
+    Picks a deployment for every Azure OpenAI call
+
+    Selection is "power of two choices": two deployments are drawn by weight
+    among those whose circuit is closed, and the one with the lower expected
+    cost wins (EWMA latency scaled by in-flight load, plus quota wait, scaled
+    up by the recent error rate, divided by the weight). A failed attempt is
+    retried on another deployment right away when one is available, and on
+    the same one after the usual backoff otherwise.
+
+    With a hedge delay, a request that has not answered (or streamed its first
+    token) after the delay is also sent to a second deployment; the first
+    answer wins and the other request is cancelled. Hedges are capped at a
+    fraction of all requests so a slow region cannot double the load.
+    """
+
+    def __init__(self, deployments: List[Deployment], hedge_delay: float = 0.0, hedge_max_ratio: float = 0.1):
+        """
+        Args:
+            deployments: The pool (at least one)
+            hedge_delay: Seconds before a second request is sent (0 disables hedging)
+            hedge_max_ratio: Maximum fraction of requests that may be hedged
+        """
+        if not deployments:
+            raise ValueError("At least one Azure OpenAI deployment is required")
+        self.deployments = deployments
+        self.hedge_delay = hedge_delay
+        self.hedge_max_ratio = hedge_max_ratio
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {"requests": 0, "failovers": 0, "hedges": 0, "hedge_wins": 0}
+
+    @classmethod
+    def from_env(cls, token_provider: Any, settings: List[Dict[str, Any]] = None) -> "DeploymentRouter":
+        """Build the pool from deployments_from_env() (or the given settings) and the hedging variables"""
+        max_retries = int(os.getenv("AZURE_OPENAI_MAX_RETRIES", "4"))
+        deployments = [Deployment(item, token_provider, max_retries) for item in settings or deployments_from_env()]
+        names = [deployment.name for deployment in deployments]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Azure OpenAI deployment names must be unique: {names}")
+        router = cls(
+            deployments,
+            hedge_delay=float(os.getenv("AZURE_OPENAI_HEDGE_DELAY_MS", "0")) / 1000.0,
+            hedge_max_ratio=float(os.getenv("AZURE_OPENAI_HEDGE_MAX_RATIO", "0.1"))
+        )
+        if len(deployments) > 1:
+            logger.info(f"Routing Azure OpenAI calls across {len(deployments)} deployments: {', '.join(names)}")
+        return router
+
+    @property
+    def primary(self) -> Deployment:
+        return self.deployments[0]
+
+    def choose(self, estimated_tokens: int = 0, stream: bool = False, exclude: Set[Deployment] = frozenset(),
+               fallback: bool = True) -> Optional[Deployment]:
+        """
+        Pick a deployment
+
+        Args:
+            estimated_tokens: Token estimate of the request, for the quota wait
+            stream: Compare streamed (time to first token) or completion latencies
+            exclude: Deployments not to use (already tried or already serving this request)
+            fallback: If nothing else is left, return the excluded or ejected deployment
+                that will recover first instead of None
+
+        Returns:
+            The chosen deployment, or None if fallback is False and none is available
+        """
+        candidates = [d for d in self.deployments if d not in exclude and d.health.available()]
+        if not candidates:
+            if not fallback:
+                return None
+            # Every deployment is ejected or excluded: try the one whose cooldown ends first rather than fail
+            remaining = [d for d in self.deployments if d not in exclude] or self.deployments
+            return min(remaining, key=lambda d: d.health.open_until)
+        if len(candidates) == 1:
+            return candidates[0]
+
+        first = random.choices(candidates, weights=[d.weight for d in candidates])[0]
+        others = [d for d in candidates if d is not first]
+        second = random.choices(others, weights=[d.weight for d in others])[0]
+        # Deployments without measurements yet compete with the best known latency, so they get tried
+        known = [d.health.latency[stream] for d in candidates if d.health.latency[stream] is not None]
+        default_latency = min(known) if known else 0.0
+        return min(
+            (first, second),
+            key=lambda d: d.score(estimated_tokens, stream, default_latency)
+        )
+
+    def open(self, request: Callable[[Deployment], Any], estimated_tokens: int, stream: bool = False,
+             discard: Callable[[Any], None] = None, cancel: CancelToken = None) -> Tuple[Any, Permit, Deployment]:
+        """
+        Send a request to the pool, with failover, retries and optional hedging
+
+        Args:
+            request: Sends the request to the given deployment and returns its result
+            estimated_tokens: Token estimate used by the deployment's rate limiter
+            stream: Whether request returns a (primed) stream; selects the latency to compare
+            discard: Frees the result of a request nobody waits for anymore (a hedge that
+                lost or a cancelled request), e.g. closes its stream
+            cancel: Deadline and cancellation of the request. It bounds the rate-limit and
+                retry waits; the call itself is bounded by the SDK timeout the caller derives
+                from it (and a PrimedStream given the token closes itself when cancelled).
+                Only hedged requests run on worker threads, so the caller can also stop
+                waiting for them as soon as it is cancelled
+
+        Returns:
+            Tuple of (result, permit still held by the caller, deployment that served it)
+        """
+        self._count("requests")
+        first = self.choose(estimated_tokens, stream)
+        if not self._can_hedge():
+            return self._attempt(request, estimated_tokens, stream, first, cancel=cancel)
+
+        primary = self._pool().submit(self._attempt, request, estimated_tokens, stream, first, frozenset(), cancel)
+        futures = [primary]
+        winner = None
+        try:
+            if self._can_hedge() and not self._wait(futures, self.hedge_delay, cancel):
+                second = self.choose(estimated_tokens, stream, exclude={first}, fallback=False)
+                if second is not None and self._take_hedge():
+                    futures.append(
+                        self._pool().submit(self._attempt, request, estimated_tokens, stream, second, {first}, cancel)
+                    )
+            pending = set(futures)
+            while pending and winner is None:
+                done = self._wait(pending, None, cancel)
+                pending -= done
+                winner = next((future for future in done if future.exception() is None), None)
+            if winner is None:
+                winner = primary
+                return primary.result()
+            if winner is not primary:
+                self._count("hedge_wins")
+            return winner.result()
+        finally:
+            # The hedge that lost, or every request if the caller was cancelled
+            for future in futures:
+                if future is not winner:
+                    future.cancel()
+                    future.add_done_callback(lambda f: self._discard(f, discard))
+
+    async def aopen(self, request: Callable[[Deployment], Awaitable[Any]], estimated_tokens: int, stream: bool = False,
+                    discard: Callable[[Any], Awaitable[None]] = None,
+                    cancel: CancelToken = None) -> Tuple[Any, Permit, Deployment]:
+        """
+        Async variant of open; the losing request of a hedge is really cancelled
+
+        cancel bounds the rate-limit and retry waits; interrupting the request
+        itself is left to the caller's cancel_scope (task cancellation).
+        """
+        self._count("requests")
+        first = self.choose(estimated_tokens, stream)
+        if not self._can_hedge():
+            return await self._aattempt(request, estimated_tokens, stream, first, cancel=cancel)
+
+        primary = asyncio.ensure_future(self._aattempt(request, estimated_tokens, stream, first, cancel=cancel))
+        tasks = [primary]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if done:
+                winner = primary
+                return primary.result()
+            second = self.choose(estimated_tokens, stream, exclude={first}, fallback=False)
+            if second is None or not self._take_hedge():
+                result = await primary
+                winner = primary
+                return result
+
+            hedge = asyncio.ensure_future(self._aattempt(request, estimated_tokens, stream, second, {first}, cancel))
+            tasks.append(hedge)
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if not task.cancelled() and task.exception() is None), None)
+            if winner is None:
+                winner = primary
+                return primary.result()
+            if winner is hedge:
+                self._count("hedge_wins")
+            return winner.result()
+        finally:
+            # The loser, or both if the caller was cancelled
+            for task in tasks:
+                if task is not winner:
+                    task.cancel()
+                    task.add_done_callback(lambda t: self._adiscard(t, discard))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _attempt(self, request: Callable[[Deployment], Any], estimated_tokens: int, stream: bool,
+                 deployment: Deployment, exclude: Set[Deployment] = frozenset(),
+                 cancel: CancelToken = None) -> Tuple[Any, Permit, Deployment]:
+        """Send to deployment, failing over to other deployments (or backing off) on retryable errors"""
+        tried = set(exclude)
+        attempt = 0
+        while True:
+            permit = deployment.rate_limiter.acquire(estimated_tokens, cancel)
+            if cancel is not None:
+                try:
+                    cancel.check()
+                except Exception:
+                    permit.release()
+                    raise
+            deployment.health.started()
+            started = time.perf_counter()
+            try:
+                result = request(deployment)
+            except Exception as e:
+                if cancel is not None and (cancel.cancelled or cancel.expired):
+                    # Stopped by the request's own deadline or cancellation: not the deployment's fault
+                    permit.release()
+                    deployment.health.abandoned()
+                    cancel.check()
+                permit.release(error=e)
+                deployment.health.failed(e)
+                delay = deployment.retry_policy.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                deployment, delay = self._next_attempt(deployment, tried, estimated_tokens, stream, delay)
+                if cancel is not None:
+                    cancel.sleep(delay)
+                elif delay:
+                    time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                permit.release()
+                deployment.health.abandoned()
+                raise
+            deployment.health.succeeded(time.perf_counter() - started, stream)
+            return result, permit, deployment
+
+    async def _aattempt(self, request: Callable[[Deployment], Awaitable[Any]], estimated_tokens: int, stream: bool,
+                        deployment: Deployment, exclude: Set[Deployment] = frozenset(),
+                        cancel: CancelToken = None) -> Tuple[Any, Permit, Deployment]:
+        """Async variant of _attempt"""
+        tried = set(exclude)
+        attempt = 0
+        while True:
+            permit = await deployment.rate_limiter.acquire_async(estimated_tokens, cancel)
+            deployment.health.started()
+            started = time.perf_counter()
+            try:
+                result = await request(deployment)
+            except Exception as e:
+                if cancel is not None and (cancel.cancelled or cancel.expired):
+                    # Stopped by the request's own deadline or cancellation: not the deployment's fault
+                    permit.release()
+                    deployment.health.abandoned()
+                    cancel.check()
+                permit.release(error=e)
+                deployment.health.failed(e)
+                delay = deployment.retry_policy.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                deployment, delay = self._next_attempt(deployment, tried, estimated_tokens, stream, delay)
+                if cancel is not None:
+                    await cancel.asleep(delay)
+                elif delay:
+                    await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                permit.release()
+                deployment.health.abandoned()
+                raise
+            deployment.health.succeeded(time.perf_counter() - started, stream)
+            return result, permit, deployment
+
+    def _next_attempt(self, failed: Deployment, tried: Set[Deployment], estimated_tokens: int, stream: bool,
+                      delay: float) -> Tuple[Deployment, float]:
+        """Deployment for the retry and the delay before it: none when failing over to another deployment"""
+        tried.add(failed)
+        other = self.choose(estimated_tokens, stream, exclude=tried, fallback=False)
+        if other is not None:
+            self._count("failovers")
+            logger.info(f"Failing over from {failed.name} to {other.name}")
+            return other, 0.0
+        # Every deployment was tried: start over after the backoff
+        tried.clear()
+        return self.choose(estimated_tokens, stream), delay
+
+    def _wait(self, futures: Any, timeout: Optional[float], cancel: Optional[CancelToken]) -> Set[Future]:
+        """Wait until one of futures is done (or timeout); raise if cancel fires first"""
+        if cancel is None:
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            return done
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            cancel.check()
+            left = CancelToken.POLL_INTERVAL if deadline is None else min(CancelToken.POLL_INTERVAL, deadline - time.monotonic())
+            done, _ = wait(futures, timeout=max(0.0, left), return_when=FIRST_COMPLETED)
+            if done or (deadline is not None and time.monotonic() >= deadline):
+                return done
+
+    def _can_hedge(self) -> bool:
+        return self.hedge_delay > 0 and len(self.deployments) > 1
+
+    def _take_hedge(self) -> bool:
+        """Count a hedge if the budget allows one more"""
+        with self._lock:
+            if self._stats["hedges"] + 1 > self.hedge_max_ratio * self._stats["requests"]:
+                return False
+            self._stats["hedges"] += 1
+        return True
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """Threads that send sync requests while the caller waits for the first answer"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    workers = 2 * sum(d.rate_limiter.max_concurrency for d in self.deployments)
+                    self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="openai-hedge")
+        return self._executor
+
+    def _discard(self, future: Future, discard: Optional[Callable[[Any], None]]):
+        """Free the result of a sync request nobody waits for (it lost a hedge or was cancelled)"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        result, permit, _ = future.result()
+        try:
+            if discard is not None:
+                discard(result)
+        finally:
+            permit.release()
+
+    def _adiscard(self, task: "asyncio.Task", discard: Optional[Callable[[Any], Awaitable[None]]]):
+        """Free the result of an async request that lost a hedge (it finished before it was cancelled)"""
+        if task.cancelled() or task.exception() is not None:
+            return
+        result, permit, _ = task.result()
+        permit.release()
+        if discard is not None:
+            asyncio.ensure_future(discard(result))
+
+class PrimedStream:
+    """
+    A chat completion stream whose first content chunk has already been read
+
+    Reading up to the first token inside the routed request makes time to
+    first token the latency that routing and hedging compare, and lets a
+    connection that fails before answering be retried elsewhere.
+    """
+
+    def __init__(self, stream: Any, has_content: Callable[[Any], bool], cancel: CancelToken = None):
+        """
+        Args:
+            stream: Chat completion stream
+            has_content: Whether a chunk carries content
+            cancel: Closes the stream (the HTTP response) if cancelled while waiting for the first token
+        """
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._buffered: List[Any] = []
+        unregister = cancel.on_cancel(self.close) if cancel is not None else None
+        try:
+            for chunk in self._iterator:
+                self._buffered.append(chunk)
+                if has_content(chunk):
+                    break
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            if unregister is not None:
+                unregister()
+
+    def __iter__(self) -> Iterator[Any]:
+        while self._buffered:
+            yield self._buffered.pop(0)
+        yield from self._iterator
+
+    def close(self):
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+class AsyncPrimedStream:
+    """Async variant of PrimedStream; create it with ``await AsyncPrimedStream.open(...)``"""
+
+    def __init__(self, stream: Any, iterator: AsyncIterator[Any], buffered: List[Any]):
+        self._stream = stream
+        self._iterator = iterator
+        self._buffered = buffered
+
+    @classmethod
+    async def open(cls, stream: Any, has_content: Callable[[Any], bool]) -> "AsyncPrimedStream":
+        iterator = stream.__aiter__()
+        buffered = []
+        try:
+            while True:
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                buffered.append(chunk)
+                if has_content(chunk):
+                    break
+        except BaseException:
+            await stream.close()
+            raise
+        return cls(stream, iterator, buffered)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        while self._buffered:
+            yield self._buffered.pop(0)
+        async for chunk in self._iterator:
+            yield chunk
+
+    async def close(self):
+        await self._stream.close()
+
+def metric_slug(name: str) -> str:
+    """Deployment name usable in a metric name"""
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name).strip("_").lower()
@@ -0,0 +1,492 @@
+"""
+Conversation session store
+The single source of truth for chat history: compact records in a per-session ring buffer,
+idle eviction, a global memory cap, and an optional SQLite (WAL) backend so sessions survive restarts
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+from history import SUMMARIZED_KEY, TOKENS_KEY
+
+logger = logging.getLogger(__name__)
+
+# Session ids are generated here and may come back through the page URL
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Rough per-record cost on top of the content string (slotted object + deque slot)
+RECORD_OVERHEAD_BYTES = 120
+SESSION_OVERHEAD_BYTES = 1024
+
+class Message:
+    """
+    One transcript entry
+
+    A slotted record instead of a dict. It supports the item access that
+    HistoryManager uses (role, content and its private bookkeeping keys), so
+    records can be selected and counted without being copied.
+    """
+
+    __slots__ = ("seq", "role", "content", "context", "tokens", "summarized", "changed")
+
+    def __init__(self, seq: int, role: str, content: str, context: bool = True):
+        self.seq = seq
+        self.role = sys.intern(role)
+        self.content = content
+        self.context = context  # False for messages only shown in the UI (introductions, notices)
+        self.tokens = None
+        self.summarized = False
+        # Bookkeeping set after the record was written, for a persistent backend to write again
+        self.changed = False
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        if key == TOKENS_KEY:
+            return self.tokens
+        if key == SUMMARIZED_KEY:
+            return self.summarized
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key == TOKENS_KEY:
+            self.tokens = value
+        elif key == SUMMARIZED_KEY:
+            self.summarized = value
+        else:
+            raise KeyError(key)
+        self.changed = True
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def size(self) -> int:
+        return RECORD_OVERHEAD_BYTES + sys.getsizeof(self.content)
+
+class Session:
+    """
+    One conversation: the persona, the rolling summary and the transcript
+
+    ``messages`` keeps at most ``max_messages`` records; the oldest fall off
+    the ring buffer. Records from ``context_start`` on (with ``context`` set)
+    are the history sent to the model; older ones are only shown in the UI.
+    """
+
+    def __init__(self, session_id: str, max_messages: int):
+        self.id = session_id
+        self.persona_file: Optional[str] = None
+        # Snapshot version and rendered system prompt the conversation started with; kept until it resets
+        self.persona_version: Optional[int] = None
+        self.system_prompt: Optional[str] = None
+        self.summary: Optional[str] = None
+        self.context_start = 0
+        self.next_seq = 0
+        self.messages: Deque[Message] = deque()
+        self.max_messages = max_messages
+        self.last_access = 0.0
+        self.size = SESSION_OVERHEAD_BYTES
+        # Size the store last counted for this session
+        self.accounted = 0
+        # Messages not yet written by a persistent backend
+        self.unsaved: List[Message] = []
+
+    def append(self, role: str, content: str, context: bool = True) -> Message:
+        """Add a message, dropping the oldest one if the ring buffer is full"""
+        message = Message(self.next_seq, role, content, context)
+        self.next_seq += 1
+        self._push(message)
+        self.unsaved.append(message)
+        return message
+
+    def _push(self, message: Message):
+        if len(self.messages) >= self.max_messages:
+            self.size -= self.messages.popleft().size()
+        self.messages.append(message)
+        self.size += message.size()
+
+    def context_messages(self) -> List[Message]:
+        """Messages sent to the model as history, oldest first"""
+        selected = []
+        for message in reversed(self.messages):
+            if message.seq < self.context_start:
+                break
+            if message.context:
+                selected.append(message)
+        selected.reverse()
+        return selected
+
+    def transcript(self, since_seq: int = 0) -> List[Message]:
+        """Messages shown in the UI with a sequence number of at least since_seq"""
+        if since_seq <= 0:
+            return list(self.messages)
+        selected = []
+        for message in reversed(self.messages):
+            if message.seq < since_seq:
+                break
+            selected.append(message)
+        selected.reverse()
+        return selected
+
+    def clear(self):
+        """Forget the transcript and summary (the persona stays)"""
+        self.messages.clear()
+        self.unsaved.clear()
+        self.summary = None
+        self.context_start = self.next_seq
+        self.size = SESSION_OVERHEAD_BYTES
+
+class SessionStore:
+    """
+    In-memory session store
+
+    Sessions idle for ``idle_ttl`` seconds are evicted, and the least recently
+    used sessions are evicted while the estimated size of all transcripts
+    exceeds ``memory_cap_bytes``. Evicted sessions are gone; SQLiteSessionStore
+    keeps them on disk so they can be resumed.
+    """
+
+    def __init__(self, max_messages: int = 200, idle_ttl: float = 3600.0,
+                 memory_cap_bytes: int = 256 * 1024 * 1024, sweep_interval: float = 30.0,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            max_messages: Ring buffer size per session
+            idle_ttl: Seconds without access before a session is evicted
+            memory_cap_bytes: Estimated size of all sessions above which the least recently used are evicted
+            sweep_interval: Minimum seconds between idle sweeps (done opportunistically on access)
+            clock: Wall clock, injectable for tests
+        """
+        self.max_messages = max(2, max_messages)
+        self.idle_ttl = idle_ttl
+        self.memory_cap_bytes = memory_cap_bytes
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._size = 0
+        self._last_sweep = clock()
+        self.created = 0
+        self.resumed = 0
+        self.evicted_idle = 0
+        self.evicted_memory = 0
+
+    def open(self, session_id: str = None) -> Session:
+        """
+        Return a session, resuming or creating it as needed
+
+        Args:
+            session_id: Id of an existing session (e.g. from the page URL);
+                a new id is generated if it is missing or malformed
+
+        Returns:
+            The session, marked as accessed now
+        """
+        if not session_id or not SESSION_ID_PATTERN.match(session_id):
+            session_id = uuid.uuid4().hex
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                session = Session(session_id, self.max_messages)
+                session.last_access = self._clock()
+                self.created += 1
+                self._track(session)
+            return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Return an existing session (from memory or the backend), or None"""
+        if not session_id or not SESSION_ID_PATTERN.match(session_id):
+            return None
+        with self._lock:
+            self._sweep_if_due()
+            session = self._sessions.get(session_id)
+            if session is not None and self.shared:
+                # Another worker may have changed it since; read the stored copy
+                self._size -= self._sessions.pop(session_id).accounted
+                session = None
+            if session is None:
+                session = self._load(session_id)
+                if session is None:
+                    return None
+                self.resumed += 1
+                self._track(session)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_access = self._clock()
+            return session
+
+    def save(self, session: Session):
+        """Record changes made to a session and enforce the memory cap"""
+        with self._lock:
+            self._persist(session)
+            session.unsaved.clear()
+            if self._sessions.get(session.id) is session:
+                self._account(session)
+                self._enforce_cap(keep=session.id)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._size -= session.accounted
+            self._remove(session_id)
+
+    def evict_idle(self) -> int:
+        """Evict sessions idle for longer than idle_ttl; return how many were evicted"""
+        with self._lock:
+            self._last_sweep = self._clock()
+            cutoff = self._last_sweep - self.idle_ttl
+            idle = [session_id for session_id, session in self._sessions.items() if session.last_access < cutoff]
+            for session_id in idle:
+                self._size -= self._sessions.pop(session_id).accounted
+            self.evicted_idle += len(idle)
+            self._purge_expired()
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle sessions")
+        return len(idle)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "messages": sum(len(session.messages) for session in self._sessions.values()),
+                "bytes": self._size,
+                "created": self.created,
+                "resumed": self.resumed,
+                "evicted_idle": self.evicted_idle,
+                "evicted_memory": self.evicted_memory,
+            }
+
+    def _track(self, session: Session):
+        self._sessions[session.id] = session
+        self._account(session)
+        self._enforce_cap(keep=session.id)
+
+    def _account(self, session: Session):
+        self._size += session.size - session.accounted
+        session.accounted = session.size
+
+    def _sweep_if_due(self):
+        if self._clock() - self._last_sweep >= self.sweep_interval:
+            self.evict_idle()
+
+    def _enforce_cap(self, keep: str):
+        while self._size > self.memory_cap_bytes and len(self._sessions) > 1:
+            session_id, session = next(iter(self._sessions.items()))
+            if session_id == keep:
+                self._sessions.move_to_end(session_id)
+                continue
+            del self._sessions[session_id]
+            self._size -= session.accounted
+            self.evicted_memory += 1
+
+    # Persistence hooks, no-ops for the in-memory store
+
+    shared = False
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        return None
+
+    def _persist(self, session: Session):
+        pass
+
+    def _remove(self, session_id: str):
+        pass
+
+    def _purge_expired(self):
+        pass
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store backed by a local SQLite database in WAL mode
+
+    Memory works like SessionStore, but evicted sessions stay on disk and are
+    loaded again on the next open(), including after a worker restart. Only
+    new messages (and the token counts and summary flags HistoryManager set
+    on older ones) are written on save. Rows are deleted once a session has
+    been idle for ``retention`` seconds. Pinned system prompts are stored once
+    per distinct prompt.
+
+    With ``shared`` set, every open() re-reads the session from the database,
+    so several worker processes can serve the same session in turn (requests
+    for one session must not overlap).
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS sessions ("
+        " id TEXT PRIMARY KEY, persona_file TEXT, summary TEXT,"
+        " context_start INTEGER NOT NULL, next_seq INTEGER NOT NULL, updated REAL NOT NULL,"
+        " persona_version INTEGER, prompt_hash TEXT)",
+        "CREATE TABLE IF NOT EXISTS messages ("
+        " session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL,"
+        " context INTEGER NOT NULL, tokens INTEGER, summarized INTEGER NOT NULL DEFAULT 0,"
+        " PRIMARY KEY (session_id, seq)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS prompts (hash TEXT PRIMARY KEY, text TEXT NOT NULL) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)",
+    )
+    # Columns added since the first schema, for databases created before them
+    ADDED_COLUMNS = {
+        "messages": {
+            "tokens": "tokens INTEGER",
+            "summarized": "summarized INTEGER NOT NULL DEFAULT 0",
+        },
+        "sessions": {
+            "persona_version": "persona_version INTEGER",
+            "prompt_hash": "prompt_hash TEXT",
+        },
+    }
+
+    def __init__(self, path: str, retention: float = 7 * 24 * 3600.0, shared: bool = False, **kwargs: Any):
+        """
+        Args:
+            path: Database file (created if missing)
+            retention: Seconds of inactivity after which a session is deleted from disk
+            shared: Re-read sessions on every open() because other processes write them too
+            **kwargs: SessionStore settings
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        self.retention = retention
+        self.shared = shared
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # One connection guarded by the store lock; WAL lets other workers read while one writes
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+        self._migrate()
+        logger.info(f"Session store: SQLite database {path}")
+
+    def _migrate(self):
+        for table, added in self.ADDED_COLUMNS.items():
+            columns = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+            for name, definition in added.items():
+                if name not in columns:
+                    try:
+                        self._db.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+                    except sqlite3.OperationalError as e:
+                        # Another worker added it first
+                        if "duplicate column" not in str(e):
+                            raise
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        row = self._db.execute(
+            "SELECT persona_file, summary, context_start, next_seq, persona_version, prompts.text FROM sessions"
+            " LEFT JOIN prompts ON prompts.hash = sessions.prompt_hash WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        session = Session(session_id, self.max_messages)
+        (session.persona_file, session.summary, session.context_start, session.next_seq,
+         session.persona_version, session.system_prompt) = row
+        rows = self._db.execute(
+            "SELECT seq, role, content, context, tokens, summarized FROM messages"
+            " WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+            (session_id, self.max_messages)
+        ).fetchall()
+        for seq, role, content, context, tokens, summarized in reversed(rows):
+            message = Message(seq, role, content, bool(context))
+            message.tokens = tokens
+            message.summarized = bool(summarized)
+            session._push(message)
+        return session
+
+    def _persist(self, session: Session):
+        first_seq = session.messages[0].seq if session.messages else session.next_seq
+        pending = {message.seq: message for message in session.unsaved if message.seq >= first_seq}
+        for message in session.messages:
+            if message.changed:
+                pending[message.seq] = message
+        prompt_hash = None
+        if session.system_prompt is not None:
+            prompt_hash = hashlib.sha256(session.system_prompt.encode("utf-8")).hexdigest()
+        with self._db:
+            self._db.execute("BEGIN")
+            if prompt_hash is not None:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO prompts (hash, text) VALUES (?, ?)", (prompt_hash, session.system_prompt)
+                )
+            self._db.execute(
+                "INSERT INTO sessions (id, persona_file, summary, context_start, next_seq, updated,"
+                " persona_version, prompt_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET"
+                " persona_file = excluded.persona_file, summary = excluded.summary,"
+                " context_start = excluded.context_start, next_seq = excluded.next_seq, updated = excluded.updated,"
+                " persona_version = excluded.persona_version, prompt_hash = excluded.prompt_hash",
+                (session.id, session.persona_file, session.summary, session.context_start,
+                 session.next_seq, self._clock(), session.persona_version, prompt_hash)
+            )
+            # Rows that fell off the ring buffer (or were cleared) are deleted
+            self._db.execute("DELETE FROM messages WHERE session_id = ? AND seq < ?", (session.id, first_seq))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO messages (session_id, seq, role, content, context, tokens, summarized)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._rows(session.id, pending.values())
+            )
+        for message in pending.values():
+            message.changed = False
+
+    def _rows(self, session_id: str, messages: Iterable[Message]) -> Iterable[tuple]:
+        for message in messages:
+            yield (session_id, message.seq, message.role, message.content, int(message.context),
+                   message.tokens, int(message.summarized))
+
+    def _remove(self, session_id: str):
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _purge_expired(self):
+        cutoff = self._clock() - self.retention
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "DELETE FROM messages WHERE session_id IN (SELECT id FROM sessions WHERE updated < ?)", (cutoff,)
+            )
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (cutoff,))
+            self._db.execute(
+                "DELETE FROM prompts WHERE hash NOT IN"
+                " (SELECT prompt_hash FROM sessions WHERE prompt_hash IS NOT NULL)"
+            )
+
+def create_session_store(default_backend: str = "memory", shared: bool = False) -> SessionStore:
+    """
+    Build the session store selected by PERSONA_SESSION_STORE (memory or sqlite)
+
+    Args:
+        default_backend: Backend used when PERSONA_SESSION_STORE is not set
+        shared: Whether other processes use the same SQLite database (see SQLiteSessionStore)
+    """
+    settings = {
+        "max_messages": int(os.getenv("PERSONA_SESSION_MAX_MESSAGES", "200")),
+        "idle_ttl": float(os.getenv("PERSONA_SESSION_IDLE_SECONDS", "3600")),
+        "memory_cap_bytes": int(float(os.getenv("PERSONA_SESSION_MEMORY_MB", "256")) * 1024 * 1024),
+    }
+    backend = os.getenv("PERSONA_SESSION_STORE", default_backend).lower()
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            os.getenv("PERSONA_SESSION_DB", "sessions.db"),
+            retention=float(os.getenv("PERSONA_SESSION_RETENTION_SECONDS", str(7 * 24 * 3600))),
+            shared=shared,
+            **settings
+        )
+    if backend != "memory":
+        logger.warning(f"Unknown PERSONA_SESSION_STORE '{backend}', using memory")
+    return SessionStore(**settings)
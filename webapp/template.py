@@ -0,0 +1,147 @@
+"""
+Compiled prompt templates
+Parses ``{{placeholder}}`` templates once into literal segments and slots rendered in a single pass
+"""
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# {{key}} or {{key|default text}}; dotted keys read nested mappings ({{company.size}})
+PLACEHOLDER_PATTERN = re.compile(r"\{\{\s*([A-Za-z_][\w.]*)\s*(?:\|([^}]*))?\}\}")
+
+# Persona keys that configure the app rather than describe the persona
+NON_PROMPT_KEYS = frozenset({"response_cache"})
+
+EMPTY_LIST_TEXT = "None specified"
+
+# Prompt layouts (PERSONA_PROMPT_LAYOUT) and their template files in templates/
+# "inline" weaves persona fields through the instructions; "prefix" puts the shared,
+# persona-independent instructions first so every persona's prompt starts with the same text
+PROMPT_LAYOUTS = {
+    "inline": "prompt-template.txt",
+    "prefix": "prompt-template-prefix.txt",
+}
+
+def template_filename(layout: str = None) -> str:
+    """Template file of a prompt layout (PERSONA_PROMPT_LAYOUT when not given)"""
+    layout = (layout or os.getenv("PERSONA_PROMPT_LAYOUT", "inline")).strip().lower()
+    if layout not in PROMPT_LAYOUTS:
+        raise ValueError(f"Unknown prompt layout '{layout}'; expected one of: {', '.join(PROMPT_LAYOUTS)}")
+    return PROMPT_LAYOUTS[layout]
+
+# Text used when a persona omits one of the standard fields
+DEFAULT_PERSONA_VALUES = {
+    "name": "Unknown",
+    "role": "Unknown Role",
+    "industry": "Unknown Industry",
+    "pain_points": [],
+    "goals": [],
+    "tech_maturity": "Unknown",
+    "tone": "Professional",
+    "sample_dialogue": "",
+}
+
+class Slot:
+    """A placeholder in a compiled template"""
+
+    __slots__ = ("key", "path", "default")
+
+    def __init__(self, key: str, default: Optional[str] = None):
+        self.key = key
+        self.path = key.split(".")
+        self.default = default
+
+    def lookup(self, values: Dict[str, Any]) -> Any:
+        """Return the value for this slot, or None if the persona does not define it"""
+        value: Any = values
+        for part in self.path:
+            if not isinstance(value, dict) or part not in value:
+                return None
+            value = value[part]
+        return value
+
+def format_value(value: Any) -> str:
+    """
+    Format a persona value for the prompt
+
+    Lists are joined with commas ("None specified" if empty), mappings become
+    "key: value" pairs and everything else is converted with str().
+    """
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return EMPTY_LIST_TEXT
+        return ", ".join(format_value(item) for item in value)
+    if isinstance(value, dict):
+        return ", ".join(f"{key}: {format_value(item)}" for key, item in value.items())
+    return str(value)
+
+class CompiledTemplate:
+    """
+    A template split into literal segments and slots
+
+    ``parts`` alternates between literal strings and Slot objects, so rendering
+    is a single join instead of one full copy of the template per placeholder.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parts: List[Any] = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(source):
+            if match.start() > position:
+                self.parts.append(source[position:match.start()])
+            default = match.group(2)
+            self.parts.append(Slot(match.group(1), default.strip() if default is not None else None))
+            position = match.end()
+        if position < len(source):
+            self.parts.append(source[position:])
+
+        self.slots = [part for part in self.parts if isinstance(part, Slot)]
+        self.keys: Set[str] = {slot.path[0] for slot in self.slots}
+
+        # Braces left over after compilation are almost always typos, e.g. {{ name } or {{first-name}}
+        leftovers = PLACEHOLDER_PATTERN.sub("", source)
+        if "{{" in leftovers or "}}" in leftovers:
+            logger.warning("Prompt template contains malformed placeholders; they are rendered verbatim")
+
+    def render(self, values: Dict[str, Any], defaults: Dict[str, str] = None) -> str:
+        """
+        Render the template
+
+        Args:
+            values: Persona configuration
+            defaults: Fallback text per key, used when the template gives no default
+
+        Returns:
+            Rendered text; slots with neither a value nor a default render as ""
+        """
+        defaults = defaults or {}
+        rendered = []
+        for part in self.parts:
+            if part.__class__ is str:
+                rendered.append(part)
+                continue
+            value = part.lookup(values)
+            if value is None:
+                # An inline {{key|default}} wins over the builder's default for the key
+                value = part.default if part.default is not None else defaults.get(part.key, "")
+            rendered.append(format_value(value))
+        return "".join(rendered)
+
+    def check(self, values: Dict[str, Any], defaults: Dict[str, str] = None) -> Tuple[List[str], List[str]]:
+        """
+        Compare the template's placeholders with a persona's keys
+
+        Returns:
+            Tuple of (placeholders with no value or default, persona keys the template never uses)
+        """
+        defaults = defaults or {}
+        unknown = sorted({
+            slot.key for slot in self.slots
+            if slot.default is None and slot.key not in defaults and slot.lookup(values) is None
+        })
+        unused = sorted(key for key in values if key not in self.keys and key not in NON_PROMPT_KEYS)
+        return unknown, unused
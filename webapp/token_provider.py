@@ -0,0 +1,183 @@
+"""
+Cached Entra ID token provider
+Caches the access token used by the Azure OpenAI client and refreshes it ahead of expiry
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Scope used to request tokens for Azure OpenAI
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+class CachedTokenProvider:
+    """
+    Callable token provider for ``AzureOpenAI(azure_ad_token_provider=...)``
+
+    The token returned by the credential is cached until shortly before its
+    ``expires_on``. Inside the refresh window (``refresh_margin`` seconds before
+    expiry) callers keep receiving the cached token while a single background
+    thread fetches a new one; after a failed background refresh, the next one
+    waits ``refresh_backoff`` seconds so an Entra ID outage does not cost a
+    credential call per request. Once the token is expired (or missing)
+    callers block, but only one of them calls the credential; the others wait
+    for its result.
+
+    The credential only needs a ``get_token(scope)`` method returning an object
+    with ``token`` and ``expires_on`` attributes, so tests can pass a fake one.
+    """
+
+    def __init__(self, credential: Any, scope: str = COGNITIVE_SERVICES_SCOPE,
+                 refresh_margin: float = 300.0, min_validity: float = 30.0, refresh_backoff: float = 30.0,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            credential: Azure credential (e.g. DefaultAzureCredential)
+            scope: Scope the token is requested for
+            refresh_margin: Seconds before expiry at which a background refresh starts
+            min_validity: Seconds before expiry at which the cached token is no
+                longer handed out and callers wait for a fresh one
+            refresh_backoff: Seconds after a failed background refresh before the next one starts
+            clock: Time source returning epoch seconds (overridable in tests)
+        """
+        self.credential = credential
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self.min_validity = min(min_validity, refresh_margin)
+        self.refresh_backoff = refresh_backoff
+        self._clock = clock
+
+        self._token = None
+        self._state_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._background_refresh_running = False
+        # Clock time before which no background refresh is started (after a failure)
+        self._retry_after = 0.0
+
+        self._metrics = {
+            "cache_hits": 0,
+            "refreshes": 0,
+            "background_refreshes": 0,
+            "refresh_failures": 0,
+            "refreshes_deferred": 0,
+            "last_refresh_seconds": 0.0,
+            "max_refresh_seconds": 0.0,
+            "total_refresh_seconds": 0.0,
+        }
+
+    def __call__(self) -> str:
+        return self.get_token()
+
+    def get_token(self) -> str:
+        """
+        Return a valid access token, refreshing it if needed
+
+        Returns:
+            Bearer token string
+        """
+        token = self._token
+        now = self._clock()
+
+        if token is not None and now < token.expires_on - self.refresh_margin:
+            self._count("cache_hits")
+            return token.token
+
+        if token is not None and now < token.expires_on - self.min_validity:
+            # Refresh-ahead: hand out the current token while a new one is fetched
+            self._count("cache_hits")
+            if now < self._retry_after:
+                self._count("refreshes_deferred")
+            else:
+                self._start_background_refresh()
+            return token.token
+
+        with metrics.span("token_acquire_blocking"):
+            return self._refresh_blocking()
+
+    async def get_token_async(self) -> str:
+        """
+        Async variant for ``AsyncAzureOpenAI``; never blocks the event loop
+
+        A usable cached token is returned directly (refresh-ahead still happens
+        in the background thread); otherwise the blocking refresh runs in a
+        worker thread.
+        """
+        token = self._token
+        if token is not None and self._clock() < token.expires_on - self.min_validity:
+            return self.get_token()
+        return await asyncio.to_thread(self.get_token)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return a snapshot of the refresh metrics"""
+        with self._state_lock:
+            snapshot = dict(self._metrics)
+        token = self._token
+        snapshot["expires_in_seconds"] = max(0.0, token.expires_on - self._clock()) if token is not None else 0.0
+        return snapshot
+
+    def _refresh_blocking(self) -> str:
+        """Fetch a new token, single-flighting concurrent callers"""
+        with self._refresh_lock:
+            # Another caller may have refreshed while we were waiting for the lock
+            token = self._token
+            if token is not None and self._clock() < token.expires_on - self.min_validity:
+                self._count("cache_hits")
+                return token.token
+            return self._fetch().token
+
+    def _start_background_refresh(self):
+        """Start a background refresh unless one is already running"""
+        with self._state_lock:
+            if self._background_refresh_running:
+                return
+            self._background_refresh_running = True
+
+        thread = threading.Thread(target=self._background_refresh, name="token-refresh", daemon=True)
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            with self._refresh_lock:
+                token = self._token
+                # Skip if a blocking caller already refreshed the token
+                if token is not None and self._clock() < token.expires_on - self.refresh_margin:
+                    return
+                self._fetch()
+                self._count("background_refreshes")
+        except Exception as e:
+            # The cached token is still valid; a caller retries once the backoff has passed
+            self._retry_after = self._clock() + self.refresh_backoff
+            logger.warning(f"Background token refresh failed: {e}; retrying in {self.refresh_backoff:.0f}s")
+        finally:
+            with self._state_lock:
+                self._background_refresh_running = False
+
+    def _fetch(self) -> Any:
+        """Call the credential and store the new token (caller holds _refresh_lock)"""
+        started = time.perf_counter()
+        try:
+            token = self.credential.get_token(self.scope)
+        except Exception as e:
+            self._count("refresh_failures")
+            logger.error(f"Failed to acquire Entra ID token: {e}")
+            raise
+        elapsed = time.perf_counter() - started
+        metrics.observe("token_refresh", elapsed)
+
+        self._token = token
+        with self._state_lock:
+            self._metrics["refreshes"] += 1
+            self._metrics["last_refresh_seconds"] = elapsed
+            self._metrics["total_refresh_seconds"] += elapsed
+            self._metrics["max_refresh_seconds"] = max(self._metrics["max_refresh_seconds"], elapsed)
+        logger.info(f"Acquired Entra ID token in {elapsed * 1000:.0f} ms")
+        return token
+
+    def _count(self, name: str):
+        with self._state_lock:
+            self._metrics[name] += 1
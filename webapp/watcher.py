@@ -0,0 +1,138 @@
+"""
+File change watcher for hot reload
+Polls file signatures (mtime, size) and, on Linux, wakes up early on inotify events
+"""
+import logging
+import os
+import select
+import sys
+import threading
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# inotify_init1 flags and the events that mean "a file was written, created, moved or deleted"
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_WATCH_MASK = 0x2 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200
+
+Signature = Tuple[Tuple[str, int, int], ...]
+
+class _Inotify:
+    """Minimal ctypes binding used only to wake the poller early"""
+
+    def __init__(self, directories: List[str]):
+        # Imported here: ctypes is only needed on Linux, once the watcher starts
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for directory in directories:
+            if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_WATCH_MASK) < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout: float) -> bool:
+        """Block until an event arrives or timeout passes; return True on events"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+class FileWatcher:
+    """
+    Calls ``on_change`` after files under the watched paths change
+
+    The signature (name, mtime, size) of every watched file is compared every
+    ``poll_interval`` seconds; inotify, when available, only shortens the wait.
+    Bursts of changes (editors writing several files, git checkouts) are
+    coalesced by waiting ``debounce`` seconds for the signature to settle.
+    """
+
+    def __init__(self, paths: List[str], on_change: Callable[[], None],
+                 poll_interval: float = 2.0, debounce: float = 0.5):
+        """
+        Args:
+            paths: Files and directories to watch (directories are not recursed)
+            on_change: Called from the watcher thread after a change settled
+            poll_interval: Seconds between signature checks
+            debounce: Seconds the signature must stay unchanged before on_change runs
+        """
+        self.paths = paths
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._inotify: Optional[_Inotify] = None
+
+    def start(self) -> "FileWatcher":
+        if sys.platform.startswith("linux"):
+            directories = sorted({path if os.path.isdir(path) else os.path.dirname(path) for path in self.paths})
+            try:
+                self._inotify = _Inotify(directories)
+            except (OSError, AttributeError) as e:
+                logger.info(f"inotify unavailable, polling only: {e}")
+        self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {', '.join(self.paths)} for changes")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def signature(self) -> Signature:
+        """Current (name, mtime_ns, size) of every watched file"""
+        entries = []
+        for path in self.paths:
+            try:
+                if os.path.isdir(path):
+                    for entry in os.scandir(path):
+                        if entry.is_file():
+                            stat = entry.stat()
+                            entries.append((entry.path, stat.st_mtime_ns, stat.st_size))
+                else:
+                    stat = os.stat(path)
+                    entries.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                continue
+        return tuple(sorted(entries))
+
+    def _wait(self, timeout: float):
+        if self._inotify is not None:
+            self._inotify.wait(timeout)
+        else:
+            self._stop.wait(timeout)
+
+    def _run(self):
+        last = self.signature()
+        while not self._stop.is_set():
+            self._wait(self.poll_interval)
+            current = self.signature()
+            if current == last:
+                continue
+            # Let the burst of writes finish before reloading
+            while not self._stop.wait(self.debounce):
+                settled = self.signature()
+                if settled == current:
+                    break
+                current = settled
+            last = current
+            try:
+                self.on_change()
+            except Exception as e:
+                logger.error(f"Reload after file change failed: {e}")